@@ -19,6 +19,7 @@ export async function createReport({
   inputType,
   is_embedded_at_local,
   local_llm_address,
+  batch_mode,
 }: {
   input: string;
   question: string;
@@ -33,6 +34,7 @@ export async function createReport({
   inputType: string;
   is_embedded_at_local: boolean;
   local_llm_address?: string;
+  batch_mode: boolean;
 }): Promise<void> {
   try {
     const response = await fetch(`${process.env.NEXT_PUBLIC_API_BASEPATH}/admin/reports`, {
@@ -55,6 +57,7 @@ export async function createReport({
         inputType,
         is_embedded_at_local,
         local_llm_address,
+        batch_mode,
       }),
     });
 
@@ -25,6 +25,9 @@ export function AISettingsSection({
   promptSettings,
   isEmbeddedAtLocal,
   onEmbeddedAtLocalChange,
+  isBatchMode,
+  onBatchModeChange,
+  isBatchModeDisabled,
   fetchLocalLLMModels,
 }: {
   provider: string;
@@ -57,6 +60,9 @@ export function AISettingsSection({
   };
   isEmbeddedAtLocal: boolean;
   onEmbeddedAtLocalChange: (checked: boolean | "indeterminate") => void;
+  isBatchMode: boolean;
+  onBatchModeChange: (checked: boolean | "indeterminate") => void;
+  isBatchModeDisabled?: () => boolean;
 }) {
   const modelOptions = getCurrentModels();
 
@@ -172,6 +178,27 @@ export function AISettingsSection({
         </Field.HelperText>
       </Field.Root>
 
+      <Field.Root>
+        <Checkbox
+          checked={isBatchMode}
+          onCheckedChange={(details) => {
+            const { checked } = details;
+            if (checked === "indeterminate") return;
+            onBatchModeChange(checked);
+          }}
+          disabled={isBatchModeDisabled?.()}
+        >
+          Batch APIでまとめて実行する
+        </Checkbox>
+        <Field.HelperText>
+          意見の抽出とラベリングのリクエストをBatch APIでまとめて実行し、APIの利用料金を削減します。
+          結果が返るまでに最大で24時間かかるため、急がない大規模なレポートに向いています。
+          {isBatchModeDisabled?.() && (
+            <span style={{ color: "red" }}>※ OpenAIとAzure以外のプロバイダーでは利用できません</span>
+          )}
+        </Field.HelperText>
+      </Field.Root>
+
       <Field.Root>
         <Field.Label>抽出プロンプト</Field.Label>
         <Textarea
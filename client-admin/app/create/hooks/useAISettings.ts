@@ -21,6 +21,7 @@ const STORAGE_KEYS = {
   WORKERS: `${STORAGE_KEY_PREFIX}workers`,
   LOCAL_LLM_ADDRESS: `${STORAGE_KEY_PREFIX}local_llm_address`,
   IS_EMBEDDED_AT_LOCAL: `${STORAGE_KEY_PREFIX}is_embedded_at_local`,
+  IS_BATCH_MODE: `${STORAGE_KEY_PREFIX}is_batch_mode`,
 };
 
 // LocalLLMのデフォルトアドレスを定数化
@@ -114,6 +115,10 @@ export function useAISettings() {
     getFromStorage<boolean>(STORAGE_KEYS.IS_EMBEDDED_AT_LOCAL, false),
   );
 
+  const [isBatchMode, setIsBatchMode] = useState<boolean>(() =>
+    getFromStorage<boolean>(STORAGE_KEYS.IS_BATCH_MODE, false),
+  );
+
   const [localLLMAddress, setLocalLLMAddress] = useState<string>(() =>
     getFromStorage<string>(STORAGE_KEYS.LOCAL_LLM_ADDRESS, DEFAULT_LOCAL_LLM_ADDRESS),
   );
@@ -141,6 +146,10 @@ export function useAISettings() {
     saveToStorage(STORAGE_KEYS.IS_EMBEDDED_AT_LOCAL, isEmbeddedAtLocal);
   }, [isEmbeddedAtLocal]);
 
+  useEffect(() => {
+    saveToStorage(STORAGE_KEYS.IS_BATCH_MODE, isBatchMode);
+  }, [isBatchMode]);
+
   useEffect(() => {
     if (provider === "openrouter") {
       setOpenRouterModels(OPENROUTER_MODELS);
@@ -152,6 +161,11 @@ export function useAISettings() {
     if (provider === "local") {
       setIsEmbeddedAtLocal(true);
     }
+
+    // Batch APIに対応していないプロバイダーではBatch APIモードを使えない
+    if (provider === "local" || provider === "openrouter") {
+      setIsBatchMode(false);
+    }
   }, [provider]);
 
   /**
@@ -305,6 +319,14 @@ export function useAISettings() {
     return provider === "local";
   };
 
+  /**
+   * Batch APIモードの設定が無効化されるべきかどうか
+   * Batch APIに対応しているのはOpenAIとAzureのみ
+   */
+  const isBatchModeDisabled = () => {
+    return provider !== "openai" && provider !== "azure";
+  };
+
   /**
    * AI設定をリセット
    */
@@ -314,6 +336,7 @@ export function useAISettings() {
     setWorkers(30);
     setIsPubcomMode(true);
     setIsEmbeddedAtLocal(false);
+    setIsBatchMode(false);
     setLocalLLMAddress(DEFAULT_LOCAL_LLM_ADDRESS);
     setOpenRouterModels([]);
     setLocalLLMModels([]);
@@ -323,6 +346,7 @@ export function useAISettings() {
     saveToStorage(STORAGE_KEYS.WORKERS, 30);
     saveToStorage(STORAGE_KEYS.LOCAL_LLM_ADDRESS, DEFAULT_LOCAL_LLM_ADDRESS);
     saveToStorage(STORAGE_KEYS.IS_EMBEDDED_AT_LOCAL, false);
+    saveToStorage(STORAGE_KEYS.IS_BATCH_MODE, false);
   };
 
   return {
@@ -331,6 +355,7 @@ export function useAISettings() {
     workers,
     isPubcomMode,
     isEmbeddedAtLocal,
+    isBatchMode,
     localLLMAddress,
     handleProviderChange,
     handleModelChange,
@@ -344,8 +369,10 @@ export function useAISettings() {
     getCurrentModels,
     requiresConnectionSettings,
     isEmbeddedAtLocalDisabled,
+    isBatchModeDisabled,
     resetAISettings,
     setIsEmbeddedAtLocal,
+    setIsBatchMode,
     fetchLocalLLMModels,
   };
 }
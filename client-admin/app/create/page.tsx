@@ -165,6 +165,7 @@ export default function Page() {
         inputType: inputData.inputType,
         is_embedded_at_local: aiSettings.isEmbeddedAtLocal,
         local_llm_address: aiSettings.provider === "local" ? aiSettings.localLLMAddress : undefined,
+        batch_mode: aiSettings.isBatchMode,
       });
 
       toaster.create({
@@ -291,6 +292,12 @@ export default function Page() {
               getCurrentModels={aiSettings.getCurrentModels}
               requiresConnectionSettings={aiSettings.requiresConnectionSettings}
               isEmbeddedAtLocalDisabled={aiSettings.isEmbeddedAtLocalDisabled}
+              isBatchMode={aiSettings.isBatchMode}
+              onBatchModeChange={(checked) => {
+                if (checked === "indeterminate") return;
+                aiSettings.setIsBatchMode(checked);
+              }}
+              isBatchModeDisabled={aiSettings.isBatchModeDisabled}
               promptSettings={promptSettings}
             />
           </Presence>
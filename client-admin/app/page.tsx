@@ -44,23 +44,27 @@ import { useEffect, useState } from "react";
 const stepKeys = [
   "extraction",
   "embedding",
+  "category_classification",
   "hierarchical_clustering",
   "hierarchical_initial_labelling",
   "hierarchical_merge_labelling",
   "hierarchical_overview",
   "hierarchical_aggregation",
+  "hierarchical_comment_export",
   "hierarchical_visualization",
 ];
 
 const steps = [
   { id: 1, title: "抽出", description: "データの抽出" },
   { id: 2, title: "埋め込み", description: "埋め込み表現の生成" },
-  { id: 3, title: "意見グループ化", description: "意見グループ化の実施" },
-  { id: 4, title: "初期ラベリング", description: "初期ラベルの付与" },
-  { id: 5, title: "統合ラベリング", description: "ラベルの統合" },
-  { id: 6, title: "概要生成", description: "概要の作成" },
-  { id: 7, title: "集約", description: "結果の集約" },
-  { id: 8, title: "可視化", description: "結果の可視化" },
+  { id: 3, title: "カテゴリ分類", description: "意見のカテゴリ分類" },
+  { id: 4, title: "意見グループ化", description: "意見グループ化の実施" },
+  { id: 5, title: "初期ラベリング", description: "初期ラベルの付与" },
+  { id: 6, title: "統合ラベリング", description: "ラベルの統合" },
+  { id: 7, title: "概要生成", description: "概要の作成" },
+  { id: 8, title: "集約", description: "結果の集約" },
+  { id: 9, title: "CSV出力", description: "元コメント付きCSVの出力" },
+  { id: 10, title: "可視化", description: "結果の可視化" },
 ];
 
 // ステータスに応じた表示内容を返す関数
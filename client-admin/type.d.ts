@@ -78,6 +78,13 @@ type Config = {
     prompt: string; // LLM に渡すプロンプト
     model: string; // 使用するモデル名
   };
+  category_classification?: {
+    workers: number; // 並列処理数
+    categories: Record<string, Record<string, string>>; // 分類情報
+    category_batch_size: number; // カテゴリ処理のバッチサイズ
+    source_code: string; // 分類スクリプト
+    model: string; // 使用するモデル名
+  };
   hierarchical_clustering: {
     cluster_nums: number[]; // クラスタ数のリスト
     source_code: string; // クラスタリングのスクリプト
@@ -107,6 +114,9 @@ type Config = {
     hidden_properties: Record<string, string[]>; // 非表示プロパティ情報
     source_code: string; // 集約スクリプト
   };
+  hierarchical_comment_export?: {
+    source_code: string; // CSV出力スクリプト
+  };
   hierarchical_visualization: {
     replacements: Record<string, string[]>;
     source_code: string; // 集約スクリプト
@@ -0,0 +1,86 @@
+"""hierarchical_clusteringの各モードの処理時間とクラスタの品質を比較するベンチマーク
+
+比較するモード:
+    standard: UMAPの2次元座標でKMeans（デフォルト）
+    large: PCAで次元を減らしてからUMAP、UMAPの座標でMiniBatchKMeans
+    large+embedding: PCAで次元を減らした埋め込み空間でMiniBatchKMeans（UMAPは座標のためだけに計算）
+
+pipelineディレクトリで実行する:
+    python -m benchmarks.clustering_benchmark --samples 20000 --dim 1536
+    python -m benchmarks.clustering_benchmark --embeddings outputs/<dataset>
+
+--embeddingsを指定した場合はそのレポートの埋め込みを、指定しない場合は正解のクラスタを持つ合成データを使う。
+品質は、最も細かい階層のクラスタについて元の埋め込み空間でのシルエット係数（コサイン距離）で比較し、
+合成データの場合は正解とのARI（調整ランド指数）も出力する。
+"""
+
+import argparse
+import time
+
+import numpy as np
+from sklearn.datasets import make_blobs
+from sklearn.metrics import adjusted_rand_score, silhouette_score
+from steps.hierarchical_clustering import cluster_embeddings
+
+from services.embedding_store import load_embeddings
+
+
+def make_synthetic_embeddings(
+    n_samples: int, dim: int, n_topics: int, spread: float, seed: int = 0
+) -> tuple[np.ndarray, np.ndarray]:
+    """トピックごとにまとまった、単位ベクトルに正規化した埋め込みの合成データを作る（spreadが大きいほど重なりが大きい）"""
+    embeddings, topics = make_blobs(
+        n_samples=n_samples, n_features=dim, centers=n_topics, cluster_std=spread, random_state=seed
+    )
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings.astype(np.float32), topics
+
+
+MODES = {
+    "standard": {},
+    "large": {"pca_components": 50, "kmeans_batch_size": 4096},
+    "large+embedding": {"pca_components": 50, "kmeans_batch_size": 4096, "cluster_space": "embedding"},
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the standard and large clustering modes.")
+    parser.add_argument("--embeddings", help="Report output directory containing embeddings.npy.")
+    parser.add_argument("--samples", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--topics", type=int, default=30)
+    parser.add_argument("--spread", type=float, default=12.0)
+    parser.add_argument("--cluster-nums", type=int, nargs="+", default=[3, 6, 30])
+    parser.add_argument("--silhouette-samples", type=int, default=5000)
+    args = parser.parse_args()
+
+    topics = None
+    if args.embeddings:
+        embeddings, _ = load_embeddings(args.embeddings)
+        embeddings = np.asarray(embeddings)
+    else:
+        embeddings, topics = make_synthetic_embeddings(args.samples, args.dim, args.topics, args.spread)
+    print(f"embeddings: {embeddings.shape[0]} x {embeddings.shape[1]}")
+
+    labels = {}
+    for mode, options in MODES.items():
+        started = time.perf_counter()
+        _, results = cluster_embeddings(embeddings, cluster_nums=list(args.cluster_nums), **options)
+        elapsed = time.perf_counter() - started
+        labels[mode] = results[max(args.cluster_nums)]
+        silhouette = silhouette_score(
+            embeddings,
+            labels[mode],
+            metric="cosine",
+            sample_size=min(args.silhouette_samples, len(embeddings)),
+            random_state=0,
+        )
+        line = f"{mode:>16}: {elapsed:.1f}s, silhouette {silhouette:.3f}"
+        if topics is not None:
+            line += f", ARI vs topics {adjusted_rand_score(topics, labels[mode]):.3f}"
+        line += f", ARI vs standard {adjusted_rand_score(labels['standard'], labels[mode]):.3f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
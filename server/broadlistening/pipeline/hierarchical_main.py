@@ -1,11 +1,13 @@
 import argparse
 import sys
 
-from hierarchical_utils import initialization, run_step, termination
+from hierarchical_utils import initialization, run_steps, termination
+from steps.category_classification import category_classification
 from steps.embedding import embedding
 from steps.extraction import extraction
 from steps.hierarchical_aggregation import hierarchical_aggregation
 from steps.hierarchical_clustering import hierarchical_clustering
+from steps.hierarchical_comment_export import hierarchical_comment_export
 from steps.hierarchical_initial_labelling import hierarchical_initial_labelling
 from steps.hierarchical_merge_labelling import hierarchical_merge_labelling
 from steps.hierarchical_overview import hierarchical_overview
@@ -38,6 +40,11 @@ def parse_arguments():
         action="store_true",
         help="Skip the html output.",
     )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Submit LLM requests of extraction and labelling steps through the provider's Batch API.",
+    )
     return parser.parse_args()
 
 
@@ -54,18 +61,28 @@ def main():
         new_argv.append("-skip-interaction")
     if args.without_html:
         new_argv.append("--without-html")
+    if args.batch:
+        new_argv.append("--batch")
 
     config = initialization(new_argv)
 
     try:
-        run_step("extraction", extraction, config)
-        run_step("embedding", embedding, config)
-        run_step("hierarchical_clustering", hierarchical_clustering, config)
-        run_step("hierarchical_initial_labelling", hierarchical_initial_labelling, config)
-        run_step("hierarchical_merge_labelling", hierarchical_merge_labelling, config)
-        run_step("hierarchical_overview", hierarchical_overview, config)
-        run_step("hierarchical_aggregation", hierarchical_aggregation, config)
-        run_step("hierarchical_visualization", hierarchical_visualization, config)
+        # hierarchical_specs.jsonの依存関係に従い、依存のないステップは並行して実行する
+        run_steps(
+            {
+                "extraction": extraction,
+                "embedding": embedding,
+                "category_classification": category_classification,
+                "hierarchical_clustering": hierarchical_clustering,
+                "hierarchical_initial_labelling": hierarchical_initial_labelling,
+                "hierarchical_merge_labelling": hierarchical_merge_labelling,
+                "hierarchical_overview": hierarchical_overview,
+                "hierarchical_aggregation": hierarchical_aggregation,
+                "hierarchical_comment_export": hierarchical_comment_export,
+                "hierarchical_visualization": hierarchical_visualization,
+            },
+            config,
+        )
 
         termination(config)
     except Exception as e:
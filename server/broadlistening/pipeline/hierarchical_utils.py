@@ -1,11 +1,25 @@
+import hashlib
 import json
 import os
+import threading
+import time
 import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
 
+from services.adaptive_concurrency import get_concurrency_stats
+from services.batch_api import configure_batch_mode, get_batch_stats
+from services.content_store import param_value, put_content, slim_params
+from services.llm import get_client_metrics
+from services.llm_cache import get_response_cache_stats
+from services.rate_limiter import get_rate_limiter_stats
+
 with open("./hierarchical_specs.json") as f:
     specs = json.load(f)
 
+# ソースコード・プロンプトの本文を保存する場所（ステータスファイルにはハッシュだけを書き出す）
+CONTENT_STORE_DIR = "outputs/.content_store"
+
 
 def validate_config(config):
     if "input" not in config:
@@ -22,6 +36,7 @@ def validate_config(config):
         "is_embedded_at_local",
         "provider",
         "local_llm_address",
+        "batch_mode",
     ]
     step_names = [x["step"] for x in specs]
     for key in config:
@@ -36,28 +51,86 @@ def validate_config(config):
                 raise Exception(f"Unknown option '{key}' for step '{step_spec['step']}' in config")
 
 
-def decide_what_to_run(config, previous):
+def _previous_jobs(config):
     # find last previously tracked jobs (digging in case previous run failed)
-    previous_jobs = []
     _previous = config.get("previous", None)
     while _previous and _previous.get("previous", None) is not None:
         _previous = _previous["previous"]
-    if _previous:
-        previous_jobs = _previous.get("completed_jobs", []) + _previous.get("previously_completed_jobs", [])
+    if not _previous:
+        return []
+    return _previous.get("completed_jobs", []) + _previous.get("previously_completed_jobs", [])
+
+
+def _tracked_params(step):
+    keys = list(step["dependencies"]["params"])
+    if step.get("use_llm", False):
+        # automagically track prompt and model for llm jobs
+        keys += ["prompt", "model"]
+    return keys
+
+
+_file_hashes: dict[tuple[str, int, int], str] = {}
+
+
+def _file_hash(path):
+    # 同じファイルを何度もハッシュしないよう、(パス, サイズ, 更新時刻)ごとに結果を覚えておく
+    if not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    if key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        _file_hashes[key] = digest.hexdigest()
+    return _file_hashes[key]
+
+
+def input_fingerprint(config, step):
+    """ステップの入力（追跡するパラメータ・プロンプト・モデルと、ステップが読み込むファイル）のハッシュを返す
+
+    読み込むファイルは、依存するステップの出力ファイル（filename）に加えて、dependencies.filesに書かれた
+    出力ディレクトリ内のファイルと、dependencies.inputがtrueの場合は入力CSV。
+    上流のステップが再実行されても出力が変わらなければ同じ値になるため、再実行の要否の判定に使う。
+    """
+    output_dir = config["output_dir"]
+    step_specs = {spec["step"]: spec for spec in specs}
+    spec = step_specs[step]
+    dependencies = spec["dependencies"]
+    inputs = {dep: _file_hash(f"outputs/{output_dir}/{step_specs[dep]['filename']}") for dep in dependencies["steps"]}
+    for filename in dependencies.get("files", []):
+        inputs[filename] = _file_hash(f"outputs/{output_dir}/{filename}")
+    if dependencies.get("input", False):
+        inputs["input"] = _file_hash(f"inputs/{config['input']}.csv")
+    params = {key: param_value(config[step], key) for key in _tracked_params(spec)}
+    payload = json.dumps({"params": params, "inputs": inputs}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def decide_what_to_run(config, previous):
+    previous_jobs = _previous_jobs(config)
 
     # utility function to check if params changed
 
     def different_params(step):
-        keys = step["dependencies"]["params"]
-        if step.get("use_llm", False):
-            # automagically track prompt and model for llm jobs
-            keys += ["prompt", "model"]
+        keys = _tracked_params(step)
         match = [x for x in previous_jobs if x["step"] == step["step"]]
         prev = match[0]["params"]
         next = config[step["step"]]
-        diff = [key for key in keys if prev.get(key, None) != next.get(key, None)]
+
+        def previous_value(key):
+            # 前回の実行時にはなかったオプションは、デフォルト値で実行されていたとみなす
+            if key not in prev and f"{key}_hash" not in prev:
+                return step.get("options", {}).get(key)
+            return param_value(prev, key)
+
+        # プロンプトはハッシュで比較する
+        diff = [key for key in keys if previous_value(key) != param_value(next, key)]
         for key in diff:
-            print(f"(!) {step} step parameter '{key}' changed from '{prev.get(key)}' to '{next.get(key)}'")
+            print(
+                f"(!) {step} step parameter '{key}' changed from '{previous_value(key)}' to '{param_value(next, key)}'"
+            )
         return diff
 
     # figure out which steps need to run and why
@@ -66,6 +139,7 @@ def decide_what_to_run(config, previous):
         stepname = step["step"]
         run = True
         reason = None
+        check_inputs = False
         found_prev = len([x for x in previous_jobs if x["step"] == step["step"]]) > 0
 
         if stepname == "hierarchical_visualization" and config.get("without-html", False):
@@ -85,17 +159,29 @@ def decide_what_to_run(config, previous):
         else:
             deps = step["dependencies"]["steps"]
             changing_deps = [x["step"] for x in plan if (x["step"] in deps and x["run"])]
-            if len(changing_deps) > 0:
+            previous_job = [x for x in previous_jobs if x["step"] == stepname][0]
+            previous_fingerprint = previous_job.get("input_fingerprint")
+            if previous_job.get("incomplete"):
+                # 前回の結果が一部欠けている場合（抽出に失敗したコメントがあるなど）は、入力が同じでも実行し直す
+                reason = f"previous run was incomplete: {previous_job['incomplete']}"
+            elif len(changing_deps) > 0:
                 reason = "some dependent steps will re-run: " + (", ".join(changing_deps))
+                # 上流のステップの出力が変わらなければ、実行直前に入力のハッシュを比較してスキップする
+                check_inputs = previous_fingerprint is not None
             else:
                 diff_params = different_params(step)
                 if len(diff_params) > 0:
                     print("diff_params", diff_params)
                     reason = "some parameters changed: " + ", ".join(diff_params)
+                elif previous_fingerprint is not None and previous_fingerprint != input_fingerprint(config, stepname):
+                    reason = "input data changed"
                 else:
                     run = False
                     reason = "nothing changed"
-        plan.append({"step": stepname, "run": run, "reason": reason})
+        entry = {"step": stepname, "run": run, "reason": reason}
+        if check_inputs:
+            entry["check_inputs"] = True
+        plan.append(entry)
     return plan
 
 
@@ -118,6 +204,8 @@ def initialization(sysargv):
             config["skip-interaction"] = True
         if option == "--without-html":
             config["without-html"] = True
+        if option == "--batch":
+            config["batch_mode"] = True
 
     output_dir = config["output_dir"]
 
@@ -136,6 +224,14 @@ def initialization(sysargv):
         else:
             print("Hum, the last Job crashed a while ago...Proceeding!")
 
+    # Batch APIモードでは、抽出・ラベリングのLLMリクエストをバッチジョブにまとめて実行する
+    configure_batch_mode(
+        config.get("batch_mode", False),
+        work_dir=f"outputs/{output_dir}/batch_jobs",
+        provider=config.get("provider", "openai"),
+        poll_interval=float(os.getenv("LLM_BATCH_POLL_INTERVAL", "30")),
+    )
+
     # set default LLM model
     if "model" not in config:
         config["model"] = "gpt-4o-mini"
@@ -147,13 +243,17 @@ def initialization(sysargv):
             config[step] = {}
         # set default option values
         if "options" in step_spec:
+            # options_fromを指定したステップは、そのステップの設定にある同名のオプションを既定値にする
+            # （カテゴリ分類のオプションは、以前と同じく抽出ステップの設定に書けるようにする）
+            inherited = config.get(step_spec.get("options_from"), {})
             for key, value in step_spec["options"].items():
                 if key not in config[step]:
-                    config[step][key] = value
+                    config[step][key] = inherited.get(key, value)
         # try and include source code
         try:
             with open(f"steps/{step}.py") as f:
                 config[step]["source_code"] = f.read()
+            put_content(CONTENT_STORE_DIR, config[step]["source_code"])
         except Exception:
             print(f"Warning: could not find source code for step '{step}'")
         # resolve common options for llm-based jobs
@@ -163,6 +263,7 @@ def initialization(sysargv):
                 file = config.get(step).get("prompt_file", "default")
                 with open(f"prompts/{step}/{file}.txt") as f:
                     config[step]["prompt"] = f.read()
+            put_content(CONTENT_STORE_DIR, config[step]["prompt"])
             # resolve model
             if "model" not in config.get(step):
                 if "model" in config:
@@ -195,24 +296,178 @@ def initialization(sysargv):
     return config
 
 
-# (!) make sure to always use this function to update status...
-def update_status(config, updates):
+# 進捗の更新をファイルに書き出す最小間隔（秒）。進捗の更新はこの間隔でまとめて書き出す
+PROGRESS_WRITE_INTERVAL = 1.0
+# 進捗の更新中でも、ロック（lock_until）が切れないようにステータス全体を書き出す間隔（秒）
+STATUS_WRITE_INTERVAL = 60.0
+# 管理画面から頻繁に参照される、進捗の表示に必要な項目だけを書き出すファイルのキー
+PROGRESS_KEYS = [
+    "status",
+    "current_job",
+    "current_job_started",
+    "current_job_progress",
+    "current_jop_tasks",
+    "running_jobs",
+    "total_token_usage",
+    "token_usage_input",
+    "token_usage_output",
+    "error",
+    "lock_until",
+]
+
+# ステップの種類ごとに同時に実行できるステップ数
+# llm: LLM・埋め込みAPIを呼ぶステップ（リクエストの同時実行数とレート制限は共有のスケジューラ・リミッターで制御する）
+# cpu: クラスタリングやビルドなど計算の重いステップ、io: ファイルの読み書きが中心のステップ
+RESOURCE_SLOTS = {"llm": 2, "cpu": 1, "io": 1}
+
+_last_writes = {"status": 0.0, "progress": 0.0}
+# 並行して実行されるステップからのステータスの更新を直列化する
+_status_lock = threading.RLock()
+
+
+def _write_json_atomic(path, data, **kwargs):
+    # 一時ファイルに書き出してからrenameし、読み込み側が書き込み途中のファイルを読まないようにする
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(data, file, **kwargs)
+    os.replace(tmp_path, path)
+
+
+def _write_progress(config):
+    output_dir = config["output_dir"]
+    progress = {key: config[key] for key in PROGRESS_KEYS if key in config}
+    _write_json_atomic(f"outputs/{output_dir}/hierarchical_progress.json", progress)
+    _last_writes["progress"] = time.monotonic()
+
+
+def _slim_status(status):
+    # 各ステップのソースコード・プロンプトをハッシュに置き換えたコピーを返す（本文はCONTENT_STORE_DIRに保存済み）
+    # 本文をそのまま記録していた以前のステータスファイルを読み込んだpreviousも同様に置き換える
+    step_names = {step_spec["step"] for step_spec in specs}
+    slim = {}
+    # memo: 並行して実行中のステップがconfigにキーを追加することがあるため、先にコピーしてから走査する
+    for key, value in list(status.items()):
+        if key in step_names and isinstance(value, dict):
+            slim[key] = slim_params(value)
+        elif key in ("completed_jobs", "previously_completed_jobs"):
+            slim[key] = [{**job, "params": slim_params(job.get("params", {}))} for job in value]
+        elif key == "previous" and isinstance(value, dict):
+            slim[key] = _slim_status(value)
+        else:
+            slim[key] = value
+    return slim
+
+
+def _write_status(config):
     output_dir = config["output_dir"]
+    config["lock_until"] = (datetime.now() + timedelta(minutes=5)).isoformat()
+    _write_json_atomic(f"outputs/{output_dir}/hierarchical_status.json", _slim_status(config), indent=2)
+    _last_writes["status"] = time.monotonic()
+    _write_progress(config)
+
+
+def _apply_updates(config, updates):
     for key, value in updates.items():
         if value is None and key in config:
             del config[key]
         else:
             config[key] = value
-    config["lock_until"] = (datetime.now() + timedelta(minutes=5)).isoformat()
-    with open(f"outputs/{output_dir}/hierarchical_status.json", "w") as file:
-        json.dump(config, file, indent=2)
 
 
-def update_progress(config, incr=None, total=None):
-    if total is not None:
-        update_status(config, {"current_job_progress": 0, "current_jop_tasks": total})
-    elif incr is not None:
-        update_status(config, {"current_job_progress": config["current_job_progress"] + incr})
+# (!) make sure to always use this function to update status...
+def update_status(config, updates):
+    with _status_lock:
+        _apply_updates(config, updates)
+        _write_status(config)
+
+
+def _sync_current_job(config):
+    """running_jobsから、以前の形式の実行中のステップの項目（current_jobなど）を更新する
+
+    並行して実行中のステップのうち、hierarchical_specs.jsonで最も前にあるステップを表す
+    （それより前のステップは全て完了している）。実行中のステップがなければ最後のcurrent_jobを残す。
+    """
+    running = config.get("running_jobs", {})
+    step = next((spec["step"] for spec in specs if spec["step"] in running), None)
+    if step is None:
+        _apply_updates(config, {"current_job_progress": None, "current_jop_tasks": None})
+        return
+    job = running[step]
+    _apply_updates(
+        config,
+        {
+            "current_job": step,
+            "current_job_started": job["started"],
+            "current_job_progress": job.get("progress"),
+            "current_jop_tasks": job.get("tasks"),
+        },
+    )
+
+
+def update_progress(config, step, incr=None, total=None):
+    """実行中のステップの進捗を更新する
+
+    進捗はステップごとにrunning_jobsに記録し、hierarchical_progress.jsonにPROGRESS_WRITE_INTERVAL秒に1回だけ書き出す。
+    ステータス全体（hierarchical_status.json）はロックを延長するためにSTATUS_WRITE_INTERVAL秒に1回だけ書き出す。
+    """
+    if total is None and incr is None:
+        return
+    with _status_lock:
+        job = config.setdefault("running_jobs", {}).setdefault(step, {"started": datetime.now().isoformat()})
+        # 実行中のステップの実効同時実行数も合わせて書き出す
+        config["llm_concurrency"] = get_concurrency_stats()
+        if total is not None:
+            job.update({"progress": 0, "tasks": total})
+            _sync_current_job(config)
+            # 進捗の開始は必ず書き出す
+            _write_progress(config)
+            return
+        job["progress"] += incr
+        _sync_current_job(config)
+        now = time.monotonic()
+        if now - _last_writes["status"] >= STATUS_WRITE_INTERVAL:
+            _write_status(config)
+        elif now - _last_writes["progress"] >= PROGRESS_WRITE_INTERVAL or job["progress"] >= job["tasks"]:
+            _write_progress(config)
+
+
+def record_token_usage(config, step, token_input, token_output, token_total):
+    """ステップのLLMリクエストのトークン使用量を、全体とステップごとの合計に加える
+
+    並行して実行されるステップのトークン使用量が混ざらないよう、ステップごとの合計（step_token_usage）から
+    completed_jobsのtoken_usageを記録する。
+    """
+    with _status_lock:
+        config["total_token_usage"] = config.get("total_token_usage", 0) + token_total
+        config["token_usage_input"] = config.get("token_usage_input", 0) + token_input
+        config["token_usage_output"] = config.get("token_usage_output", 0) + token_output
+        usage = config.setdefault("step_token_usage", {}).setdefault(step, {"input": 0, "output": 0, "total": 0})
+        usage["input"] += token_input
+        usage["output"] += token_output
+        usage["total"] += token_total
+
+
+def recorded_output_hash(config, step):
+    """ステップの出力ファイルのハッシュを、今回または前回の実行のcompleted_jobsに記録した値から返す
+
+    ファイル全体を読み直さずに出力の内容を識別するために使う。記録がない場合はNoneを返す。
+    """
+    with _status_lock:
+        jobs = list(config.get("completed_jobs", []))
+    # 今回の実行で完了したステップの記録を優先する
+    for job in [*reversed(jobs), *_previous_jobs(config)]:
+        if job["step"] == step and job.get("output_hash"):
+            return job["output_hash"]
+    return None
+
+
+def mark_incomplete(config, step, reason):
+    """実行中のステップの結果が一部欠けていることを記録する
+
+    completed_jobsのincompleteに理由が記録され、次回の実行では入力が変わっていなくてもこのステップを実行し直す。
+    """
+    with _status_lock:
+        config.setdefault("incomplete_steps", {})[step] = reason
 
 
 def run_step(step, func, config):
@@ -221,41 +476,104 @@ def run_step(step, func, config):
     if not plan["run"]:
         print(f"Skipping '{step}'")
         return
+    fingerprint = input_fingerprint(config, step)
+    if plan.get("check_inputs"):
+        previous = [x for x in _previous_jobs(config) if x["step"] == step]
+        if previous and previous[0].get("input_fingerprint") == fingerprint:
+            with _status_lock:
+                plan.update({"run": False, "reason": "inputs unchanged after re-running dependent steps"})
+                _write_status(config)
+            print(f"Skipping '{step}' (inputs unchanged)")
+            return
     # update status before running...
-    update_status(
-        config,
-        {
-            "current_job": step,
-            "current_job_started": datetime.now().isoformat(),
-        },
-    )
+    started = datetime.now()
+    with _status_lock:
+        # 並行して実行中のステップごとに、開始時刻と進捗をrunning_jobsに記録する
+        config.setdefault("running_jobs", {})[step] = {"started": started.isoformat()}
+        _sync_current_job(config)
+        _write_status(config)
     print("Running step:", step)
     # run the step...
-    token_usage_before = config.get("total_token_usage", 0)
     func(config)
-    token_usage_after = config.get("total_token_usage", token_usage_before)
-    token_usage_step = token_usage_after - token_usage_before
     # update status after running...
-    update_status(
-        config,
-        {
-            "current_job_progress": None,
-            "current_jop_tasks": None,
-            "completed_jobs": config.get("completed_jobs", [])
-            + [
-                {
-                    "step": step,
-                    "completed": datetime.now().isoformat(),
-                    "duration": (
-                        datetime.fromisoformat(datetime.now().isoformat())
-                        - datetime.fromisoformat(config["current_job_started"])
-                    ).total_seconds(),
-                    "params": config[step],
-                    "token_usage": token_usage_step,  # ステップ毎のトークン使用量を追加
-                }
-            ],
-        },
-    )
+    step_spec = [x for x in specs if x["step"] == step][0]
+    job = {
+        "step": step,
+        "completed": datetime.now().isoformat(),
+        "duration": (datetime.now() - started).total_seconds(),
+        "params": slim_params(config[step]),
+        # 次回の実行で、入力が変わっていないかの判定に使う
+        "input_fingerprint": fingerprint,
+        "output_hash": _file_hash(f"outputs/{config['output_dir']}/{step_spec['filename']}"),
+    }
+    # memo: 他のステップも並行してcompleted_jobsなどを更新するため、読み出しから書き込みまでをロックの中で行う
+    with _status_lock:
+        # ステップ毎のトークン使用量（record_token_usageでステップごとに集計したもの）
+        job["token_usage"] = config.get("step_token_usage", {}).pop(step, {}).get("total", 0)
+        incomplete = config.get("incomplete_steps", {}).pop(step, None)
+        if incomplete:
+            job["incomplete"] = incomplete
+        config.get("running_jobs", {}).pop(step, None)
+        _sync_current_job(config)
+        _apply_updates(
+            config,
+            {
+                "completed_jobs": config.get("completed_jobs", []) + [job],
+                "llm_client_metrics": get_client_metrics(),
+                "llm_cache_stats": get_response_cache_stats(),
+                "llm_rate_limiter_stats": get_rate_limiter_stats(),
+                "llm_concurrency": get_concurrency_stats(),
+                "llm_batch_jobs": get_batch_stats(),
+            },
+        )
+        _write_status(config)
+
+
+def run_steps(step_funcs, config):
+    """hierarchical_specs.jsonのdependencies.stepsからDAGを作り、依存するステップが完了したものから並行して実行する
+
+    各ステップはrun_stepで実行するため、計画（plan）による実行・スキップの判定とステータスの更新は逐次実行と同じ。
+    ステップのresource（llm・cpu・io）ごとにRESOURCE_SLOTSの数までしか同時に実行しない。
+    いずれかのステップが失敗した場合は新しいステップを開始せず、実行中のステップの完了を待ってから例外を送出する。
+
+    Args:
+        step_funcs: {ステップ名: ステップの関数}。ここに含まれないステップへの依存は無視する
+        config: パイプラインの設定
+    """
+    step_specs = {spec["step"]: spec for spec in specs if spec["step"] in step_funcs}
+    dependencies = {
+        step: [dep for dep in spec["dependencies"]["steps"] if dep in step_specs] for step, spec in step_specs.items()
+    }
+    pending = list(step_specs)
+    done = set()
+    running = {}
+    in_use = dict.fromkeys(RESOURCE_SLOTS, 0)
+    error = None
+    with ThreadPoolExecutor(max_workers=sum(RESOURCE_SLOTS.values())) as executor:
+        while pending or running:
+            if error is None:
+                # hierarchical_specs.jsonの順に、依存が解決済みで枠の空いているステップを開始する
+                for step in list(pending):
+                    resource = step_specs[step].get("resource", "cpu")
+                    if all(dep in done for dep in dependencies[step]) and in_use[resource] < RESOURCE_SLOTS[resource]:
+                        pending.remove(step)
+                        in_use[resource] += 1
+                        running[executor.submit(run_step, step, step_funcs[step], config)] = (step, resource)
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step, resource = running.pop(future)
+                in_use[resource] -= 1
+                try:
+                    future.result()
+                    done.add(step)
+                except Exception as e:
+                    error = error or e
+    if error is not None:
+        raise error
+    if pending:
+        raise RuntimeError(f"Circular dependencies between steps: {', '.join(pending)}")
 
 
 def termination(config, error=None):
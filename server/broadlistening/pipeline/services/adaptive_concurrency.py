@@ -0,0 +1,172 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD方式で同時実行数の上限を自動調整するリミッター
+
+    - レイテンシが基準値のlatency_tolerance倍以内で成功している間は上限を増やす
+      （最初に過負荷を検知するまでは成功1回ごとに+1、以降は上限1回分の成功で+1）
+    - 429・5xx・タイムアウトを検知したら上限をdecrease_factor倍に減らす
+      （同じ過負荷で何度も減らさないよう、直近の減少から基準レイテンシ分は減らさない）
+
+    待機中のリクエストにはスレッドセーフに枠を渡すため、どのイベントループからでも利用できる。
+    """
+
+    def __init__(
+        self,
+        initial: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        latency_tolerance: float = 2.0,
+        decrease_factor: float = 0.5,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.limit = float(min(max(initial, min_limit), self.max_limit))
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self._slow_start = True
+        self._baseline_latency: float | None = None
+        self._last_decrease = 0.0
+        self._waiters: deque[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "overloaded": 0, "increases": 0, "decreases": 0}
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.in_flight < int(self.limit) and not self._waiters:
+                self.in_flight += 1
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    raise
+            # 枠を受け取った後にキャンセルされた場合は、受け取った枠を返す
+            if waiter[1].done() and not waiter[1].cancelled():
+                self._return_slot()
+            raise
+
+    def release(self, latency: float, overloaded: bool = False, succeeded: bool = True) -> None:
+        """リクエストの完了を記録し、上限を更新する
+
+        Args:
+            latency: リクエストにかかった秒数
+            overloaded: 429・5xx・タイムアウトなど、相手側の過負荷を示すエラーで終わった場合はTrue
+            succeeded: 正常に完了した場合はTrue（過負荷以外のエラーでは上限を変更しない）
+        """
+        with self._lock:
+            self.in_flight -= 1
+            self._stats["requests"] += 1
+            now = time.monotonic()
+            if overloaded:
+                self._stats["overloaded"] += 1
+                self._slow_start = False
+                if now - self._last_decrease >= (self._baseline_latency or 1.0):
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self._last_decrease = now
+                    self._stats["decreases"] += 1
+            elif succeeded:
+                if self._baseline_latency is None or latency < self._baseline_latency:
+                    self._baseline_latency = latency
+                else:
+                    # 基準値は最小値に近い値を保ちつつ、遅くなった状態が続く場合はゆっくり追従させる
+                    self._baseline_latency = self._baseline_latency * 0.99 + latency * 0.01
+                if latency <= self._baseline_latency * self.latency_tolerance and self.limit < self.max_limit:
+                    before = int(self.limit)
+                    self.limit = min(self.max_limit, self.limit + (1 if self._slow_start else 1 / self.limit))
+                    if int(self.limit) > before:
+                        self._stats["increases"] += 1
+            self._wake_waiters()
+
+    def _return_slot(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self._wake_waiters()
+
+    def _wake_waiters(self) -> None:
+        # memo: self._lockを保持した状態で呼ぶこと
+        while self._waiters and self.in_flight < int(self.limit):
+            loop, future = self._waiters.popleft()
+            self.in_flight += 1
+            loop.call_soon_threadsafe(self._grant, future)
+
+    def _grant(self, future: asyncio.Future) -> None:
+        # 待機側がすでにキャンセルされていた場合は、渡そうとした枠を返す
+        if future.done():
+            self._return_slot()
+        else:
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, is_overload_error):
+        """同時実行の枠を確保し、終了時に結果に応じて上限を更新するコンテキストマネージャ
+
+        Args:
+            is_overload_error: 例外を受け取り、過負荷を示すものならTrueを返す関数
+        """
+        await self.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.release(time.monotonic() - started, overloaded=is_overload_error(e), succeeded=False)
+            raise
+        except BaseException:
+            self.release(time.monotonic() - started, succeeded=False)
+            raise
+        else:
+            self.release(time.monotonic() - started)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "effective_concurrency": int(self.limit),
+                "in_flight": self.in_flight,
+                "waiting": len(self._waiters),
+                **self._stats,
+            }
+
+
+_limiter_settings = {"enabled": True, "initial": 4, "max_limit": 64}
+_limiters: dict[tuple[str, str], AdaptiveConcurrencyLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def configure_adaptive_concurrency(enabled: bool = True, initial: int = 4, max_limit: int = 64) -> None:
+    """適応的な同時実行数制御の設定を登録する関数（既存のリミッターは破棄される）"""
+    with _limiters_lock:
+        _limiter_settings.update({"enabled": enabled, "initial": initial, "max_limit": max_limit})
+        _limiters.clear()
+
+
+def get_concurrency_limiter(provider: str, model: str) -> AdaptiveConcurrencyLimiter | None:
+    """(provider, model)ごとに共有するAdaptiveConcurrencyLimiterを返す。無効化されている場合はNone"""
+    with _limiters_lock:
+        if not _limiter_settings["enabled"]:
+            return None
+        key = (provider, model)
+        if key not in _limiters:
+            _limiters[key] = AdaptiveConcurrencyLimiter(
+                initial=_limiter_settings["initial"], max_limit=_limiter_settings["max_limit"]
+            )
+        return _limiters[key]
+
+
+def get_concurrency_stats() -> dict[str, dict] | None:
+    """(provider:model)ごとの現在の実効同時実行数と統計を返す。リクエストがまだない場合はNone"""
+    with _limiters_lock:
+        limiters = {f"{p}:{m}": limiter for (p, m), limiter in _limiters.items()}
+    if not limiters:
+        return None
+    return {key: limiter.stats() for key, limiter in limiters.items()}
@@ -0,0 +1,176 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import uuid
+
+# Batch APIの1ジョブあたりの最大リクエスト数（OpenAIの上限）
+DEFAULT_MAX_REQUESTS = 50000
+DEFAULT_POLL_INTERVAL = 30.0
+DEFAULT_FLUSH_DELAY = 1.0
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchRequestError(RuntimeError):
+    """Batch APIで個別のリクエストが失敗した場合の例外"""
+
+
+class BatchCollector:
+    """並行して発行されたチャットリクエストを集め、OpenAI Batch API互換のエンドポイントでまとめて実行する
+
+    requestを呼ぶと、リクエストはクライアントごとに溜められ、flush_delay秒の間に新しいリクエストが来なくなった時点
+    （またはmax_requests件に達した時点）でバッチジョブとして送信される。
+    ジョブの完了をpoll_interval秒ごとに確認し、結果を各リクエストの呼び出し元に返す。
+    """
+
+    def __init__(
+        self,
+        work_dir: str | None = None,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        flush_delay: float = DEFAULT_FLUSH_DELAY,
+        max_requests: int = DEFAULT_MAX_REQUESTS,
+        completion_window: str = "24h",
+    ):
+        self.work_dir = work_dir
+        self.poll_interval = poll_interval
+        self.flush_delay = flush_delay
+        self.max_requests = max_requests
+        self.completion_window = completion_window
+        self._pending: dict[int, tuple[object, str, list]] = {}
+        self._timers: dict[int, asyncio.TimerHandle] = {}
+        self._jobs: list[dict] = []
+        self._tasks: set[asyncio.Task] = set()
+        self._lock = threading.Lock()
+
+    async def request(self, client, body: dict, endpoint: str = "/v1/chat/completions") -> dict:
+        """リクエストをバッチに追加し、完了後にレスポンスのbodyを返す
+
+        Args:
+            client: files/batchesのAPIを持つ非同期のOpenAIクライアント
+            body: エンドポイントに送るリクエストボディ
+            endpoint: バッチジョブのエンドポイント（Azureの場合は"/chat/completions"）
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = id(client)
+        _, _, items = self._pending.setdefault(key, (client, endpoint, []))
+        items.append((f"request-{uuid.uuid4().hex}", body, future))
+        if key in self._timers:
+            self._timers.pop(key).cancel()
+        if len(items) >= self.max_requests:
+            self._flush(key)
+        else:
+            # memo: 並行して発行されるリクエストを1つのジョブにまとめるため、少し待ってから送信する
+            self._timers[key] = loop.call_later(self.flush_delay, self._flush, key)
+        return await future
+
+    def _flush(self, key: int) -> None:
+        self._timers.pop(key, None)
+        client, endpoint, items = self._pending.pop(key)
+        task = asyncio.get_running_loop().create_task(self._run_job(client, endpoint, items))
+        # memo: 実行中のタスクがガベージコレクションされないよう参照を保持する
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_job(self, client, endpoint: str, items: list) -> None:
+        try:
+            results = await self._submit_and_wait(client, endpoint, items)
+        except Exception as e:
+            logging.error(f"Batch job failed: {e}")
+            for _, _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for custom_id, _, future in items:
+            if future.done():
+                continue
+            result = results.get(custom_id)
+            response = (result or {}).get("response") or {}
+            if response.get("status_code") == 200:
+                future.set_result(response["body"])
+            else:
+                error = (result or {}).get("error") or response.get("body") or "no result"
+                future.set_exception(BatchRequestError(f"Batch request {custom_id} failed: {error}"))
+
+    async def _submit_and_wait(self, client, endpoint: str, items: list) -> dict[str, dict]:
+        lines = [
+            json.dumps({"custom_id": custom_id, "method": "POST", "url": endpoint, "body": body}, ensure_ascii=False)
+            for custom_id, body, _ in items
+        ]
+        content = ("\n".join(lines) + "\n").encode("utf-8")
+        job = {"requests": len(items)}
+        with self._lock:
+            self._jobs.append(job)
+            job_index = len(self._jobs)
+        if self.work_dir:
+            # 送信したリクエストを後から確認できるよう、バッチジョブのファイルを残す
+            os.makedirs(self.work_dir, exist_ok=True)
+            with open(os.path.join(self.work_dir, f"batch_{job_index:03d}_input.jsonl"), "wb") as f:
+                f.write(content)
+
+        input_file = await client.files.create(file=(f"batch_{job_index:03d}.jsonl", content), purpose="batch")
+        batch = await client.batches.create(
+            input_file_id=input_file.id, endpoint=endpoint, completion_window=self.completion_window
+        )
+        job["batch_id"] = batch.id
+        print(f"Submitted batch job {batch.id} with {len(items)} requests")
+        while batch.status not in TERMINAL_STATUSES:
+            await asyncio.sleep(self.poll_interval)
+            batch = await client.batches.retrieve(batch.id)
+        job["status"] = batch.status
+        print(f"Batch job {batch.id} finished with status {batch.status}")
+
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            output = await client.files.content(file_id)
+            for line in output.text.splitlines():
+                if line.strip():
+                    result = json.loads(line)
+                    results[result["custom_id"]] = result
+        if batch.status != "completed" and not results:
+            raise RuntimeError(f"Batch job {batch.id} ended with status {batch.status}")
+        return results
+
+    def stats(self) -> list[dict]:
+        with self._lock:
+            return [dict(job) for job in self._jobs]
+
+
+_collector: BatchCollector | None = None
+# Batch APIに対応しているプロバイダー
+BATCH_API_PROVIDERS = ("openai", "azure")
+
+
+def configure_batch_mode(enabled: bool, work_dir: str | None = None, provider: str = "openai", **kwargs) -> None:
+    """Batch APIによる実行モードを設定する関数
+
+    Args:
+        enabled: Trueの場合、arequest_to_chat_aiのリクエストをBatch APIでまとめて実行する
+        work_dir: バッチジョブの入力ファイルを保存するディレクトリ
+        provider: パイプラインで使うLLMプロバイダー（Batch APIに対応していない場合はエラー）
+        **kwargs: BatchCollectorに渡す設定（poll_interval, flush_delay, max_requests, completion_window）
+    """
+    global _collector
+    if enabled and provider not in BATCH_API_PROVIDERS:
+        # memo: 実行後に全てのリクエストが失敗して抽出結果が空になるのではなく、開始前に設定の誤りとして止める
+        raise ValueError(
+            f"Batch API mode is not supported for provider '{provider}' (supported: {', '.join(BATCH_API_PROVIDERS)})"
+        )
+    _collector = BatchCollector(work_dir=work_dir, **kwargs) if enabled else None
+
+
+def get_batch_collector() -> BatchCollector | None:
+    """Batch APIモードが有効な場合はBatchCollectorを返す。無効な場合はNone"""
+    return _collector
+
+
+def is_batch_mode() -> bool:
+    return _collector is not None
+
+
+def get_batch_stats() -> list[dict] | None:
+    """送信したバッチジョブの一覧を返す。Batch APIモードが無効な場合はNone"""
+    return _collector.stats() if _collector is not None else None
@@ -1,10 +1,14 @@
-import concurrent.futures
+import asyncio
 import json
+import logging
 
 import pandas as pd
 from tqdm import tqdm
 
-from services.llm import request_to_openai
+from .llm import arequest_to_chat_ai, estimate_tokens, get_scheduler
+
+# 1リクエストあたりの推定トークン数の上限（プロンプトの固定部分は含まない）
+DEFAULT_BATCH_MAX_TOKENS = 2000
 
 BASE_CLASSIFICATION_PROMPT = """与えられた意見群をカテゴリに分類してください
 
@@ -112,51 +116,126 @@ def _parse_arg_result(classification_results: dict, arg_id: str, categories: lis
     return parsed_result
 
 
-def classify_batch_args(batch_args: pd.DataFrame, categories: dict, model: str) -> dict:
+def build_classification_batches(
+    args: pd.DataFrame, categories: dict[str, dict[str, str]], max_tokens: int, max_size: int
+) -> list[list[int]]:
+    """1リクエストあたりの推定トークン数がmax_tokens以下、件数がmax_size以下になるように意見の位置をまとめる
+
+    推定トークン数には、意見の行と、その意見に対して出力されるJSON（カテゴリ名と分類先の最長のもの）の両方を含める。
+    1件でmax_tokensを超える意見は単独のバッチにする。
+    """
+    # 意見1件あたりの出力は{"arg-id": {"カテゴリ": "分類先", ...}}になるため、カテゴリの数に比例する
+    output_tokens_per_arg = sum(
+        estimate_tokens(f'"{category}": "{max(values, key=len, default="")}", ')
+        for category, values in categories.items()
+    )
+    batches = []
+    current = []
+    current_tokens = 0
+    for position, (arg_id, argument) in enumerate(zip(args["arg-id"], args["argument"], strict=False)):
+        tokens = estimate_tokens(f"- {arg_id}: {argument}\n") + estimate_tokens(f'"{arg_id}": {{}}, ')
+        tokens += output_tokens_per_arg
+        if current and (len(current) >= max_size or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(position)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+async def classify_batch_args(
+    batch_args: pd.DataFrame,
+    categories: dict,
+    model: str,
+    provider: str = "openai",
+    local_llm_address: str | None = None,
+) -> dict:
+    """意見群をまとめて分類し、{arg-id: {カテゴリ: 分類先}}を返す
+
+    一部の意見の結果が含まれていない場合は、結果のない意見だけを再度分類する。
+    JSONとして読めない（出力が途中で切れた場合など）場合は、バッチを半分ずつに分けて再度分類する。
+    1件ずつにしても結果が得られない意見は結果に含めない。
+    """
     category_string = _build_categories_string(categories)
     batch_args_string = _build_batch_args_string(batch_args)
     prompt = BASE_CLASSIFICATION_PROMPT.format(categories_string=category_string, args_string=batch_args_string)
-    result = request_to_openai(
+    result, _, _, _ = await arequest_to_chat_ai(
         messages=[
             {"role": "system", "content": prompt},
         ],
         model=model,
         is_json=True,
+        provider=provider,
+        local_llm_address=local_llm_address,
     )
     try:
-        return json.loads(result)
+        parsed = json.loads(result)
     except json.JSONDecodeError:
-        return {}
+        parsed = {}
+    if not isinstance(parsed, dict):
+        parsed = {}
+
+    classified = {arg_id: parsed[arg_id] for arg_id in batch_args["arg-id"] if isinstance(parsed.get(arg_id), dict)}
+    missing = batch_args[~batch_args["arg-id"].isin(list(classified))]
+    if missing.empty:
+        return classified
+    if len(batch_args) == 1:
+        logging.warning(f"Failed to classify argument {batch_args['arg-id'].iloc[0]}: {result!r}")
+        return classified
+
+    if len(missing) < len(batch_args):
+        retries = [missing]
+    else:
+        # memo: 全件失敗したバッチを同じ大きさで再送すると同じ理由で失敗しやすいため、半分に分けて再試行する
+        half = len(batch_args) // 2
+        retries = [batch_args.iloc[:half], batch_args.iloc[half:]]
+    for retry_result in await asyncio.gather(
+        *[classify_batch_args(retry_args, categories, model, provider, local_llm_address) for retry_args in retries]
+    ):
+        classified.update(retry_result)
+    return classified
 
 
 def classify_args(args: pd.DataFrame, config, workers: int) -> pd.DataFrame:
-    batch_size = config["extraction"]["category_batch_size"]
+    options = config["category_classification"]
+    categories = options["categories"]
+    batches = build_classification_batches(
+        args,
+        categories,
+        max_tokens=options.get("category_batch_max_tokens", DEFAULT_BATCH_MAX_TOKENS),
+        max_size=options["category_batch_size"],
+    )
 
     classification_results = {}
-    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
-        batch_start_indices = range(0, len(args), batch_size)
-        future_to_batch = {
-            executor.submit(
-                classify_batch_args,
-                args.loc[batch_idx : batch_idx + batch_size],
-                config["extraction"]["categories"],
-                config["extraction"]["model"],
-            ): batch_idx
-            for batch_idx in batch_start_indices
-        }
-        for future in tqdm(
-            concurrent.futures.as_completed(future_to_batch),
-            total=len(batch_start_indices),
-            desc="Classifying arguments",
-        ):
-            result = future.result()
-            classification_results.update(result)
+    # 共有スケジューラにすべてのバッチを投入し、workers件ずつ並行実行する
+    with tqdm(total=len(batches), desc="Classifying arguments") as progress:
+        results = get_scheduler().map(
+            classify_batch_args,
+            [
+                {
+                    "batch_args": args.iloc[batch],
+                    "categories": categories,
+                    "model": options["model"],
+                    "provider": config.get("provider", "openai"),
+                    "local_llm_address": config.get("local_llm_address"),
+                }
+                for batch in batches
+            ],
+            max_concurrency=workers,
+            on_result=lambda _i, _result: progress.update(1),
+            batchable=True,
+        )
+    for result in results:
+        classification_results.update(result)
 
     # 結果をdataframeに変換し、argsにjoinする
     results = []
-    categories = list(config["extraction"]["categories"].keys())
+    category_names = list(categories.keys())
     for arg_id in args["arg-id"]:
-        arg_result = _parse_arg_result(classification_results, arg_id, categories)
+        arg_result = _parse_arg_result(classification_results, arg_id, category_names)
         results.append(arg_result)
     classification_results_df = pd.DataFrame(results)
     merged = args.merge(classification_results_df, on="arg-id", how="left")
@@ -0,0 +1,62 @@
+import hashlib
+import json
+import os
+
+
+def _sha256(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+class ClusterLabelCache:
+    """クラスタの内容をキーにラベリング結果を保存し、次回の実行で再利用するためのキャッシュ(JSON)
+
+    キーはクラスタに所属する意見(arg-idと本文)と、マージラベリングの場合は下位クラスタのラベルから作るため、
+    クラスタリングをやり直しても所属する意見が変わらなかったクラスタはラベリングをやり直さずに済む。
+    ラベリングの条件(プロンプト・モデル・サンプリング数)が異なるキャッシュは読み込まない。
+    保存時は今回の実行で使ったエントリだけを書き出すため、ファイルが際限なく大きくなることはない。
+    """
+
+    def __init__(self, path: str, prompt: str, model: str, sampling_num: int, enabled: bool = True):
+        self.path = path
+        self.fingerprint = _sha256(json.dumps([prompt, model, sampling_num], ensure_ascii=False))
+        self._previous: dict[str, dict] = {}
+        self._current: dict[str, dict] = {}
+        self.hits = 0
+        if enabled:
+            self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        if data.get("fingerprint") == self.fingerprint:
+            self._previous = data.get("labels", {})
+
+    @staticmethod
+    def cluster_key(arg_ids, arguments, child_labels=None) -> str:
+        """クラスタに所属する意見（と下位クラスタのラベル）から、並び順によらないキーを作る"""
+        lines = sorted(f"{arg_id}\t{argument}" for arg_id, argument in zip(arg_ids, arguments, strict=True))
+        if child_labels is not None:
+            lines += ["#"] + sorted(child_labels)
+        return _sha256("\n".join(lines))
+
+    def get(self, key: str) -> dict | None:
+        """前回の実行で同じ内容のクラスタに付けたラベリング結果を返す。見つからない場合はNone"""
+        value = self._previous.get(key)
+        if value is not None:
+            self._current[key] = value
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: dict) -> None:
+        self._current[key] = value
+
+    def save(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": self.fingerprint, "labels": self._current}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,112 @@
+import os
+from contextlib import nullcontext
+
+import joblib
+import numpy as np
+import scipy.sparse as sp
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from threadpoolctl import threadpool_limits
+
+CLUSTER_MODEL_FILENAME = "hierarchical_cluster_model.joblib"
+# クラスタ中心までの距離を計算する際に一度に扱う意見数（距離行列やコピーのメモリを抑える）
+ASSIGN_CHUNK_SIZE = 65536
+
+
+def save_cluster_model(output_dir: str, model: dict) -> None:
+    """fit済みのクラスタリングのモデル（PCA・UMAP・KMeans・リンケージなど）を保存する"""
+    path = os.path.join(output_dir, CLUSTER_MODEL_FILENAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        joblib.dump(model, f)
+    os.replace(tmp_path, path)
+
+
+def load_cluster_model(output_dir: str) -> dict | None:
+    """save_cluster_modelで保存したモデルを読み込む。見つからない・読み込めない場合はNone"""
+    path = os.path.join(output_dir, CLUSTER_MODEL_FILENAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            return joblib.load(f)
+    except Exception as e:
+        print(f"Failed to load cluster model {path}: {e}")
+        return None
+
+
+def fit_kmeans(
+    cluster_points: np.ndarray, n_clusters: int, kmeans_batch_size: int | None = None, n_threads: int | None = None
+):
+    """cluster_points（UMAPの座標、またはcluster_space="embedding"の場合は埋め込み）を最大分割数でクラスタリングする
+
+    n_threadsを指定した場合はKMeansのOpenMPのスレッド数をその数までに制限する。
+    hierarchical_clusteringがUMAPと同時に別プロセスで実行するため、ステップのモジュールではなくここに置く
+    （子プロセスでhierarchical_utilsなどを読み込まずに済む）。
+    """
+    print("start initial clustering")
+    if kmeans_batch_size:
+        # 件数が多い場合は、ミニバッチで中心を更新して計算量とメモリを抑える
+        kmeans_model = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, batch_size=kmeans_batch_size, n_init=3)
+    else:
+        kmeans_model = KMeans(n_clusters=n_clusters, random_state=42)
+    with threadpool_limits(limits=n_threads, user_api="openmp") if n_threads else nullcontext():
+        kmeans_model.fit(cluster_points)
+    print("end initial clustering")
+    return kmeans_model
+
+
+def assign_to_centers(points: np.ndarray, centers: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """各点を最も近いクラスタ中心に割り当てる
+
+    Returns:
+        (クラスタ中心のインデックス, 中心までのユークリッド距離)
+    """
+    points = np.asarray(points, dtype=np.float64)
+    centers = np.asarray(centers, dtype=np.float64)
+    labels = np.empty(len(points), dtype=int)
+    distances = np.empty(len(points), dtype=np.float64)
+    center_norms = (centers**2).sum(axis=1)
+    for start in range(0, len(points), ASSIGN_CHUNK_SIZE):
+        chunk = points[start : start + ASSIGN_CHUNK_SIZE]
+        # |x - c|^2 = |x|^2 - 2x・c + |c|^2
+        squared = (chunk**2).sum(axis=1)[:, None] - 2 * chunk @ centers.T + center_norms[None, :]
+        nearest = squared.argmin(axis=1)
+        labels[start : start + len(chunk)] = nearest
+        distances[start : start + len(chunk)] = np.sqrt(np.maximum(squared[np.arange(len(chunk)), nearest], 0))
+    return labels, distances
+
+
+def cluster_means(points: np.ndarray, labels: np.ndarray, n_clusters: int) -> np.ndarray:
+    """クラスタごとの点の平均（重心）を返す（所属する点がないクラスタは0）"""
+    labels = np.asarray(labels)
+    # 1-hotの疎行列との積で、行列全体を1回読むだけで各クラスタの合計を求める
+    membership = sp.csr_matrix(
+        (np.ones(len(labels), dtype=np.float32), (labels, np.arange(len(labels)))), shape=(n_clusters, len(labels))
+    )
+    counts = np.maximum(np.asarray(membership.sum(axis=1)).reshape(-1), 1)
+    # memo: メモリマップの埋め込みをfloat64の行列にコピーしないよう、元のdtypeのまま積を計算する
+    return np.asarray(membership @ np.asarray(points), dtype=np.float64) / counts[:, None]
+
+
+def center_distances(points: np.ndarray, centers: np.ndarray, labels: np.ndarray) -> np.ndarray:
+    """各点から、割り当てられたクラスタの中心までのユークリッド距離を返す"""
+    labels = np.asarray(labels)
+    distances = np.empty(len(labels), dtype=np.float64)
+    for start in range(0, len(labels), ASSIGN_CHUNK_SIZE):
+        chunk = np.asarray(points[start : start + ASSIGN_CHUNK_SIZE], dtype=np.float64)
+        distances[start : start + len(chunk)] = np.linalg.norm(
+            chunk - centers[labels[start : start + len(chunk)]], axis=1
+        )
+    return distances
+
+
+def centroid_drift(distances: np.ndarray, baseline_distance: float) -> float:
+    """新しい意見のクラスタ中心までの平均距離が、fit時の意見の平均距離の何倍かを返す
+
+    既存のクラスタに当てはまらない意見が増えるほど大きくなる。新しい意見がない場合は0
+    """
+    if len(distances) == 0:
+        return 0.0
+    if baseline_distance <= 0:
+        return float("inf") if np.mean(distances) > 0 else 1.0
+    return float(np.mean(distances) / baseline_distance)
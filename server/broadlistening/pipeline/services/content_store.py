@@ -0,0 +1,54 @@
+import hashlib
+import os
+
+# ステータスファイルには本文の代わりにハッシュ（キー名に"_hash"を付けたもの）を書き出すオプション
+CONTENT_KEYS = ("source_code", "prompt")
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def put_content(store_dir: str, text: str) -> str:
+    """テキストをハッシュをファイル名として保存し、ハッシュを返す（同じ内容はレポートをまたいで1つだけ保存される）"""
+    digest = content_hash(text)
+    path = os.path.join(store_dir, f"{digest}.txt")
+    if not os.path.exists(path):
+        os.makedirs(store_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    return digest
+
+
+def get_content(store_dir: str, digest: str) -> str | None:
+    """put_contentで保存したテキストを返す。見つからない場合はNone"""
+    path = os.path.join(store_dir, f"{digest}.txt")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def slim_params(params: dict) -> dict:
+    """ステップのオプションから本文（ソースコード・プロンプト）を取り除き、ハッシュに置き換えたコピーを返す"""
+    slim = {key: value for key, value in params.items() if key not in CONTENT_KEYS}
+    for key in CONTENT_KEYS:
+        if isinstance(params.get(key), str):
+            slim[f"{key}_hash"] = content_hash(params[key])
+    return slim
+
+
+def param_value(params: dict, key: str):
+    """前回の実行と比較するためのオプションの値を返す
+
+    本文のオプションはハッシュで比較する。本文をそのまま記録していた以前のステータスファイルにも対応する。
+    """
+    if key not in CONTENT_KEYS:
+        return params.get(key, None)
+    if f"{key}_hash" in params:
+        return params[f"{key}_hash"]
+    if isinstance(params.get(key), str):
+        return content_hash(params[key])
+    return None
@@ -0,0 +1,91 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from .local_embedding import LOCAL_EMBEDDING_MODEL
+
+DEFAULT_CACHE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "../cache/embeddings.sqlite3"))
+
+# SQLiteのプレースホルダ数の上限を超えないよう、問い合わせをこの件数ずつに分ける
+_QUERY_CHUNK_SIZE = 500
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def embedding_model_key(
+    model: str,
+    is_embedded_at_local: bool = False,
+    provider: str = "openai",
+    local_llm_address: str | None = None,
+) -> str:
+    """埋め込みを生成したモデルを識別するキーを返す関数
+
+    同じ文章でもモデルが異なればベクトルも異なるため、キャッシュはこのキーごとに分けて保存する。
+    Azure・ローカルLLMは同じ名前でもエンドポイントが異なれば別のモデルの可能性があるため、エンドポイントもキーに含める。
+    """
+    if is_embedded_at_local:
+        return f"local:{LOCAL_EMBEDDING_MODEL}"
+    if provider == "azure":
+        # Azureはモデル名ではなくデプロイメント名で呼び出している
+        return f"azure:{os.getenv('AZURE_EMBEDDING_ENDPOINT')}:{os.getenv('AZURE_EMBEDDING_DEPLOYMENT_NAME')}"
+    if provider == "local":
+        # memo: request_to_embedと同じく、アドレスの指定がない場合はOllamaのデフォルトのアドレスを使う
+        return f"local-llm:{local_llm_address or 'localhost:11434'}:{model}"
+    return f"{provider}:{model}"
+
+
+class EmbeddingCache:
+    """(モデル, 文章のsha256)をキーに埋め込みベクトルを保存する永続キャッシュ
+
+    同じサーバー上の全レポートで共有できるよう、SQLite(WALモード)に float32 で保存します。
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash TEXT NOT NULL, dim INTEGER NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.commit()
+
+    def get_many(self, model_key: str, texts: list[str]) -> list[np.ndarray | None]:
+        """textsの各文章に対応するベクトルを返す。キャッシュにないものはNone"""
+        hashes = [text_hash(text) for text in texts]
+        found: dict[str, np.ndarray] = {}
+        unique_hashes = list(dict.fromkeys(hashes))
+        with self._lock:
+            for i in range(0, len(unique_hashes), _QUERY_CHUNK_SIZE):
+                chunk = unique_hashes[i : i + _QUERY_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model_key, *chunk],
+                ).fetchall()
+                for hash_value, vector in rows:
+                    found[hash_value] = np.frombuffer(vector, dtype=np.float32)
+        return [found.get(hash_value) for hash_value in hashes]
+
+    def put_many(self, model_key: str, texts: list[str], vectors) -> None:
+        rows = []
+        for text, vector in zip(texts, vectors, strict=True):
+            array = np.asarray(vector, dtype=np.float32)
+            rows.append((model_key, text_hash(text), array.shape[0], array.tobytes()))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, dim, vector) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,57 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+EMBEDDINGS_FILENAME = "embeddings.npy"
+EMBEDDING_ARG_IDS_FILENAME = "embeddings_arg_ids.csv"
+LEGACY_EMBEDDINGS_FILENAME = "embeddings.pkl"
+
+
+def save_embeddings(output_dir: str, arg_ids, embeddings: np.ndarray) -> None:
+    """埋め込みを連続したfloat32の行列(.npy)と、行に対応するarg-idの一覧として保存する
+
+    Args:
+        output_dir: 出力ディレクトリ（例: outputs/{dataset}）
+        arg_ids: 各行に対応するarg-id
+        embeddings: (意見数, 次元数)の埋め込み行列
+    """
+    matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+    if matrix.shape[0] != len(arg_ids):
+        raise ValueError(f"Number of embeddings ({matrix.shape[0]}) does not match number of arg-ids ({len(arg_ids)})")
+
+    # 読み込み中のプロセスが壊れたファイルを読まないよう、一時ファイルに書いてから置き換える
+    path = os.path.join(output_dir, EMBEDDINGS_FILENAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, matrix)
+    os.replace(tmp_path, path)
+    pd.DataFrame({"arg-id": arg_ids}).to_csv(os.path.join(output_dir, EMBEDDING_ARG_IDS_FILENAME), index=False)
+
+
+def load_embeddings(output_dir: str, mmap: bool = True) -> tuple[np.ndarray, list[str]]:
+    """save_embeddingsで保存した埋め込みを読み込む
+
+    .npyはメモリマップで開くため、行列全体をメモリにコピーせずに参照できる。
+    旧形式のembeddings.pklしかない場合は、そちらを読み込んでfloat32の行列に変換する。
+
+    Returns:
+        (埋め込み行列, arg-idのリスト)
+    """
+    path = os.path.join(output_dir, EMBEDDINGS_FILENAME)
+    if os.path.exists(path):
+        embeddings = np.load(path, mmap_mode="r" if mmap else None)
+        arg_ids = pd.read_csv(os.path.join(output_dir, EMBEDDING_ARG_IDS_FILENAME), dtype={"arg-id": str})[
+            "arg-id"
+        ].tolist()
+        return embeddings, arg_ids
+
+    legacy_path = os.path.join(output_dir, LEGACY_EMBEDDINGS_FILENAME)
+    if os.path.exists(legacy_path):
+        df = pd.read_pickle(legacy_path)
+        embeddings = np.empty((len(df), len(df["embedding"].iloc[0])), dtype=np.float32)
+        for i, vector in enumerate(df["embedding"]):
+            embeddings[i] = vector
+        return embeddings, df["arg-id"].astype(str).tolist()
+
+    raise FileNotFoundError(f"Embeddings not found in {output_dir}")
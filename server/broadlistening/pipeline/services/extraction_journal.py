@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+
+
+def _sha256(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+class ExtractionJournal:
+    """意見抽出の結果をコメント単位で追記する、再開用のジャーナル(JSONL)
+
+    1行目に抽出条件(プロンプト・モデル・プロバイダーと、重複判定・パッキングなど結果に影響するオプション)のハッシュを
+    持つヘッダーを書き、以降は完了したコメントごとに{"comment_id", "body_hash", "arguments"}を1行ずつ追記する。
+    抽出条件が異なるジャーナルは読み込まずに作り直し、コメント本文が変わったコメントは再抽出の対象にする。
+    enabled=Falseの場合（-fで強制的に実行し直す場合）は既存のジャーナルを読み込まず、最初の追記時に作り直す。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        prompt: str,
+        model: str,
+        provider: str,
+        options: dict | None = None,
+        enabled: bool = True,
+    ):
+        self.path = path
+        self.fingerprint = _sha256(
+            json.dumps([prompt, model, provider, options or {}], ensure_ascii=False, sort_keys=True)
+        )
+        self._entries: dict[str, tuple[str, list[str]]] = {}
+        self._reusable = False
+        self._ends_with_newline = True
+        self._file = None
+        if enabled:
+            self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            lines = f.read().split("\n")
+        try:
+            header = json.loads(lines[0])
+        except json.JSONDecodeError:
+            return
+        if header.get("fingerprint") != self.fingerprint:
+            print("Extraction journal was written with a different prompt/model; starting over")
+            return
+        self._reusable = True
+        self._ends_with_newline = lines[-1] == ""
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # 書き込み途中で中断された行は読み飛ばす
+                continue
+            self._entries[str(entry["comment_id"])] = (entry["body_hash"], entry["arguments"])
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, comment_id, body: str) -> list[str] | None:
+        """完了済みのコメントの抽出結果を返す。未処理、または本文が変わっている場合はNone"""
+        entry = self._entries.get(str(comment_id))
+        if entry is None or entry[0] != _sha256(str(body)):
+            return None
+        return entry[1]
+
+    def append(self, comment_id, body: str, arguments: list[str]) -> None:
+        """コメントの抽出結果を追記する（途中で異常終了しても書き込み済みの行は失われない）"""
+        if self._file is None:
+            if self._reusable:
+                self._file = open(self.path, "a", encoding="utf-8")
+                if not self._ends_with_newline:
+                    self._file.write("\n")
+            else:
+                self._file = open(self.path, "w", encoding="utf-8")
+                self._file.write(json.dumps({"fingerprint": self.fingerprint}) + "\n")
+                self._reusable = True
+        entry = {"comment_id": str(comment_id), "body_hash": _sha256(str(body)), "arguments": arguments}
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self._entries[entry["comment_id"]] = (entry["body_hash"], arguments)
+
+    def close(self) -> None:
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+    def remove(self) -> None:
+        """抽出が最後まで完了し、結果を保存した後にジャーナルを削除する"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._entries = {}
+        self._reusable = False
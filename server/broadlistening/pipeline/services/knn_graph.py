@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+from importlib import import_module
+
+import joblib
+import numpy as np
+from sklearn.neighbors import NearestNeighbors
+
+KNN_GRAPH_CACHE_FILENAME = "hierarchical_knn_graph.joblib"
+# "umap"はUMAPの内部でk近傍グラフを作る（キャッシュしない）
+KNN_BACKENDS = ("umap", "nndescent", "exact", "hnsw")
+# transformで新しい点を射影するための検索インデックスを作れるバックエンド
+SEARCHABLE_KNN_BACKENDS = ("umap", "nndescent")
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    """ファイルの内容のSHA-256を返す（大きなファイルも少しずつ読んで計算する）"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def knn_cache_key(**values) -> str:
+    """k近傍グラフのキャッシュのキーを、グラフを決める値（元の埋め込みのハッシュ・近傍数・バックエンドなど）から作る"""
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def build_knn_graph(
+    points: np.ndarray,
+    n_neighbors: int,
+    backend: str = "nndescent",
+    params: dict | None = None,
+    with_search_index: bool = False,
+) -> tuple[np.ndarray, np.ndarray, object]:
+    """各点のk近傍（自身を含む）を求める
+
+    Args:
+        points: (点の数, 次元数)の行列
+        n_neighbors: 近傍数
+        backend: "nndescent"（pynndescent、UMAPと同じ近似）、"exact"（総当たり）、"hnsw"（hnswlib、hnsw extraが必要）
+        params: バックエンドに渡すパラメータ
+            nndescent: n_trees, n_iters, max_candidates など pynndescent.NNDescent の引数
+            hnsw: M, ef_construction, ef
+        with_search_index: Trueの場合、nndescentの検索インデックスを返す（UMAPのtransformに必要）
+
+    Returns:
+        (近傍のインデックス, 近傍までの距離, 検索インデックスまたはNone)
+    """
+    params = dict(params or {})
+    points = np.ascontiguousarray(points, dtype=np.float32)
+    if not points.flags.writeable:
+        # memo: pynndescent（numba）は読み取り専用の配列（メモリマップの埋め込み）を受け付けないためコピーする
+        points = points.copy()
+    if backend == "nndescent":
+        NNDescent = import_module("pynndescent").NNDescent
+
+        params.setdefault("random_state", 42)
+        params.setdefault("low_memory", True)
+        index = NNDescent(points, n_neighbors=n_neighbors, metric="euclidean", **params)
+        indices, distances = index.neighbor_graph
+        return indices, distances, index if with_search_index else None
+    if backend == "exact":
+        distances, indices = NearestNeighbors(n_neighbors=n_neighbors, algorithm="brute").fit(points).kneighbors(points)
+        return indices, distances.astype(np.float32), None
+    if backend == "hnsw":
+        try:
+            hnswlib = import_module("hnswlib")
+        except ImportError as e:
+            raise ImportError(
+                "knn_backend 'hnsw' requires hnswlib; install the 'hnsw' extra (rye sync --features hnsw) "
+                "or set WITH_HNSW=true when building the Docker image"
+            ) from e
+        index = hnswlib.Index(space="l2", dim=points.shape[1])
+        index.init_index(
+            max_elements=len(points),
+            M=params.get("M", 16),
+            ef_construction=params.get("ef_construction", 200),
+            random_seed=42,
+        )
+        index.add_items(points)
+        index.set_ef(max(params.get("ef", 50), n_neighbors))
+        indices, squared_distances = index.knn_query(points, k=n_neighbors)
+        # hnswlibのl2は二乗距離を返す
+        return indices.astype(np.int64), np.sqrt(squared_distances), None
+    raise ValueError(f"Unknown knn backend: {backend}")
+
+
+def get_knn_graph(
+    points: np.ndarray,
+    n_neighbors: int,
+    backend: str = "nndescent",
+    params: dict | None = None,
+    with_search_index: bool = False,
+    cache_path: str | None = None,
+    cache_key: str | None = None,
+) -> tuple[np.ndarray, np.ndarray, object]:
+    """build_knn_graphの結果を、cache_pathにキャッシュしながら返す
+
+    cache_keyが前回保存したキャッシュと同じ場合はグラフを作り直さずに読み込む。
+    キャッシュはcache_pathに1つだけ保存し、キーが変わった場合は上書きする。
+    """
+    if cache_path and cache_key and os.path.exists(cache_path):
+        try:
+            cached = joblib.load(cache_path)
+        except Exception as e:
+            print(f"Failed to load knn graph cache {cache_path}: {e}")
+            cached = None
+        if cached is not None and cached.get("key") == cache_key:
+            print(f"loaded knn graph from {cache_path}")
+            return cached["indices"], cached["distances"], cached["search_index"]
+
+    print(f"start building knn graph ({backend}, n_neighbors={n_neighbors})")
+    indices, distances, search_index = build_knn_graph(points, n_neighbors, backend, params, with_search_index)
+    print("end building knn graph")
+    if cache_path and cache_key:
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            joblib.dump({"key": cache_key, "indices": indices, "distances": distances, "search_index": search_index}, f)
+        os.replace(tmp_path, cache_path)
+    return indices, distances, search_index
@@ -1,13 +1,25 @@
+import asyncio
+import concurrent.futures
+import contextlib
 import logging
 import os
 import threading
+import weakref
+from collections.abc import Callable
 
+import httpx
 import openai
 from dotenv import load_dotenv
-from openai import AzureOpenAI, OpenAI
+from openai import AsyncAzureOpenAI, AsyncOpenAI, AzureOpenAI, OpenAI
 from pydantic import BaseModel
 from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 
+from .adaptive_concurrency import configure_adaptive_concurrency, get_concurrency_limiter
+from .batch_api import get_batch_collector, is_batch_mode
+from .llm_cache import DEFAULT_MAX_BYTES, configure_response_cache, get_response_cache, make_cache_key
+from .local_embedding import get_local_embedding_engine
+from .rate_limiter import configure_rate_limits, get_rate_limiter
+
 DOTENV_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../../.env"))
 load_dotenv(DOTENV_PATH)
 
@@ -32,6 +44,218 @@ if use_azure == "true":
     if not os.getenv("AZURE_EMBEDDING_DEPLOYMENT_NAME"):
         raise RuntimeError("AZURE_EMBEDDING_DEPLOYMENT_NAME environment variable is not set")
 
+# LLMレスポンスのディスクキャッシュ（LLM_CACHE_ENABLED=trueで有効化）
+configure_response_cache(
+    enabled=os.getenv("LLM_CACHE_ENABLED", "false").lower() == "true",
+    cache_dir=os.getenv("LLM_CACHE_DIR"),
+    max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", str(DEFAULT_MAX_BYTES))),
+)
+
+# (provider, model)ごとのレート制限（例: LLM_RATE_LIMITS='{"openai:gpt-4o-mini": {"rpm": 500, "tpm": 200000}}'）
+configure_rate_limits(os.getenv("LLM_RATE_LIMITS"))
+
+# HTTP接続プールの設定（環境変数で調整可能）
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100"))
+LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "30"))
+
+# (provider, model)ごとに同時実行数をレイテンシと429/5xx/タイムアウトから自動調整する（AIMD、LLM_ADAPTIVE_CONCURRENCY=trueで有効化）
+# memo: 接続プールの空きを待つリクエストがタイムアウトしないよう、上限は接続プールのサイズを超えないようにする
+configure_adaptive_concurrency(
+    enabled=os.getenv("LLM_ADAPTIVE_CONCURRENCY", "false").lower() == "true",
+    initial=int(os.getenv("LLM_ADAPTIVE_INITIAL_CONCURRENCY", "4")),
+    max_limit=min(
+        int(os.getenv("LLM_ADAPTIVE_MAX_CONCURRENCY", str(LLM_HTTP_MAX_CONNECTIONS))), LLM_HTTP_MAX_CONNECTIONS
+    ),
+)
+
+# memo: (provider, base_url, api_version)ごとにクライアントをプロセス全体で共有し、
+# リクエストごとのコネクションプール生成とTLSハンドシェイクを避ける
+_client_registry: dict[tuple[str, str | None, str | None], OpenAI | AzureOpenAI] = {}
+_client_registry_lock = threading.Lock()
+_client_metrics = {
+    "clients_created": 0,
+    "clients_reused": 0,
+    "requests": 0,
+    "connections_created": 0,
+    "tls_handshakes": 0,
+}
+_client_metrics_lock = threading.Lock()
+
+
+def _increment_client_metric(key: str, value: int = 1) -> None:
+    with _client_metrics_lock:
+        _client_metrics[key] += value
+
+
+def _trace_connection(event_name: str, info: dict) -> None:
+    # httpcoreのtrace拡張を使い、新規コネクションの確立とTLSハンドシェイクを数える
+    if event_name == "connection.connect_tcp.complete":
+        _increment_client_metric("connections_created")
+    elif event_name == "connection.start_tls.complete":
+        _increment_client_metric("tls_handshakes")
+
+
+def _on_http_request(request: httpx.Request) -> None:
+    _increment_client_metric("requests")
+    request.extensions["trace"] = _trace_connection
+
+
+def _build_http_client() -> httpx.Client:
+    return openai.DefaultHttpxClient(
+        limits=httpx.Limits(
+            max_connections=LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_HTTP_KEEPALIVE_EXPIRY,
+        ),
+        event_hooks={"request": [_on_http_request]},
+    )
+
+
+def get_client(
+    provider: str,
+    base_url: str | None = None,
+    api_key: str | None = None,
+    api_version: str | None = None,
+) -> OpenAI | AzureOpenAI:
+    """プロバイダーごとに共有されるOpenAI互換クライアントを取得する関数
+
+    同じ(provider, base_url, api_version)に対しては、keep-aliveのコネクションプールを持つ
+    同一のクライアントを返します。
+
+    Args:
+        provider: プロバイダー名（"openai", "azure", "local", "openrouter"）
+        base_url: APIのベースURL（provider="azure"の場合はエンドポイント）
+        api_key: APIキー
+        api_version: APIバージョン（provider="azure"の場合のみ使用）
+
+    Returns:
+        OpenAIまたはAzureOpenAIのクライアント
+    """
+    key = (provider, base_url, api_version)
+    with _client_registry_lock:
+        client = _client_registry.get(key)
+        if client is not None:
+            _increment_client_metric("clients_reused")
+            return client
+
+        if provider == "azure":
+            client = AzureOpenAI(
+                api_version=api_version,
+                azure_endpoint=base_url,
+                api_key=api_key,
+                http_client=_build_http_client(),
+            )
+        else:
+            client = OpenAI(
+                base_url=base_url,
+                api_key=api_key,
+                http_client=_build_http_client(),
+            )
+        _client_registry[key] = client
+        _increment_client_metric("clients_created")
+        return client
+
+
+async def _atrace_connection(event_name: str, info: dict) -> None:
+    _trace_connection(event_name, info)
+
+
+async def _on_async_http_request(request: httpx.Request) -> None:
+    _increment_client_metric("requests")
+    request.extensions["trace"] = _atrace_connection
+
+
+def _build_async_http_client() -> httpx.AsyncClient:
+    return openai.DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_HTTP_KEEPALIVE_EXPIRY,
+        ),
+        event_hooks={"request": [_on_async_http_request]},
+    )
+
+
+# memo: 非同期クライアントのコネクションはイベントループに紐づくため、ループごとに保持する
+_async_client_registry: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, dict[tuple[str, str | None, str | None], AsyncOpenAI | AsyncAzureOpenAI]
+] = weakref.WeakKeyDictionary()
+
+
+def get_async_client(
+    provider: str,
+    base_url: str | None = None,
+    api_key: str | None = None,
+    api_version: str | None = None,
+) -> AsyncOpenAI | AsyncAzureOpenAI:
+    """get_clientの非同期版。実行中のイベントループごとにクライアントを共有する"""
+    loop = asyncio.get_running_loop()
+    key = (provider, base_url, api_version)
+    with _client_registry_lock:
+        clients = _async_client_registry.setdefault(loop, {})
+        client = clients.get(key)
+        if client is not None:
+            _increment_client_metric("clients_reused")
+            return client
+
+        if provider == "azure":
+            client = AsyncAzureOpenAI(
+                api_version=api_version,
+                azure_endpoint=base_url,
+                api_key=api_key,
+                http_client=_build_async_http_client(),
+            )
+        else:
+            client = AsyncOpenAI(
+                base_url=base_url,
+                api_key=api_key,
+                http_client=_build_async_http_client(),
+            )
+        clients[key] = client
+        _increment_client_metric("clients_created")
+        return client
+
+
+def get_client_metrics() -> dict[str, int]:
+    """共有クライアントとHTTPコネクションの生成・再利用数を返す関数"""
+    with _client_metrics_lock:
+        metrics = dict(_client_metrics)
+    metrics["connections_reused"] = max(0, metrics["requests"] - metrics["connections_created"])
+    return metrics
+
+
+def reset_clients() -> None:
+    """共有クライアントを破棄し、メトリクスを初期化する関数"""
+    with _client_registry_lock:
+        for client in _client_registry.values():
+            try:
+                client.close()
+            except Exception as e:
+                logging.warning(f"Failed to close LLM client: {e}")
+        _client_registry.clear()
+        # 非同期クライアントは所属するループ上でしかcloseできないため、参照のみ破棄する
+        _async_client_registry.clear()
+    with _client_metrics_lock:
+        for key in _client_metrics:
+            _client_metrics[key] = 0
+
+
+def _local_llm_base_url(address: str) -> str:
+    try:
+        if ":" in address:
+            host, port_str = address.split(":")
+            port = int(port_str)
+        else:
+            host = address
+            port = 11434  # デフォルトポート
+    except ValueError:
+        logging.warning(f"Invalid address format: {address}, using default")
+        host = "localhost"
+        port = 11434
+
+    return f"http://{host}:{port}/v1"
+
 
 @retry(
     retry=retry_if_exception_type(openai.RateLimitError),
@@ -124,11 +348,7 @@ def request_to_azure_chatcompletion(
     token_usage_output = 0  # 出力トークン使用量を追跡する変数
     token_usage_total = 0  # 合計トークン使用量を追跡する変数
 
-    client = AzureOpenAI(
-        api_version=api_version,
-        azure_endpoint=azure_endpoint,
-        api_key=api_key,
-    )
+    client = get_client("azure", base_url=azure_endpoint, api_key=api_key, api_version=api_version)
     # Set response format based on parameters
 
     try:
@@ -214,25 +434,10 @@ def request_to_local_llm(
     token_usage_input = 0  # 入力トークン使用量を追跡する変数
     token_usage_output = 0  # 出力トークン使用量を追跡する変数
     token_usage_total = 0  # 合計トークン使用量を追跡する変数
-    try:
-        if ":" in address:
-            host, port_str = address.split(":")
-            port = int(port_str)
-        else:
-            host = address
-            port = 11434  # デフォルトポート
-    except ValueError:
-        logging.warning(f"Invalid address format: {address}, using default")
-        host = "localhost"
-        port = 11434
-
-    base_url = f"http://{host}:{port}/v1"
+    base_url = _local_llm_base_url(address)
 
     try:
-        client = OpenAI(
-            base_url=base_url,
-            api_key="not-needed",  # OllamaとLM Studioは認証不要
-        )
+        client = get_client("local", base_url=base_url, api_key="not-needed")  # OllamaとLM Studioは認証不要
 
         response_format = None
         if is_json:
@@ -302,20 +507,80 @@ def request_to_chat_ai(
         - provider="azure": Azure OpenAI APIを使用
         - provider="local": ローカルLLM（OllamaやLM Studio）を使用
         - provider="openrouter": OpenRouter APIを使用（OpenAIやGeminiのモデルにアクセス可能）
+        - レスポンスキャッシュが有効な場合、同一リクエストにはキャッシュを返す（トークン使用量は0）
     """
+    cache = get_response_cache()
+    cache_key = None
+    if cache is not None:
+        cache_key = _chat_cache_key(messages, model, is_json, json_schema, provider)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached, 0, 0, 0
+
+    limiter = get_rate_limiter(provider, _chat_model_name(model, provider))
+    estimated_tokens = _estimate_message_tokens(messages)
+    if limiter is not None:
+        limiter.acquire(estimated_tokens)
+
     if provider == "azure":
-        return request_to_azure_chatcompletion(messages, is_json, json_schema)
+        result = request_to_azure_chatcompletion(messages, is_json, json_schema)
     elif provider == "openai":
-        return request_to_openai(messages, model, is_json, json_schema)
+        result = request_to_openai(messages, model, is_json, json_schema)
     elif provider == "local":
         address = local_llm_address or "localhost:11434"
-        return request_to_local_llm(messages, model, is_json, json_schema, address)
+        result = request_to_local_llm(messages, model, is_json, json_schema, address)
     elif provider == "openrouter":
         # OpenRouterのモデル名を直接使用
-        return request_to_openrouter_chatcompletion(messages, model, is_json, json_schema)
+        result = request_to_openrouter_chatcompletion(messages, model, is_json, json_schema)
     else:
         raise ValueError(f"Unknown provider: {provider}")
 
+    if limiter is not None:
+        limiter.record_usage(estimated_tokens, result[3])
+    if cache is not None:
+        cache.set(cache_key, result[0])
+    return result
+
+
+def _chat_cache_key(
+    messages: list[dict],
+    model: str,
+    is_json: bool,
+    json_schema: dict | type[BaseModel] | None,
+    provider: str,
+) -> str:
+    # 全プロバイダーでtemperature=0, seed=0固定で呼び出している
+    return make_cache_key(
+        provider, _chat_model_name(model, provider), messages, json_schema, is_json, temperature=0, seed=0
+    )
+
+
+def _chat_model_name(model: str, provider: str) -> str:
+    # Azureはモデル名ではなくデプロイメント名で呼び出しているため、そちらを使う
+    if provider == "azure":
+        return os.getenv("AZURE_CHATCOMPLETION_DEPLOYMENT_NAME")
+    return model
+
+
+def _embedding_model_name(model: str, provider: str) -> str:
+    if provider == "azure":
+        return os.getenv("AZURE_EMBEDDING_DEPLOYMENT_NAME")
+    return model
+
+
+def _estimate_message_tokens(messages: list[dict]) -> int:
+    return sum(estimate_tokens(str(message.get("content") or "")) for message in messages)
+
+
+def estimate_tokens(text: str) -> int:
+    """tokenizerを使わずにテキストのトークン数を見積もる関数
+
+    日本語などの非ASCII文字は1文字1トークン、ASCII文字は4文字1トークンとして数えます。
+    多めに見積もる方向の近似で、リクエストの分割やレート制限の事前見積もりに使います。
+    """
+    ascii_chars = sum(1 for c in text if c.isascii())
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
 
 EMBDDING_MODELS = [
     "text-embedding-3-large",
@@ -341,25 +606,10 @@ def request_to_local_llm_embed(args, model, address="localhost:11434"):
     Returns:
         埋め込みベクトルのリスト
     """
-    try:
-        if ":" in address:
-            host, port_str = address.split(":")
-            port = int(port_str)
-        else:
-            host = address
-            port = 11434  # デフォルトポート
-    except ValueError:
-        logging.warning(f"Invalid address format: {address}, using default")
-        host = "localhost"
-        port = 11434
-
-    base_url = f"http://{host}:{port}/v1"
+    base_url = _local_llm_base_url(address)
 
     try:
-        client = OpenAI(
-            base_url=base_url,
-            api_key="not-needed",  # OllamaとLM Studioは認証不要
-        )
+        client = get_client("local", base_url=base_url, api_key="not-needed")  # OllamaとLM Studioは認証不要
 
         response = client.embeddings.create(input=args, model=model)
         embeds = [item.embedding for item in response.data]
@@ -374,11 +624,15 @@ def request_to_embed(args, model, is_embedded_at_local=False, provider="openai",
     if is_embedded_at_local:
         return request_to_local_embed(args)
 
+    limiter = get_rate_limiter(provider, _embedding_model_name(model, provider))
+    if limiter is not None:
+        limiter.acquire(sum(estimate_tokens(arg) for arg in args))
+
     if provider == "azure":
         return request_to_azure_embed(args, model)
     elif provider == "openai":
         _validate_model(model)
-        client = OpenAI()
+        client = get_client("openai", api_key=os.getenv("OPENAI_API_KEY"))
         response = client.embeddings.create(input=args, model=model)
         embeds = [item.embedding for item in response.data]
         return embeds
@@ -397,34 +651,516 @@ def request_to_azure_embed(args, model):
     api_version = os.getenv("AZURE_EMBEDDING_VERSION")
     deployment = os.getenv("AZURE_EMBEDDING_DEPLOYMENT_NAME")
 
-    client = AzureOpenAI(
-        api_version=api_version,
-        azure_endpoint=azure_endpoint,
-        api_key=api_key,
-    )
+    client = get_client("azure", base_url=azure_endpoint, api_key=api_key, api_version=api_version)
 
     response = client.embeddings.create(input=args, model=deployment)
     return [item.embedding for item in response.data]
 
 
-__local_emb_model = None
-__local_emb_model_loading_lock = threading.Lock()
+def request_to_local_embed(args):
+    """sentence-transformersでローカルに埋め込みを計算する（モデルはプロセス内で共有する）"""
+    return get_local_embedding_engine().encode(args).tolist()
 
 
-def request_to_local_embed(args):
-    global __local_emb_model
-    # memo: モデルを遅延ロード＆キャッシュするために、グローバル変数を使用
+def _token_usage(response) -> tuple[int, int, int]:
+    if hasattr(response, "usage") and response.usage:
+        return (
+            response.usage.prompt_tokens or 0,
+            response.usage.completion_tokens or 0,
+            response.usage.total_tokens or 0,
+        )
+    return 0, 0, 0
+
+
+def _is_overload_error(e: BaseException) -> bool:
+    """相手側の過負荷を示すエラー（429・5xx・タイムアウト）かどうか
+
+    接続プールの空き待ちによるタイムアウト（httpx.PoolTimeout）は手元の制限によるものなので過負荷とみなさない。
+    """
+    if isinstance(e.__cause__, httpx.PoolTimeout):
+        return False
+    if isinstance(e, openai.RateLimitError | openai.APITimeoutError | asyncio.TimeoutError):
+        return True
+    return isinstance(e, openai.APIStatusError) and e.status_code >= 500
+
+
+def _concurrency_slot(provider: str, model: str):
+    limiter = get_concurrency_limiter(provider, model)
+    if limiter is None:
+        return contextlib.nullcontext()
+    return limiter.slot(_is_overload_error)
+
+
+async def _arequest_chat_completion(
+    client: AsyncOpenAI | AsyncAzureOpenAI,
+    model: str,
+    messages: list[dict],
+    is_json: bool,
+    json_schema: dict | type[BaseModel] | None,
+    provider: str,
+) -> tuple[str, int, int, int]:
+    """同期版のrequest_to_*と同じペイロードで非同期にチャットリクエストを送信する
+
+    同時実行数は(provider, model)ごとの適応的なリミッターで制御する。
+    """
+    async with _concurrency_slot(provider, model):
+        return await _asend_chat_completion(client, model, messages, is_json, json_schema, provider)
+
+
+async def _asend_chat_completion(
+    client: AsyncOpenAI | AsyncAzureOpenAI,
+    model: str,
+    messages: list[dict],
+    is_json: bool,
+    json_schema: dict | type[BaseModel] | None,
+    provider: str,
+) -> tuple[str, int, int, int]:
+    is_pydantic_schema = isinstance(json_schema, type) and issubclass(json_schema, BaseModel)
+    try:
+        if is_pydantic_schema and provider != "local":
+            response = await client.beta.chat.completions.parse(
+                model=model,
+                messages=messages,
+                temperature=0,
+                n=1,
+                seed=0,
+                response_format=json_schema,
+                timeout=30,
+            )
+            message = response.choices[0].message
+            # 同期版と同様に、Azureのみパース済みのdictを返す
+            content = message.parsed.model_dump() if provider == "azure" else message.content
+            return content, *_token_usage(response)
+
+        response_format = None
+        if is_json:
+            response_format = {"type": "json_object"}
+        if is_pydantic_schema:
+            # ローカルLLMはparseに対応していないため、JSONスキーマに変換して渡す
+            response_format = {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": json_schema.__name__,
+                    "strict": True,
+                    "schema": json_schema.model_json_schema(),
+                },
+            }
+        elif json_schema:  # 両方有効化されていたら、json_schemaを優先
+            response_format = json_schema
+
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": 0,
+            "n": 1,
+            "seed": 0,
+            "timeout": 30,
+        }
+        if response_format:
+            payload["response_format"] = response_format
+
+        response = await client.chat.completions.create(**payload)
+        return response.choices[0].message.content, *_token_usage(response)
+    except openai.RateLimitError as e:
+        logging.warning(f"{provider} API rate limit hit: {e}")
+        raise
+    except openai.AuthenticationError as e:
+        logging.error(f"{provider} API authentication error: {str(e)}")
+        raise
+    except openai.BadRequestError as e:
+        logging.error(f"{provider} API bad request error: {str(e)}")
+        raise
+
+
+@retry(
+    retry=retry_if_exception_type(openai.RateLimitError),
+    wait=wait_exponential(multiplier=3, min=3, max=20),
+    stop=stop_after_attempt(3),
+    reraise=True,
+)
+async def arequest_to_openai(
+    messages: list[dict],
+    model: str = "gpt-4",
+    is_json: bool = False,
+    json_schema: dict | type[BaseModel] | None = None,
+) -> tuple[str, int, int, int]:
+    """request_to_openaiの非同期版"""
+    client = get_async_client("openai", api_key=os.getenv("OPENAI_API_KEY"))
+    return await _arequest_chat_completion(client, model, messages, is_json, json_schema, "openai")
+
+
+@retry(
+    retry=retry_if_exception_type(openai.RateLimitError),
+    wait=wait_exponential(multiplier=1, min=2, max=20),
+    stop=stop_after_attempt(3),
+    reraise=True,
+)
+async def arequest_to_azure_chatcompletion(
+    messages: list[dict],
+    is_json: bool = False,
+    json_schema: dict | type[BaseModel] | None = None,
+) -> tuple[str, int, int, int]:
+    """request_to_azure_chatcompletionの非同期版"""
+    client = get_async_client(
+        "azure",
+        base_url=os.getenv("AZURE_CHATCOMPLETION_ENDPOINT"),
+        api_key=os.getenv("AZURE_CHATCOMPLETION_API_KEY"),
+        api_version=os.getenv("AZURE_CHATCOMPLETION_VERSION"),
+    )
+    deployment = os.getenv("AZURE_CHATCOMPLETION_DEPLOYMENT_NAME")
+    return await _arequest_chat_completion(client, deployment, messages, is_json, json_schema, "azure")
 
-    with __local_emb_model_loading_lock:
-        # memo: スレッドセーフにするためにロックを使用
-        if __local_emb_model is None:
-            from sentence_transformers import SentenceTransformer
 
-            model_name = "sentence-transformers/paraphrase-multilingual-mpnet-base-v2"
-            __local_emb_model = SentenceTransformer(model_name)
+async def arequest_to_local_llm(
+    messages: list[dict],
+    model: str,
+    is_json: bool = False,
+    json_schema: dict | type[BaseModel] | None = None,
+    address: str = "localhost:11434",
+) -> tuple[str, int, int, int]:
+    """request_to_local_llmの非同期版"""
+    client = get_async_client("local", base_url=_local_llm_base_url(address), api_key="not-needed")
+    try:
+        return await _arequest_chat_completion(client, model, messages, is_json, json_schema, "local")
+    except Exception as e:
+        logging.error(
+            f"LocalLLM API error: {e}, model:{model}, address:{address}, is_json:{is_json}, json_schema:{json_schema}"
+        )
+        raise
+
+
+@retry(
+    retry=retry_if_exception_type(openai.RateLimitError),
+    wait=wait_exponential(multiplier=3, min=3, max=20),
+    stop=stop_after_attempt(3),
+    reraise=True,
+)
+async def arequest_to_openrouter_chatcompletion(
+    messages: list[dict],
+    model: str,
+    is_json: bool = False,
+    json_schema: dict | type[BaseModel] | None = None,
+) -> tuple[str, int, int, int]:
+    """request_to_openrouter_chatcompletionの非同期版"""
+    api_key = os.getenv("OPENROUTER_API_KEY")
+    if not api_key:
+        raise RuntimeError("OPENROUTER_API_KEY environment variable is not set")
 
-    result = __local_emb_model.encode(args)
-    return result.tolist()
+    client = get_async_client("openrouter", base_url="https://openrouter.ai/api/v1", api_key=api_key)
+    return await _arequest_chat_completion(client, model, messages, is_json, json_schema, "openrouter")
+
+
+async def arequest_to_chat_ai(
+    messages: list[dict],
+    model: str = "gpt-4o",
+    is_json: bool = False,
+    json_schema: dict | type[BaseModel] | None = None,
+    provider: str = "openai",
+    local_llm_address: str | None = None,
+) -> tuple[str, int, int, int]:
+    """request_to_chat_aiの非同期版
+
+    引数・戻り値・プロバイダーの切り替え・キャッシュの扱いはrequest_to_chat_aiと同じです。
+    Batch APIモードが有効な場合は、並行して発行されたリクエストをまとめてBatch APIで実行します。
+    """
+    cache = get_response_cache()
+    cache_key = None
+    if cache is not None:
+        cache_key = _chat_cache_key(messages, model, is_json, json_schema, provider)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached, 0, 0, 0
+
+    collector = get_batch_collector()
+    if collector is not None:
+        result = await _arequest_chat_via_batch(collector, messages, model, is_json, json_schema, provider)
+        if cache is not None:
+            cache.set(cache_key, result[0])
+        return result
+
+    limiter = get_rate_limiter(provider, _chat_model_name(model, provider))
+    estimated_tokens = _estimate_message_tokens(messages)
+    if limiter is not None:
+        await limiter.aacquire(estimated_tokens)
+
+    if provider == "azure":
+        result = await arequest_to_azure_chatcompletion(messages, is_json, json_schema)
+    elif provider == "openai":
+        result = await arequest_to_openai(messages, model, is_json, json_schema)
+    elif provider == "local":
+        address = local_llm_address or "localhost:11434"
+        result = await arequest_to_local_llm(messages, model, is_json, json_schema, address)
+    elif provider == "openrouter":
+        result = await arequest_to_openrouter_chatcompletion(messages, model, is_json, json_schema)
+    else:
+        raise ValueError(f"Unknown provider: {provider}")
+
+    if limiter is not None:
+        limiter.record_usage(estimated_tokens, result[3])
+    if cache is not None:
+        cache.set(cache_key, result[0])
+    return result
+
+
+def _batch_client(provider: str) -> tuple[AsyncOpenAI | AsyncAzureOpenAI, str]:
+    """Batch APIを呼び出すクライアントとエンドポイントを返す（Batch APIに対応するopenaiとazureのみ）
+
+    OPENAI_BATCH_BASE_URLを設定すると、OpenAI互換の別のエンドポイント（検証用のフェイクなど）にジョブを送信する。
+    """
+    if provider == "azure":
+        client = get_async_client(
+            "azure",
+            base_url=os.getenv("AZURE_CHATCOMPLETION_ENDPOINT"),
+            api_key=os.getenv("AZURE_CHATCOMPLETION_API_KEY"),
+            api_version=os.getenv("AZURE_CHATCOMPLETION_VERSION"),
+        )
+        return client, "/chat/completions"
+    if provider == "openai":
+        client = get_async_client(
+            "openai", base_url=os.getenv("OPENAI_BATCH_BASE_URL"), api_key=os.getenv("OPENAI_API_KEY")
+        )
+        return client, "/v1/chat/completions"
+    raise ValueError(f"Batch API mode is not supported for provider: {provider}")
+
+
+def _strict_json_schema(schema):
+    """JSONスキーマをStructured Outputsのstrictモードの制約に合わせる
+
+    strictモードでは全てのオブジェクトでadditionalPropertiesをfalseにし、全てのプロパティをrequiredにする必要がある。
+    """
+    if isinstance(schema, list):
+        return [_strict_json_schema(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    strict = {key: _strict_json_schema(value) for key, value in schema.items()}
+    if strict.get("type") == "object" and "properties" in strict:
+        strict["additionalProperties"] = False
+        strict["required"] = list(strict["properties"])
+        for prop in strict["properties"].values():
+            prop.pop("default", None)
+    return strict
+
+
+def _strict_response_format(json_schema: type[BaseModel]) -> dict:
+    """pydanticモデルから、beta.chat.completions.parseと同じ形式(strictなjson_schema)のresponse_formatを作る
+
+    memo: openaiの非公開モジュール(openai.lib._parsing)に依存しないよう、model_json_schemaから組み立てる
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": json_schema.__name__,
+            "schema": _strict_json_schema(json_schema.model_json_schema()),
+            "strict": True,
+        },
+    }
+
+
+async def _arequest_chat_via_batch(
+    collector,
+    messages: list[dict],
+    model: str,
+    is_json: bool,
+    json_schema: dict | type[BaseModel] | None,
+    provider: str,
+) -> tuple[str, int, int, int]:
+    client, endpoint = _batch_client(provider)
+    body = {"model": _chat_model_name(model, provider), "messages": messages, "temperature": 0, "n": 1, "seed": 0}
+    is_pydantic_schema = isinstance(json_schema, type) and issubclass(json_schema, BaseModel)
+    if is_pydantic_schema:
+        body["response_format"] = _strict_response_format(json_schema)
+    elif json_schema:
+        body["response_format"] = json_schema
+    elif is_json:
+        body["response_format"] = {"type": "json_object"}
+
+    response = await collector.request(client, body, endpoint)
+    content = response["choices"][0]["message"]["content"]
+    if is_pydantic_schema and provider == "azure":
+        # 通常の実行時と同様に、Azureのみパース済みのdictを返す
+        content = json_schema.model_validate_json(content).model_dump()
+    usage = response.get("usage") or {}
+    return (
+        content,
+        usage.get("prompt_tokens") or 0,
+        usage.get("completion_tokens") or 0,
+        usage.get("total_tokens") or 0,
+    )
+
+
+async def arequest_to_embed(
+    args, model, is_embedded_at_local=False, provider="openai", local_llm_address: str | None = None
+):
+    """request_to_embedの非同期版"""
+    if is_embedded_at_local:
+        return await asyncio.to_thread(request_to_local_embed, args)
+
+    limiter = get_rate_limiter(provider, _embedding_model_name(model, provider))
+    if limiter is not None:
+        await limiter.aacquire(sum(estimate_tokens(arg) for arg in args))
+
+    async with _concurrency_slot(provider, _embedding_model_name(model, provider)):
+        return await _asend_embedding_request(args, model, provider, local_llm_address)
+
+
+async def _asend_embedding_request(args, model, provider: str, local_llm_address: str | None):
+    if provider == "azure":
+        client = get_async_client(
+            "azure",
+            base_url=os.getenv("AZURE_EMBEDDING_ENDPOINT"),
+            api_key=os.getenv("AZURE_EMBEDDING_API_KEY"),
+            api_version=os.getenv("AZURE_EMBEDDING_VERSION"),
+        )
+        response = await client.embeddings.create(input=args, model=os.getenv("AZURE_EMBEDDING_DEPLOYMENT_NAME"))
+    elif provider == "openai":
+        _validate_model(model)
+        client = get_async_client("openai", api_key=os.getenv("OPENAI_API_KEY"))
+        response = await client.embeddings.create(input=args, model=model)
+    elif provider == "openrouter":
+        raise NotImplementedError("OpenRouter embedding support is not implemented yet")
+    elif provider == "local":
+        address = local_llm_address or "localhost:11434"
+        try:
+            client = get_async_client("local", base_url=_local_llm_base_url(address), api_key="not-needed")
+            response = await client.embeddings.create(input=args, model=model)
+        except Exception as e:
+            logging.error(f"LocalLLM embedding API error: {e}")
+            logging.warning("Falling back to local embedding")
+            return await asyncio.to_thread(request_to_local_embed, args)
+    else:
+        raise ValueError(f"Unknown provider: {provider}")
+    return [item.embedding for item in response.data]
+
+
+# 共有スケジューラで同時に実行するLLMリクエスト数の上限（プロセス全体）
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "1000"))
+
+
+class LLMScheduler:
+    """共有のイベントループ上で非同期のLLMリクエストを実行するスケジューラ
+
+    専用スレッドで1つのイベントループを動かし、各ステップから投入されたコルーチンを
+    セマフォで同時実行数を制限しながら実行します。スレッドを増やすことなく、
+    多数のリクエストを同時に送信できます。
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                loop = asyncio.new_event_loop()
+                started = threading.Event()
+
+                def run_loop():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(started.set)
+                    loop.run_forever()
+
+                threading.Thread(target=run_loop, name="llm-scheduler", daemon=True).start()
+                started.wait()
+                self._loop = loop
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            return self._loop
+
+    async def _run(self, coro_fn, kwargs: dict, limiter: asyncio.Semaphore | None, bounded: bool = True):
+        if not bounded:
+            return await coro_fn(**kwargs)
+        # memo: 呼び出し側の上限を先に取得し、待機中のリクエストが全体の枠を占有しないようにする
+        if limiter is None:
+            async with self._semaphore:
+                return await coro_fn(**kwargs)
+        async with limiter:
+            async with self._semaphore:
+                return await coro_fn(**kwargs)
+
+    def submit(self, coro_fn, **kwargs) -> concurrent.futures.Future:
+        """コルーチン関数を共有ループに投入し、結果を受け取るFutureを返す"""
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self._run(coro_fn, kwargs, None), loop)
+
+    def map(
+        self,
+        coro_fn,
+        kwargs_list: list[dict],
+        max_concurrency: int | None = None,
+        on_result: Callable[[int, object], None] | None = None,
+        return_exceptions: bool = False,
+        batchable: bool = False,
+    ) -> list:
+        """kwargs_listの各要素を引数にcoro_fnを並行実行し、入力順に結果を返す
+
+        Args:
+            coro_fn: 実行するコルーチン関数
+            kwargs_list: coro_fnに渡すキーワード引数のリスト
+            max_concurrency: この呼び出しで同時に実行する最大数（Noneの場合は全体の上限のみ）
+            on_result: 完了した順に(インデックス, 結果)で呼ばれるコールバック。呼び出し元のスレッドで実行される
+            return_exceptions: Trueの場合、例外を結果として返す。Falseの場合は全件完了後に最初の例外を送出する
+            batchable: coro_fnがarequest_to_chat_aiだけを呼ぶ場合はTrue。Batch APIモードでは同時実行数の上限を
+                適用せずに全件を投入し、リクエストを1つのバッチジョブにまとめられるようにする
+
+        Returns:
+            入力順に並んだ結果のリスト
+        """
+        loop = self._ensure_loop()
+        bounded = not (batchable and is_batch_mode())
+        limiter = asyncio.Semaphore(max_concurrency) if max_concurrency and bounded else None
+        future_to_index = {
+            asyncio.run_coroutine_threadsafe(self._run(coro_fn, kwargs, limiter, bounded), loop): i
+            for i, kwargs in enumerate(kwargs_list)
+        }
+        results = [None] * len(kwargs_list)
+        first_error = None
+        for future in concurrent.futures.as_completed(future_to_index):
+            i = future_to_index[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = e
+                first_error = first_error or e
+            results[i] = result
+            if on_result is not None:
+                on_result(i, result)
+        if first_error is not None and not return_exceptions:
+            raise first_error
+        return results
+
+
+_scheduler = LLMScheduler()
+
+
+def get_scheduler() -> LLMScheduler:
+    """プロセス全体で共有するLLMSchedulerを返す関数"""
+    return _scheduler
+
+
+def run_chat_requests(
+    requests: list[dict],
+    max_concurrency: int | None = None,
+    on_result: Callable[[int, object], None] | None = None,
+) -> list:
+    """arequest_to_chat_aiへの複数のリクエストを共有スケジューラで並行実行する関数
+
+    Args:
+        requests: request_to_chat_aiと同じキーワード引数の辞書のリスト
+        max_concurrency: 同時に実行する最大リクエスト数
+        on_result: 完了した順に(インデックス, 結果)で呼ばれるコールバック
+
+    Returns:
+        入力順に並んだ(レスポンス, 入力トークン, 出力トークン, 合計トークン)のリスト。
+        失敗したリクエストは例外オブジェクトが格納される
+    """
+    return _scheduler.map(
+        arequest_to_chat_ai,
+        requests,
+        max_concurrency=max_concurrency,
+        on_result=on_result,
+        return_exceptions=True,
+    )
 
 
 def _test():
@@ -548,10 +1284,7 @@ def request_to_openrouter_chatcompletion(
     token_usage_output = 0  # 出力トークン使用量を追跡する変数
     token_usage_total = 0  # 合計トークン使用量を追跡する変数
 
-    client = OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=api_key,
-    )
+    client = get_client("openrouter", base_url="https://openrouter.ai/api/v1", api_key=api_key)
 
     try:
         if isinstance(json_schema, type) and issubclass(json_schema, BaseModel):
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from pydantic import BaseModel
+
+DEFAULT_CACHE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../cache/llm"))
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024  # 1GB
+
+
+def _schema_fingerprint(json_schema: dict | type[BaseModel] | None) -> dict | None:
+    if isinstance(json_schema, type) and issubclass(json_schema, BaseModel):
+        return {"name": json_schema.__name__, "schema": json_schema.model_json_schema()}
+    return json_schema
+
+
+def make_cache_key(
+    provider: str,
+    model: str,
+    messages: list[dict],
+    json_schema: dict | type[BaseModel] | None = None,
+    is_json: bool = False,
+    temperature: float = 0,
+    seed: int = 0,
+) -> str:
+    """リクエスト内容から、キャッシュのキーとなるsha256ハッシュを計算する"""
+    payload = {
+        "provider": provider,
+        "model": model,
+        "messages": messages,
+        "json_schema": _schema_fingerprint(json_schema),
+        "is_json": is_json,
+        "temperature": temperature,
+        "seed": seed,
+    }
+    serialized = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """LLMのレスポンスをリクエスト内容のハッシュで保存するディスクキャッシュ
+
+    エントリは1件1ファイルで保存し、合計サイズがmax_bytesを超えたら
+    最終アクセス時刻（mtime）が古い順に削除します（LRU）。
+    複数のレポートから同時に利用できるよう、書き込みは一時ファイルとrenameで行います。
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size_bytes: int | None = None
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+            # memo: mtimeを更新して最近使ったエントリとして扱う
+            os.utime(path)
+        except (FileNotFoundError, json.JSONDecodeError, OSError):
+            with self._lock:
+                self._stats["misses"] += 1
+            return None
+        with self._lock:
+            self._stats["hits"] += 1
+        return entry["response"]
+
+    def set(self, key: str, response) -> None:
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            data = json.dumps({"response": response}, ensure_ascii=False).encode("utf-8")
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError) as e:
+            logging.warning(f"Failed to write LLM cache entry: {e}")
+            return
+        with self._lock:
+            self._stats["writes"] += 1
+            if self._size_bytes is None:
+                self._size_bytes = self._scan_size()
+            else:
+                self._size_bytes += len(data)
+            if self._size_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self) -> list[tuple[str, float, int]]:
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def _scan_size(self) -> int:
+        return sum(size for _, _, size in self._entries())
+
+    def _evict(self) -> None:
+        # 他プロセスの書き込みも反映するため、削除時はディレクトリを走査し直す
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        # 上限ちょうどで削除を繰り返さないよう、上限の9割まで減らす
+        target = self.max_bytes * 0.9
+        for path, _, size in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self._stats["evictions"] += 1
+        self._size_bytes = total
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+_response_cache: LLMResponseCache | None = None
+
+
+def configure_response_cache(
+    enabled: bool,
+    cache_dir: str | None = None,
+    max_bytes: int | None = None,
+) -> LLMResponseCache | None:
+    """LLMレスポンスキャッシュを有効化・無効化する関数"""
+    global _response_cache
+    if not enabled:
+        _response_cache = None
+        return None
+    _response_cache = LLMResponseCache(cache_dir or DEFAULT_CACHE_DIR, max_bytes or DEFAULT_MAX_BYTES)
+    return _response_cache
+
+
+def get_response_cache() -> LLMResponseCache | None:
+    return _response_cache
+
+
+def get_response_cache_stats() -> dict[str, int] | None:
+    """キャッシュのヒット・ミス数を返す関数（無効の場合はNone）"""
+    if _response_cache is None:
+        return None
+    return _response_cache.stats()
@@ -0,0 +1,102 @@
+import threading
+
+import numpy as np
+
+LOCAL_EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-mpnet-base-v2"
+DEFAULT_LOCAL_BATCH_SIZE = 32
+
+
+class LocalEmbeddingEngine:
+    """sentence-transformersでローカルに埋め込みを計算するエンジン
+
+    モデルは最初のencode呼び出し時に一度だけロードし、プロセス内で共有する。
+    入力は文字数の長い順に並べ替えてからバッチに分けるため、同じバッチ内のパディングが少なくなる。
+    processesに2以上を指定すると、sentence-transformersのマルチプロセスプールでCPUコアに分散して計算する。
+    deviceを指定しない場合はsentence-transformersが利用可能なデバイス（CUDA・MPS・CPU）を選ぶ。
+    """
+
+    def __init__(self, model_name: str = LOCAL_EMBEDDING_MODEL, device: str | None = None):
+        self.model_name = model_name
+        self.device = device
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        # memo: モデルのロードは重いため、複数スレッドから同時に呼ばれても一度だけ行う
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+
+                self._model = SentenceTransformer(self.model_name, device=self.device)
+        return self._model
+
+    def encode(
+        self,
+        texts: list[str],
+        batch_size: int = DEFAULT_LOCAL_BATCH_SIZE,
+        processes: int = 1,
+        normalize: bool = False,
+        show_progress: bool = False,
+    ) -> np.ndarray:
+        """textsの埋め込みを(件数, 次元数)のfloat32行列として返す
+
+        Args:
+            texts: 埋め込みを計算する文章
+            batch_size: 1回の順伝播で処理する文章数
+            processes: 計算に使うプロセス数（1の場合は呼び出し元のプロセスでモデルのデバイスを使って計算し、
+                2以上の場合はCPUのプロセスに分散する）
+            normalize: Trueの場合、各ベクトルをL2ノルム1に正規化する
+            show_progress: Trueの場合、進捗バーを表示する
+
+        Returns:
+            textsと同じ順序の埋め込み行列
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+
+        # 長さの近い文章が同じバッチに入るよう、長い順に並べ替えて計算し、最後に元の順序へ戻す
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        sorted_texts = [texts[i] for i in order]
+
+        model = self.model
+        if processes > 1:
+            pool = model.start_multi_process_pool(target_devices=["cpu"] * processes)
+            try:
+                sorted_embeddings = model.encode_multi_process(
+                    sorted_texts,
+                    pool,
+                    batch_size=batch_size,
+                    show_progress_bar=show_progress,
+                    normalize_embeddings=normalize,
+                )
+            finally:
+                model.stop_multi_process_pool(pool)
+        else:
+            sorted_embeddings = model.encode(
+                sorted_texts,
+                batch_size=batch_size,
+                show_progress_bar=show_progress,
+                convert_to_numpy=True,
+                normalize_embeddings=normalize,
+            )
+
+        embeddings = np.empty((len(texts), sorted_embeddings.shape[1]), dtype=np.float32)
+        embeddings[order] = sorted_embeddings
+        return embeddings
+
+
+_engines: dict[str | None, LocalEmbeddingEngine] = {}
+_engine_lock = threading.Lock()
+
+
+def get_local_embedding_engine(device: str | None = None) -> LocalEmbeddingEngine:
+    """プロセス全体で共有するLocalEmbeddingEngineを返す（デバイスごとに1つ）
+
+    Args:
+        device: "cpu"・"cuda"・"mps"など。Noneの場合はsentence-transformersが自動で選ぶ
+    """
+    with _engine_lock:
+        if device not in _engines:
+            _engines[device] = LocalEmbeddingEngine(device=device)
+        return _engines[device]
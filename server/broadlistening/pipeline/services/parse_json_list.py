@@ -102,6 +102,30 @@ def parse_extraction_response(response: str | dict) -> list[str]:
         return []
 
 
+def parse_packed_extraction_response(response: str | dict) -> dict[str, list[str]]:
+    """
+    複数のコメントをまとめて抽出した場合のstructured outputをパースする。
+    responseは以下のような形式の文字列またはdict。
+    {"results": [{"commentId": "0", "extractedOpinionList": ["arg1", "arg2"]}, ...]}
+    戻り値はcommentIdから意見のリストへの辞書で、パースできなかったコメントは含まれない。
+    """
+    try:
+        response_dict = response if isinstance(response, dict) else json.loads(response)
+        results = response_dict["results"]
+    except (json.JSONDecodeError, KeyError, TypeError) as e:
+        print("Failed to parse packed extraction response", response, e)
+        return {}
+
+    parsed = {}
+    for result in results if isinstance(results, list) else []:
+        if not isinstance(result, dict):
+            continue
+        opinions = result.get("extractedOpinionList")
+        if "commentId" in result and isinstance(opinions, list):
+            parsed[str(result["commentId"])] = opinions
+    return parsed
+
+
 if __name__ == "__main__":
     import doctest
 
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import threading
+import time
+
+
+class TokenBucket:
+    """1分あたりの量で指定するトークンバケット
+
+    予約した量は即座に差し引き（残量はマイナスになり得る）、残量が0に戻るまでの待ち時間を返す。
+    待ち時間の計算だけをロック内で行うため、スレッドからもイベントループからも同じバケットを共有できる。
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        self._refill(now)
+        # 1回で上限を超える量を要求された場合でも、永久に待たないよう上限までに丸める
+        self.level -= min(amount, self.capacity)
+        return max(0.0, -self.level / self.rate)
+
+    def adjust(self, delta: float, now: float) -> None:
+        self._refill(now)
+        self.level = min(self.capacity, self.level - delta)
+
+
+class RateLimiter:
+    """(provider, model)ごとのリクエスト数(RPM)とトークン数(TPM)の上限を守るためのレート制限
+
+    送信前に推定トークン数で予約し、レスポンス受信後に実際の使用量との差分を反映する。
+    """
+
+    def __init__(self, rpm: float | None = None, tpm: float | None = None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = TokenBucket(rpm) if rpm else None
+        self._tokens = TokenBucket(tpm) if tpm else None
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "throttled": 0, "wait_seconds": 0.0}
+
+    def _reserve(self, tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            if self._requests is not None:
+                wait = max(wait, self._requests.reserve(1, now))
+            if self._tokens is not None:
+                wait = max(wait, self._tokens.reserve(tokens, now))
+            self._stats["requests"] += 1
+            if wait > 0:
+                self._stats["throttled"] += 1
+                self._stats["wait_seconds"] += wait
+            return wait
+
+    def acquire(self, tokens: int = 0) -> None:
+        """リクエストを送信できるまで待つ（スレッド用）"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int = 0) -> None:
+        """acquireの非同期版"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """推定トークン数と実際の使用量の差分をバケットに反映する"""
+        if self._tokens is None or not actual_tokens:
+            return
+        with self._lock:
+            self._tokens.adjust(actual_tokens - estimated_tokens, time.monotonic())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"rpm": self.rpm, "tpm": self.tpm, **self._stats}
+
+
+# memo: キーは"provider:model"。modelを"*"にするとそのプロバイダーの全モデルに適用する
+_rate_limits: dict[str, dict] = {}
+_limiters: dict[tuple[str, str], RateLimiter | None] = {}
+_limiters_lock = threading.Lock()
+
+
+def configure_rate_limits(limits: dict[str, dict] | str | None) -> None:
+    """レート制限の設定を登録する関数
+
+    Args:
+        limits: {"openai:gpt-4o-mini": {"rpm": 500, "tpm": 200000}, "local:*": {"rpm": 60}}の形式の辞書、
+            またはそのJSON文字列。Noneまたは空の場合はレート制限を行わない
+    """
+    global _rate_limits
+    if isinstance(limits, str):
+        limits = json.loads(limits) if limits.strip() else None
+    with _limiters_lock:
+        _rate_limits = dict(limits or {})
+        _limiters.clear()
+
+
+def get_rate_limiter(provider: str, model: str) -> RateLimiter | None:
+    """(provider, model)に対応するRateLimiterを返す。設定がない場合はNone
+
+    同じ(provider, model)には同じインスタンスを返すため、全スレッド・全ステップで上限を共有する。
+    """
+    key = (provider, model)
+    with _limiters_lock:
+        if key not in _limiters:
+            limit = _rate_limits.get(f"{provider}:{model}") or _rate_limits.get(f"{provider}:*")
+            _limiters[key] = RateLimiter(limit.get("rpm"), limit.get("tpm")) if limit else None
+        return _limiters[key]
+
+
+def get_rate_limiter_stats() -> dict[str, dict] | None:
+    """レート制限の待ち回数・待ち時間を(provider:model)ごとに返す。設定がない場合はNone"""
+    with _limiters_lock:
+        limiters = {f"{p}:{m}": limiter for (p, m), limiter in _limiters.items() if limiter is not None}
+    if not limiters:
+        return None
+    return {key: limiter.stats() for key, limiter in limiters.items()}
@@ -0,0 +1,101 @@
+import hashlib
+import re
+import unicodedata
+import zlib
+
+import numpy as np
+
+WHITESPACE = re.compile(r"\s+")
+
+# MinHashの設定（64個のハッシュ関数を4個ずつ16バンドに分けてLSHで候補を絞る）
+MINHASH_NUM_PERM = 64
+MINHASH_BANDS = 16
+SHINGLE_SIZE = 3
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+def normalize_text(text: str) -> str:
+    """重複判定用にテキストを正規化する（NFKC正規化・前後の空白除去・連続する空白の圧縮）"""
+    return WHITESPACE.sub(" ", unicodedata.normalize("NFKC", str(text))).strip()
+
+
+def find_duplicates(texts: list[str], mode: str = "exact", threshold: float = 0.9) -> list[int]:
+    """各テキストについて、同じ内容とみなす代表テキストのインデックスを返す関数
+
+    代表は同じグループ内で最初に出現したテキストで、重複のないテキストは自身のインデックスになる。
+
+    Args:
+        texts: 判定するテキストのリスト
+        mode: "exact"は正規化後の完全一致、"near"はMinHashで推定したJaccard類似度が
+            threshold以上のものも同一とみなす。"none"は重複判定をしない
+        threshold: mode="near"の場合の類似度のしきい値
+
+    Returns:
+        textsと同じ長さの代表インデックスのリスト
+    """
+    if mode == "none":
+        return list(range(len(texts)))
+    if mode not in ("exact", "near"):
+        raise ValueError(f"Unknown dedup mode: {mode}")
+
+    normalized = [normalize_text(text) for text in texts]
+    first_index: dict[str, int] = {}
+    representatives = []
+    for i, text in enumerate(normalized):
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        representatives.append(first_index.setdefault(key, i))
+    if mode == "near":
+        representatives = _merge_near_duplicates(normalized, representatives, threshold)
+    return representatives
+
+
+def _shingles(text: str) -> np.ndarray:
+    if len(text) <= SHINGLE_SIZE:
+        grams = {text}
+    else:
+        grams = {text[i : i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    return np.array([zlib.crc32(gram.encode("utf-8")) for gram in grams], dtype=np.uint64)
+
+
+def _minhash_signatures(texts: list[str]) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    a = rng.integers(1, _MERSENNE_PRIME, size=MINHASH_NUM_PERM, dtype=np.uint64)
+    b = rng.integers(0, _MERSENNE_PRIME, size=MINHASH_NUM_PERM, dtype=np.uint64)
+    signatures = np.empty((len(texts), MINHASH_NUM_PERM), dtype=np.uint64)
+    for i, text in enumerate(texts):
+        shingles = _shingles(text)
+        # (a * x + b) mod p をuint64の範囲で計算する（オーバーフローは許容し、近似的なハッシュとして扱う）
+        hashed = (shingles[:, None] * a[None, :] + b[None, :]) % np.uint64(_MERSENNE_PRIME)
+        signatures[i] = hashed.min(axis=0)
+    return signatures
+
+
+def _merge_near_duplicates(texts: list[str], representatives: list[int], threshold: float) -> list[int]:
+    # 完全一致の代表同士だけを比較し、LSHで同じバケットに入ったペアを類似度で確認してまとめる
+    unique = sorted(set(representatives))
+    signatures = _minhash_signatures([texts[i] for i in unique])
+    parent = list(range(len(unique)))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    rows = MINHASH_NUM_PERM // MINHASH_BANDS
+    for band in range(MINHASH_BANDS):
+        buckets: dict[bytes, list[int]] = {}
+        for j, signature in enumerate(signatures[:, band * rows : (band + 1) * rows]):
+            buckets.setdefault(signature.tobytes(), []).append(j)
+        for members in buckets.values():
+            for other in members[1:]:
+                root_a, root_b = find(members[0]), find(other)
+                if root_a == root_b:
+                    continue
+                similarity = np.mean(signatures[members[0]] == signatures[other])
+                if similarity >= threshold:
+                    # 出現順が早い方を代表にする
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    merged = {unique[j]: unique[find(j)] for j in range(len(unique))}
+    return [merged[r] for r in representatives]
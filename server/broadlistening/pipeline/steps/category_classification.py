@@ -0,0 +1,19 @@
+"""Classify the extracted arguments into the configured categories."""
+
+import pandas as pd
+
+from services.category_classification import classify_args
+
+
+def category_classification(config):
+    dataset = config["output_dir"]
+    path = f"outputs/{dataset}/arg_categories.csv"
+    args = pd.read_csv(f"outputs/{dataset}/args.csv", usecols=["arg-id", "argument"])
+
+    if not config["category_classification"]["categories"]:
+        # 分類するカテゴリがない場合も、集約ステップが読み込めるようにarg-idだけのファイルを出力する
+        args[["arg-id"]].to_csv(path, index=False)
+        return
+
+    results = classify_args(args, config, config["category_classification"]["workers"])
+    results.drop(columns=["argument"]).to_csv(path, index=False)
@@ -1,23 +1,134 @@
+import numpy as np
+import openai
 import pandas as pd
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 from tqdm import tqdm
 
-from services.llm import request_to_embed
+from services.embedding_cache import EmbeddingCache, embedding_model_key
+from services.embedding_store import save_embeddings
+from services.llm import arequest_to_embed, estimate_tokens, get_scheduler
+from services.local_embedding import DEFAULT_LOCAL_BATCH_SIZE, get_local_embedding_engine
 
 
 def embedding(config):
     model = config["embedding"]["model"]
     is_embedded_at_local = config["is_embedded_at_local"]
+    use_cache = config["embedding"]["use_cache"]
+    batch_size = config["embedding"]["batch_size"]
+    max_batch_tokens = config["embedding"]["max_batch_tokens"]
+    concurrency = config["embedding"]["concurrency"]
+    normalize = config["embedding"].get("normalize", False)
     # print("start embedding")
     # print(f"embedding model: {model}, is_embedded_at_local: {is_embedded_at_local}")
 
     dataset = config["output_dir"]
-    path = f"outputs/{dataset}/embeddings.pkl"
     arguments = pd.read_csv(f"outputs/{dataset}/args.csv", usecols=["arg-id", "argument"])
-    embeddings = []
-    batch_size = 1000
-    for i in tqdm(range(0, len(arguments), batch_size)):
-        args = arguments["argument"].tolist()[i : i + batch_size]
-        embeds = request_to_embed(args, model, is_embedded_at_local, config["provider"])
-        embeddings.extend(embeds)
-    df = pd.DataFrame([{"arg-id": arguments.iloc[i]["arg-id"], "embedding": e} for i, e in enumerate(embeddings)])
-    df.to_pickle(path)
+    texts = arguments["argument"].tolist()
+
+    # 以前に同じモデルで埋め込んだ意見はキャッシュから取得し、それ以外だけをリクエストする
+    cache = EmbeddingCache() if use_cache else None
+    model_key = embedding_model_key(
+        model, is_embedded_at_local, config["provider"], local_llm_address=config.get("local_llm_address")
+    )
+    cached_embeddings = cache.get_many(model_key, texts) if cache else [None] * len(texts)
+    missing_texts = list(dict.fromkeys(text for text, e in zip(texts, cached_embeddings, strict=True) if e is None))
+    hits = len(texts) - sum(e is None for e in cached_embeddings)
+    print(f"Embedding cache: hits={hits}, misses={len(texts) - hits}, requests={len(missing_texts)} texts")
+
+    new_embeddings = {}
+
+    def store(args, embeds):
+        if cache and args:
+            cache.put_many(model_key, args, embeds)
+        new_embeddings.update(zip(args, embeds, strict=True))
+
+    try:
+        if is_embedded_at_local:
+            # ローカル埋め込みはAPIのリクエスト単位に分ける必要がないため、全件をまとめてエンジンに渡す
+            # （エンジン側で長さ順に並べ替えてlocal_batch_size件ずつ計算する）
+            embeds = get_local_embedding_engine(config["embedding"].get("local_device")).encode(
+                missing_texts,
+                batch_size=config["embedding"].get("local_batch_size", DEFAULT_LOCAL_BATCH_SIZE),
+                processes=config["embedding"].get("local_processes", 1),
+                show_progress=True,
+            )
+            store(missing_texts, embeds)
+        else:
+            batches = build_batches(missing_texts, batch_size, max_batch_tokens)
+            request_embeddings(batches, config, concurrency, store)
+    finally:
+        if cache:
+            cache.close()
+
+    config["embedding_cache_stats"] = {"hits": hits, "misses": len(texts) - hits}
+    # Pythonのリストを経由せず、float32の行列に直接詰める
+    # （キャッシュの有無で結果が変わらないよう、常にfloat32の精度に揃える）
+    embeddings = None
+    for i, (text, cached) in enumerate(zip(texts, cached_embeddings, strict=True)):
+        vector = cached if cached is not None else new_embeddings[text]
+        if embeddings is None:
+            embeddings = np.empty((len(texts), len(vector)), dtype=np.float32)
+        embeddings[i] = vector
+    if embeddings is None:
+        embeddings = np.empty((0, 0), dtype=np.float32)
+    if normalize:
+        # キャッシュには正規化前のベクトルを保存しているため、正規化は最後にまとめて行う
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        np.divide(embeddings, norms, out=embeddings, where=norms > 0)
+    save_embeddings(f"outputs/{dataset}", arguments["arg-id"].tolist(), embeddings)
+
+
+def request_embeddings(batches: list[list[str]], config, concurrency: int, on_embedded) -> None:
+    """batchesをconcurrency件ずつ並行してAPIに送信し、完了したバッチごとにon_embedded(args, embeds)を呼ぶ"""
+    progress = tqdm(total=len(batches))
+
+    def on_result(index, embeds):
+        progress.update(1)
+        if not isinstance(embeds, Exception):
+            on_embedded(batches[index], embeds)
+
+    try:
+        get_scheduler().map(
+            embed_batch,
+            [
+                {
+                    "args": args,
+                    "model": config["embedding"]["model"],
+                    "provider": config["provider"],
+                    "local_llm_address": config.get("local_llm_address"),
+                }
+                for args in batches
+            ],
+            max_concurrency=concurrency,
+            on_result=on_result,
+        )
+    finally:
+        progress.close()
+
+
+def build_batches(texts: list[str], batch_size: int, max_batch_tokens: int) -> list[list[str]]:
+    """件数がbatch_size以下、推定トークン数の合計がmax_batch_tokens以下になるようにtextsを分割する"""
+    batches = []
+    current = []
+    current_tokens = 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if current and (len(current) >= batch_size or current_tokens + tokens > max_batch_tokens):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+@retry(
+    retry=retry_if_exception_type(openai.RateLimitError),
+    wait=wait_exponential(multiplier=2, min=2, max=60),
+    stop=stop_after_attempt(6),
+    reraise=True,
+)
+async def embed_batch(args, model, is_embedded_at_local=False, provider="openai", local_llm_address=None):
+    return await arequest_to_embed(args, model, is_embedded_at_local, provider, local_llm_address)
@@ -1,16 +1,20 @@
-import concurrent.futures
+import asyncio
 import json
 import logging
 import re
 
+import numpy as np
+import openai
 import pandas as pd
+from hierarchical_utils import mark_incomplete, record_token_usage, update_progress
 from pydantic import BaseModel, Field
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 from tqdm import tqdm
 
-from services.category_classification import classify_args
-from services.llm import request_to_chat_ai
-from services.parse_json_list import parse_extraction_response
-from utils import update_progress
+from services.extraction_journal import ExtractionJournal
+from services.llm import arequest_to_chat_ai, estimate_tokens, get_scheduler
+from services.parse_json_list import parse_extraction_response, parse_packed_extraction_response
+from services.text_dedup import find_duplicates
 
 COMMA_AND_SPACE_AND_RIGHT_BRACKET = re.compile(r",\s*(\])")
 
@@ -19,11 +23,54 @@ class ExtractionResponse(BaseModel):
     extractedOpinionList: list[str] = Field(..., description="抽出した意見のリスト")
 
 
+class PackedExtractionItem(BaseModel):
+    commentId: str = Field(..., description="入力で指定されたコメントのID")
+    extractedOpinionList: list[str] = Field(..., description="そのコメントから抽出した意見のリスト")
+
+
+class PackedExtractionResponse(BaseModel):
+    results: list[PackedExtractionItem] = Field(..., description="コメントごとの抽出結果のリスト")
+
+
+# 複数のコメントを1リクエストにまとめる場合に、ユーザーが設定したプロンプトの後ろに追加する指示
+PACKED_EXTRACTION_INSTRUCTION = """
+
+# 複数コメントの一括処理
+入力は {"commentId": ID, "comment": コメント本文} のJSON配列で、複数のコメントが含まれます。
+各コメントについて上記の指示に従って個別に意見を抽出し、他のコメントの内容を混ぜないでください。
+出力は {"results": [{"commentId": ID, "extractedOpinionList": [意見, ...]}, ...]} の形式とし、
+入力の全てのcommentIdについて結果を1つずつ含めてください。"""
+
+
 def _validate_property_columns(property_columns: list[str], comments: pd.DataFrame) -> None:
     if not all(property in comments.columns for property in property_columns):
         raise ValueError(f"Properties {property_columns} not found in comments. Columns are {comments.columns}")
 
 
+def load_comments(path: str, limit: int, chunksize: int = 100_000) -> tuple[np.ndarray, list]:
+    """入力CSVからcomment-idとcomment-bodyを先頭からlimit件だけ読み込む
+
+    属性カラムなど抽出に使わないカラムは読み込まず、chunksize行ずつ読み進めてlimit件に達したら読み込みを打ち切るため、
+    巨大な入力でもメモリ使用量はlimit件分に収まる。
+
+    Returns:
+        (comment-idの配列, comment-bodyのリスト)
+    """
+    ids = []
+    bodies = []
+    remaining = limit
+    with pd.read_csv(path, usecols=["comment-id", "comment-body"], chunksize=chunksize) as reader:
+        for chunk in reader:
+            chunk = chunk.iloc[:remaining]
+            ids.append(chunk["comment-id"].to_numpy())
+            bodies.extend(chunk["comment-body"].tolist())
+            remaining -= len(chunk)
+            if remaining <= 0:
+                break
+    comment_ids = np.concatenate(ids) if ids else np.array([])
+    return comment_ids, bodies
+
+
 def extraction(config):
     dataset = config["output_dir"]
     path = f"outputs/{dataset}/args.csv"
@@ -40,45 +87,147 @@ def extraction(config):
     # カラム名だけを読み込み、必要なカラムが含まれているか確認する
     comments = pd.read_csv(f"inputs/{config['input']}.csv", nrows=0)
     _validate_property_columns(property_columns, comments)
-    # エラーが出なかった場合、すべての行を読み込む
-    comments = pd.read_csv(
-        f"inputs/{config['input']}.csv", usecols=["comment-id", "comment-body"] + config["extraction"]["properties"]
-    )
-    comment_ids = (comments["comment-id"].values)[:limit]
-    comments.set_index("comment-id", inplace=True)
-    results = pd.DataFrame()
-    update_progress(config, total=len(comment_ids))
+    # エラーが出なかった場合、抽出に必要なcomment-idとcomment-bodyだけを先頭からlimit件読み込む
+    comment_ids, bodies = load_comments(f"inputs/{config['input']}.csv", limit)
+    update_progress(config, "extraction", total=len(comment_ids))
 
     argument_map = {}
     relation_rows = []
 
-    for i in tqdm(range(0, len(comment_ids), workers)):
-        batch = comment_ids[i : i + workers]
-        batch_inputs = [comments.loc[id]["comment-body"] for id in batch]
-        batch_results = extract_batch(
-            batch_inputs, prompt, model, workers, provider, config.get("local_llm_address"), config
+    def add_extracted_args(comment_id, extracted_args):
+        for j, arg in enumerate(extracted_args):
+            if arg not in argument_map:
+                # argumentテーブルに追加
+                arg_id = f"A{comment_id}_{j}"
+                argument_map[arg] = {
+                    "arg-id": arg_id,
+                    "argument": arg,
+                }
+            else:
+                arg_id = argument_map[arg]["arg-id"]
+
+            # relationテーブルにcommentとargの関係を追加
+            relation_row = {
+                "arg-id": arg_id,
+                "comment-id": comment_id,
+            }
+            relation_rows.append(relation_row)
+
+    # 前回の実行が途中で中断されていた場合、同じ抽出条件で抽出済みのコメントはジャーナルから復元する（-fの場合は復元しない）
+    journal = ExtractionJournal(
+        f"outputs/{dataset}/extraction_journal.jsonl",
+        prompt,
+        model,
+        provider,
+        options={
+            "dedup": config["extraction"].get("dedup", "exact"),
+            "near_duplicate_threshold": config["extraction"].get("near_duplicate_threshold", 0.9),
+            "packing": config["extraction"].get("packing", False),
+            "pack_max_tokens": config["extraction"].get("pack_max_tokens", 2000),
+            "pack_max_comments": config["extraction"].get("pack_max_comments", 10),
+        },
+        enabled=not config.get("force", False),
+    )
+    # memo: 完了順に届く結果を入力順に並べ直してから反映し、arg-idの採番を実行ごとに安定させる
+    pending_results = {}
+    for i, (comment_id, body) in enumerate(zip(comment_ids, bodies, strict=True)):
+        restored = journal.get(comment_id, body)
+        if restored is not None:
+            pending_results[i] = restored
+    # 同じ本文（正規化後）のコメントはLLMに1回だけ問い合わせ、結果を全てのコメントに割り当てる
+    representatives = find_duplicates(
+        bodies,
+        mode=config["extraction"].get("dedup", "exact"),
+        threshold=config["extraction"].get("near_duplicate_threshold", 0.9),
+    )
+    groups = {}
+    for i, representative in enumerate(representatives):
+        if i not in pending_results:
+            groups.setdefault(representative, []).append(i)
+    todo = list(groups)
+    # packingが有効な場合は、短いコメントを推定トークン数の上限までまとめて1リクエストで抽出する
+    if config["extraction"].get("packing", False):
+        packs = build_packs(
+            [bodies[representative] for representative in todo],
+            config["extraction"].get("pack_max_tokens", 2000),
+            config["extraction"].get("pack_max_comments", 10),
+        )
+        packs = [[todo[k] for k in pack] for pack in packs]
+    else:
+        packs = [[representative] for representative in todo]
+    unique_count = len(set(representatives))
+    config["extraction_dedup_stats"] = {
+        "comments": len(comment_ids),
+        "unique_bodies": unique_count,
+        "dedup_ratio": round(1 - unique_count / len(comment_ids), 4) if len(comment_ids) else 0.0,
+    }
+    print(
+        f"Extraction: {len(comment_ids)} comments, {unique_count} unique bodies "
+        f"(dedup ratio {config['extraction_dedup_stats']['dedup_ratio']:.1%})"
+    )
+    if pending_results:
+        print(
+            f"Extraction: resuming, {len(pending_results)} comments restored from journal, {len(todo)} requests remaining"
         )
+    failed_comment_ids = []
+    next_index = 0
+    progress = tqdm(total=len(comment_ids), initial=len(pending_results))
 
-        for comment_id, extracted_args in zip(batch, batch_results, strict=False):
-            for j, arg in enumerate(extracted_args):
-                if arg not in argument_map:
-                    # argumentテーブルに追加
-                    arg_id = f"A{comment_id}_{j}"
-                    argument_map[arg] = {
-                        "arg-id": arg_id,
-                        "argument": arg,
-                    }
+    def flush_results():
+        nonlocal next_index
+        flushed = 0
+        while next_index in pending_results:
+            add_extracted_args(comment_ids[next_index], pending_results.pop(next_index))
+            next_index += 1
+            flushed += 1
+        if flushed:
+            update_progress(config, "extraction", incr=flushed)
+
+    def on_result(index, result):
+        pack = packs[index]
+        items_per_comment, token_input, token_output, token_total = _unpack_extraction_result(
+            result, [comment_ids[representative] for representative in pack]
+        )
+        record_token_usage(config, "extraction", token_input, token_output, token_total)
+        for representative, items in zip(pack, items_per_comment, strict=True):
+            for i in groups[representative]:
+                if isinstance(result, Exception):
+                    # 失敗したコメントはジャーナルに記録せず、次回の実行で再抽出する
+                    failed_comment_ids.append(comment_ids[i])
                 else:
-                    arg_id = argument_map[arg]["arg-id"]
+                    journal.append(comment_ids[i], bodies[i], items)
+                pending_results[i] = items
+            progress.update(len(groups[representative]))
+        flush_results()
 
-                # relationテーブルにcommentとargの関係を追加
-                relation_row = {
-                    "arg-id": arg_id,
-                    "comment-id": comment_id,
+    flush_results()
+    # 共有スケジューラに未処理のコメントを投入し、常にworkers件のリクエストが実行中になるようにする
+    try:
+        get_scheduler().map(
+            extract_pack,
+            [
+                {
+                    "inputs": [bodies[representative] for representative in pack],
+                    "prompt": prompt,
+                    "model": model,
+                    "provider": provider,
+                    "local_llm_address": config.get("local_llm_address"),
                 }
-                relation_rows.append(relation_row)
-
-        update_progress(config, incr=len(batch))
+                for pack in packs
+            ],
+            max_concurrency=workers,
+            on_result=on_result,
+            return_exceptions=True,
+            batchable=True,
+        )
+    finally:
+        journal.close()
+        progress.close()
+    usage = config.get("step_token_usage", {}).get("extraction", {})
+    print(
+        f"Extraction: input={usage.get('input', 0)}, output={usage.get('output', 0)}, "
+        f"total={usage.get('total', 0)} tokens"
+    )
 
     # DataFrame化
     results = pd.DataFrame(argument_map.values())
@@ -87,69 +236,121 @@ def extraction(config):
     if results.empty:
         raise RuntimeError("result is empty, maybe bad prompt")
 
-    classification_categories = config["extraction"]["categories"]
-    if classification_categories:
-        results = classify_args(results, config, workers)
-
     results.to_csv(path, index=False)
     # comment-idとarg-idの関係を保存
     relation_df.to_csv(f"outputs/{dataset}/relations.csv", index=False)
+    config["extraction_failed_comments"] = len(failed_comment_ids)
+    if failed_comment_ids:
+        # 失敗したコメントは意見なしとして保存し、ジャーナルを残して次回の実行で失敗したコメントだけを再抽出する
+        print(f"Extraction: {len(failed_comment_ids)} comments failed and will be retried on the next run")
+        mark_incomplete(config, "extraction", f"{len(failed_comment_ids)} comments failed")
+    else:
+        # 全てのコメントの結果を保存できたので、再開用のジャーナルは不要になる
+        journal.remove()
 
 
 logging.basicConfig(level=logging.ERROR)
 
 
-def extract_batch(batch, prompt, model, workers, provider="openai", local_llm_address=None, config=None):
-    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
-        futures_with_index = [
-            (i, executor.submit(extract_arguments, input, prompt, model, provider, local_llm_address))
-            for i, input in enumerate(batch)
-        ]
-
-        done, not_done = concurrent.futures.wait([f for _, f in futures_with_index], timeout=30)
-        results = [[] for _ in range(len(batch))]
-        total_token_input = 0
-        total_token_output = 0
-        total_token_usage = 0
-
-        for _, future in futures_with_index:
-            if future in not_done and not future.cancelled():
-                future.cancel()
-
-        for i, future in futures_with_index:
-            if future in done:
-                try:
-                    result = future.result()
-                    if isinstance(result, tuple) and len(result) == 4:
-                        items, token_input, token_output, token_total = result
-                        results[i] = items
-                        total_token_input += token_input
-                        total_token_output += token_output
-                        total_token_usage += token_total
-                    else:
-                        results[i] = result
-                except Exception as e:
-                    logging.error(f"Task {future} failed with error: {e}")
-                    results[i] = []
-
-        if config is not None:
-            config["total_token_usage"] = config.get("total_token_usage", 0) + total_token_usage
-            config["token_usage_input"] = config.get("token_usage_input", 0) + total_token_input
-            config["token_usage_output"] = config.get("token_usage_output", 0) + total_token_output
-            print(
-                f"Extraction batch: input={total_token_input}, output={total_token_output}, total={total_token_usage} tokens"
+def _unpack_extraction_result(result, comment_ids) -> tuple[list[list[str]], int, int, int]:
+    if isinstance(result, Exception):
+        logging.error(f"Extraction for comments {comment_ids} failed with error: {result}")
+        return [[] for _ in comment_ids], 0, 0, 0
+    return result
+
+
+def build_packs(texts: list[str], max_tokens: int, max_comments: int) -> list[list[int]]:
+    """推定トークン数の合計がmax_tokens以下、件数がmax_comments以下になるようにtextsのインデックスをまとめる
+
+    1件でmax_tokensを超えるテキストは単独のパックにする。
+    """
+    packs = []
+    current = []
+    current_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(str(text))
+        if current and (len(current) >= max_comments or current_tokens + tokens > max_tokens):
+            packs.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        packs.append(current)
+    return packs
+
+
+async def extract_pack(inputs, prompt, model, provider="openai", local_llm_address=None):
+    """inputsの各コメントから意見を抽出し、(コメントごとの意見のリスト, 入力トークン数, 出力トークン数, 合計トークン数)を返す"""
+    if len(inputs) == 1:
+        items, token_input, token_output, token_total = await extract_arguments(
+            inputs[0], prompt, model, provider, local_llm_address
+        )
+        return [items], token_input, token_output, token_total
+
+    results, token_input, token_output, token_total = await extract_packed_arguments(
+        inputs, prompt, model, provider, local_llm_address
+    )
+    items_per_comment = []
+    for k, input in enumerate(inputs):
+        items = results.get(str(k))
+        if items is None:
+            # まとめたリクエストの応答に含まれなかったコメントは、1件ずつ抽出し直す
+            items, retry_input, retry_output, retry_total = await extract_arguments(
+                input, prompt, model, provider, local_llm_address
             )
+            token_input += retry_input
+            token_output += retry_output
+            token_total += retry_total
+        items_per_comment.append(list(filter(None, items)))
+    return items_per_comment, token_input, token_output, token_total
+
 
-        return results
+# タイムアウトや接続エラーで遅れたリクエストは破棄せずに再試行する
+@retry(
+    retry=retry_if_exception_type((openai.APITimeoutError, openai.APIConnectionError, asyncio.TimeoutError)),
+    wait=wait_exponential(multiplier=1, min=2, max=20),
+    stop=stop_after_attempt(3),
+    reraise=True,
+)
+async def extract_packed_arguments(
+    inputs, prompt, model, provider="openai", local_llm_address=None
+) -> tuple[dict[str, list[str]], int, int, int]:
+    messages = [
+        {"role": "system", "content": prompt + PACKED_EXTRACTION_INSTRUCTION},
+        {
+            "role": "user",
+            "content": json.dumps(
+                [{"commentId": str(k), "comment": input} for k, input in enumerate(inputs)], ensure_ascii=False
+            ),
+        },
+    ]
+    response, token_input, token_output, token_total = await arequest_to_chat_ai(
+        messages=messages,
+        model=model,
+        is_json=False,
+        json_schema=PackedExtractionResponse,
+        provider=provider,
+        local_llm_address=local_llm_address,
+    )
+    return parse_packed_extraction_response(response), token_input, token_output, token_total
 
 
-def extract_arguments(input, prompt, model, provider="openai", local_llm_address=None):
+# タイムアウトや接続エラーで遅れたリクエストは破棄せずに再試行する
+@retry(
+    retry=retry_if_exception_type((openai.APITimeoutError, openai.APIConnectionError, asyncio.TimeoutError)),
+    wait=wait_exponential(multiplier=1, min=2, max=20),
+    stop=stop_after_attempt(3),
+    reraise=True,
+)
+async def extract_arguments(input, prompt, model, provider="openai", local_llm_address=None):
     messages = [
         {"role": "system", "content": prompt},
         {"role": "user", "content": input},
     ]
+    response = None
     try:
-        response, token_input, token_output, token_total = request_to_chat_ai(
+        response, token_input, token_output, token_total = await arequest_to_chat_ai(
             messages=messages,
             model=model,
             is_json=False,
@@ -165,4 +366,4 @@ def extract_arguments(input, prompt, model, provider="openai", local_llm_address
         print("Input was:", input)
         print("Response was:", response)
         print("Silently giving up on trying to generate valid list.")
-        return []
+        return [], 0, 0, 0
@@ -72,6 +72,10 @@ def hierarchical_aggregation(config):
     }
 
     arguments = pd.read_csv(f"outputs/{config['output_dir']}/args.csv")
+    arg_categories = pd.read_csv(f"outputs/{config['output_dir']}/arg_categories.csv")
+    # 以前の実行で抽出ステップがargs.csvに書き出していた分類結果は、分類ステップの結果で置き換える
+    arguments = arguments.drop(columns=[col for col in arg_categories.columns[1:] if col in arguments.columns])
+    arguments = arguments.merge(arg_categories, on="arg-id", how="left")
     arguments.set_index("arg-id", inplace=True)
     arg_num = len(arguments)
     relation_df = pd.read_csv(f"outputs/{config['output_dir']}/relations.csv")
@@ -105,8 +109,6 @@ def hierarchical_aggregation(config):
         json.dump(results, file, indent=2, ensure_ascii=False)
     # TODO: サンプリングロジックを実装したいが、現状は全件抽出
     create_custom_intro(config)
-    if config["is_pubcom"]:
-        add_original_comments(labels, arguments, relation_df, clusters, config)
 
 
 def create_custom_intro(config):
@@ -136,62 +138,6 @@ def create_custom_intro(config):
         json.dump(result, f, indent=2, ensure_ascii=False)
 
 
-def add_original_comments(labels, arguments, relation_df, clusters, config):
-    # 大カテゴリ（cluster-level-1）に該当するラベルだけ抽出
-    labels_lv1 = labels[labels["level"] == 1][["id", "label"]].rename(
-        columns={"id": "cluster-level-1-id", "label": "category_label"}
-    )
-
-    # arguments と clusters をマージ（カテゴリ情報付与）
-    merged = arguments.merge(clusters[["arg-id", "cluster-level-1-id"]], on="arg-id").merge(
-        labels_lv1, on="cluster-level-1-id", how="left"
-    )
-
-    # relation_df と結合
-    merged = merged.merge(relation_df, on="arg-id", how="left")
-
-    # 元コメント取得
-    comments = pd.read_csv(f"inputs/{config['input']}.csv")
-    comments["comment-id"] = comments["comment-id"].astype(str)
-    merged["comment-id"] = merged["comment-id"].astype(str)
-
-    # 元コメント本文などとマージ
-    final_df = merged.merge(comments, on="comment-id", how="left")
-
-    # 必要カラムのみ整形
-    final_cols = ["comment-id", "comment-body", "arg-id", "argument", "cluster-level-1-id", "category_label"]
-
-    # 基本カラム
-    for col in ["x", "y", "source", "url"]:
-        if col in comments.columns:
-            final_cols.append(col)
-
-    # 属性カラムを追加
-    attribute_columns = []
-    for col in comments.columns:
-        # attributeプレフィックスが付いたカラムを探す
-        if col.startswith("attribute_"):
-            attribute_columns.append(col)
-            final_cols.append(col)
-
-    print(f"属性カラム検出: {attribute_columns}")
-
-    # 必要なカラムだけ選択
-    final_df = final_df[final_cols]
-    final_df = final_df.rename(
-        columns={
-            "cluster-level-1-id": "category_id",
-            "category_label": "category",
-            "arg-id": "arg_id",
-            "argument": "argument",
-            "comment-body": "original-comment",
-        }
-    )
-
-    # 保存
-    final_df.to_csv(f"outputs/{config['output_dir']}/final_result_with_comments.csv", index=False)
-
-
 def _build_arguments(clusters: pd.DataFrame, comments: pd.DataFrame, relation_df: pd.DataFrame) -> list[Argument]:
     """
     Build the arguments list including attribute information from original comments
@@ -342,7 +288,7 @@ def _build_translations(config):
 def _build_property_map(
     arguments: pd.DataFrame, comments: pd.DataFrame, hidden_properties_map: dict[str, list[str]], config: dict
 ) -> dict[str, dict[str, str]]:
-    property_columns = list(hidden_properties_map.keys()) + list(config["extraction"]["categories"].keys())
+    property_columns = list(hidden_properties_map.keys()) + list(config["category_classification"]["categories"].keys())
     property_map = defaultdict(dict)
 
     # 指定された property_columns が arguments に存在するかチェック
@@ -1,22 +1,328 @@
 """Cluster the arguments using UMAP + HDBSCAN and GPT-4."""
 
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
 from importlib import import_module
 
 import numpy as np
 import pandas as pd
 import scipy.cluster.hierarchy as sch
-from sklearn.cluster import KMeans
+from hierarchical_utils import recorded_output_hash
+from sklearn.decomposition import PCA
 
+from services.cluster_model import (
+    assign_to_centers,
+    center_distances,
+    centroid_drift,
+    cluster_means,
+    fit_kmeans,
+    load_cluster_model,
+    save_cluster_model,
+)
+from services.embedding_store import EMBEDDINGS_FILENAME, load_embeddings
+from services.knn_graph import (
+    KNN_BACKENDS,
+    KNN_GRAPH_CACHE_FILENAME,
+    SEARCHABLE_KNN_BACKENDS,
+    file_digest,
+    get_knn_graph,
+    knn_cache_key,
+)
 
-def hierarchical_clustering(config):
-    UMAP = import_module("umap").UMAP
 
+def hierarchical_clustering(config):
     dataset = config["output_dir"]
-    path = f"outputs/{dataset}/hierarchical_clusters.csv"
-    arguments_df = pd.read_csv(f"outputs/{dataset}/args.csv", usecols=["arg-id", "argument"])
-    embeddings_df = pd.read_pickle(f"outputs/{dataset}/embeddings.pkl")
-    embeddings_array = np.asarray(embeddings_df["embedding"].values.tolist())
-    cluster_nums = config["hierarchical_clustering"]["cluster_nums"]
+    output_dir = f"outputs/{dataset}"
+    path = f"{output_dir}/hierarchical_clusters.csv"
+    arguments_df = pd.read_csv(f"{output_dir}/args.csv", usecols=["arg-id", "argument"], dtype={"arg-id": str})
+    # memo: 埋め込み行列はメモリマップで開き、全体をPythonのオブジェクトに展開しない
+    embeddings_array, embedding_arg_ids = load_embeddings(output_dir)
+    # 埋め込みの行はargs.csvの行と同じ順序で対応している必要がある（行の位置で結果を結合するため）
+    if embedding_arg_ids != arguments_df["arg-id"].tolist():
+        raise ValueError(
+            f"arg-ids of the embeddings in {output_dir} do not match args.csv; re-run the embedding step (e.g. with -f)"
+        )
+    options = config["hierarchical_clustering"]
+    # "large"モードでは、PCAで次元を減らしてからUMAPを実行し、初期クラスタリングにMiniBatchKMeansを使う
+    large_mode = options.get("mode", "standard") == "large"
+    fit_params = {
+        "cluster_nums": sorted(options["cluster_nums"]),
+        "pca_components": options.get("pca_components", 50) if large_mode else None,
+        "kmeans_batch_size": options.get("kmeans_batch_size", 4096) if large_mode else None,
+        "cluster_space": options.get("cluster_space", "umap"),
+    }
+    # 保存したモデルはクラスタリングの条件と埋め込みのモデルが同じ場合だけ再利用する
+    model_params = {**fit_params, "embedding_model": config.get("embedding", {}).get("model")}
+
+    incremental = options.get("incremental", False)
+    knn_backend = options.get("knn_backend", "umap")
+    if knn_backend not in KNN_BACKENDS:
+        raise ValueError(f"Unknown knn_backend: {knn_backend}")
+    if incremental and knn_backend not in SEARCHABLE_KNN_BACKENDS:
+        raise ValueError(
+            f"knn_backend '{knn_backend}' cannot be used with incremental (UMAP transform needs a search index)"
+        )
+    knn_builder = None
+    if knn_backend != "umap":
+        knn_builder = knn_graph_builder(
+            output_dir,
+            embeddings_digest(config, output_dir),
+            knn_backend,
+            options.get("knn_params", {}),
+            pca_components=fit_params["pca_components"],
+            with_search_index=incremental,
+            use_cache=options.get("knn_cache", True) and not config.get("force", False),
+        )
+
+    result_df = None
+    if incremental and not config.get("force", False):
+        result_df = incremental_clustering(output_dir, arguments_df, embeddings_array, model_params, options)
+    if result_df is None:
+        model = fit_cluster_model(embeddings_array, **fit_params, knn_builder=knn_builder)
+        result_df = cluster_result_df(
+            arguments_df,
+            model["reducer"].embedding_,
+            hierarchical_labels(model["kmeans"].labels_, model["linkage"], model["cluster_nums"]),
+        )
+        if incremental:
+            model["params"] = model_params
+            save_cluster_model(output_dir, model)
+
+    result_df.to_csv(path, index=False)
+
+
+def embeddings_digest(config, output_dir: str) -> str | None:
+    """埋め込みファイルの内容を識別するハッシュを返す
+
+    埋め込みステップがステータスに記録した出力のハッシュを使い、記録がない場合だけファイル全体をハッシュする。
+    """
+    digest = recorded_output_hash(config, "embedding")
+    if digest is None:
+        embeddings_path = os.path.join(output_dir, EMBEDDINGS_FILENAME)
+        if os.path.exists(embeddings_path):
+            digest = file_digest(embeddings_path)
+    return digest
+
+
+def knn_graph_builder(
+    output_dir: str,
+    embeddings_digest: str | None,
+    backend: str,
+    params: dict,
+    pca_components: int | None,
+    with_search_index: bool,
+    use_cache: bool,
+):
+    """UMAPに渡すk近傍グラフを作る関数を返す
+
+    グラフは元の埋め込みファイルの内容（embeddings_digest）・PCAの次元数・近傍数・バックエンドとそのパラメータをキーにキャッシュするため、
+    cluster_numsなどクラスタリングの条件だけを変えて実行し直す場合はグラフを作り直さない。
+    """
+
+    def build(points: np.ndarray, n_neighbors: int):
+        cache_key = None
+        if use_cache and embeddings_digest is not None:
+            cache_key = knn_cache_key(
+                embeddings=embeddings_digest,
+                pca_components=pca_components,
+                n_neighbors=n_neighbors,
+                backend=backend,
+                params=params,
+                search_index=with_search_index,
+            )
+        return get_knn_graph(
+            points,
+            n_neighbors,
+            backend=backend,
+            params=params,
+            with_search_index=with_search_index,
+            cache_path=os.path.join(output_dir, KNN_GRAPH_CACHE_FILENAME),
+            cache_key=cache_key,
+        )
+
+    return build
+
+
+def incremental_clustering(
+    output_dir: str,
+    arguments_df: pd.DataFrame,
+    embeddings_array: np.ndarray,
+    model_params: dict,
+    options: dict,
+) -> pd.DataFrame | None:
+    """前回保存したモデルを使い、新しい意見だけを既存のクラスタに割り当てる
+
+    前回の結果にある意見は座標とクラスタをそのまま引き継ぎ、新しい意見（本文が変わった意見を含む）は
+    PCA・UMAPのtransformで座標を求めて、最も近いKMeansの中心とそのリンケージ上のクラスタに割り当てる。
+    以下の場合は全体をfitし直すためにNoneを返す。
+    - モデルや前回の結果がない、またはクラスタリングの条件が変わった
+    - fit時からの意見数の増加率がmax_new_ratioを超えた
+    - 新しい意見の割り当て先クラスタの重心までの平均距離が、fit時の平均距離のdrift_threshold倍を超えた
+      （既存のクラスタに当てはまらない意見が多い）
+    """
+    previous_path = os.path.join(output_dir, "hierarchical_clusters.csv")
+    model = load_cluster_model(output_dir)
+    if model is None or not os.path.exists(previous_path):
+        print("incremental clustering: no saved model, fitting from scratch")
+        return None
+    if model.get("params") != model_params:
+        print("incremental clustering: clustering options changed, fitting from scratch")
+        return None
+
+    growth = (len(arguments_df) - model["n_fitted"]) / model["n_fitted"]
+    if growth > options.get("max_new_ratio", 0.5):
+        print(f"incremental clustering: arguments grew by {growth:.1%} since the last fit, fitting from scratch")
+        return None
+
+    previous_df = pd.read_csv(previous_path, dtype={"arg-id": str}).drop_duplicates("arg-id").set_index("arg-id")
+    known = arguments_df["arg-id"].isin(previous_df.index).to_numpy()
+    # 本文が変わった意見は新しい意見として扱う
+    known[known] = (
+        previous_df.loc[arguments_df["arg-id"][known], "argument"].to_numpy()
+        == arguments_df["argument"][known].to_numpy()
+    )
+    known_df = previous_df.loc[arguments_df["arg-id"][known]].reset_index()
+    known_df.index = np.flatnonzero(known)
+    new_positions = np.flatnonzero(~known)
+    print(f"incremental clustering: {len(known_df)} known arguments, {len(new_positions)} new arguments")
+    if len(new_positions) == 0:
+        return known_df.sort_index()
+
+    new_embeddings = np.asarray(embeddings_array[new_positions])
+    if model["pca"] is not None:
+        new_embeddings = model["pca"].transform(new_embeddings).astype(np.float32)
+    coords = model["reducer"].transform(new_embeddings)
+    cluster_points = coords if model["cluster_space"] == "umap" else new_embeddings
+    kmeans_labels, _ = assign_to_centers(cluster_points, model["kmeans"].cluster_centers_)
+    # UMAPのtransformの座標はfit時の座標ほどまとまらないため、ずれは（PCA後の）埋め込み空間の重心までの距離で測る
+    distances = center_distances(new_embeddings, model["embedding_centers"], kmeans_labels)
+    drift = centroid_drift(distances, model["baseline_distance"])
+    print(f"incremental clustering: drift {drift:.2f}")
+    if drift > options.get("drift_threshold", 1.5):
+        print("incremental clustering: new arguments do not fit the existing clusters, fitting from scratch")
+        return None
+
+    new_df = cluster_result_df(
+        arguments_df.iloc[new_positions],
+        coords,
+        hierarchical_labels(kmeans_labels, model["linkage"], model["cluster_nums"]),
+    )
+    new_df.index = new_positions
+    return pd.concat([known_df, new_df[known_df.columns]]).sort_index()
+
+
+def cluster_result_df(arguments_df: pd.DataFrame, umap_embeds: np.ndarray, cluster_results: dict) -> pd.DataFrame:
+    """意見ごとの座標と各階層のクラスタIDをまとめたhierarchical_clusters.csvの内容を作る"""
+    result_df = pd.DataFrame(
+        {
+            "arg-id": arguments_df["arg-id"].to_numpy(),
+            "argument": arguments_df["argument"].to_numpy(),
+            "x": umap_embeds[:, 0],
+            "y": umap_embeds[:, 1],
+        }
+    )
+
+    for cluster_level, final_labels in enumerate(cluster_results.values(), start=1):
+        result_df[f"cluster-level-{cluster_level}-id"] = cluster_id_column(cluster_level, final_labels)
+    return result_df
+
+
+def cluster_id_column(cluster_level: int, labels: np.ndarray) -> np.ndarray:
+    """各意見のラベルから"{階層}_{ラベル}"形式のクラスタIDの列を作る
+
+    文字列はクラスタごとに1回だけ作り、意見ごとにはインデックス参照で割り当てる。
+    """
+    unique_labels, inverse = np.unique(np.asarray(labels), return_inverse=True)
+    cluster_ids = np.array([f"{cluster_level}_{label}" for label in unique_labels], dtype=object)
+    return cluster_ids[inverse.reshape(-1)]
+
+
+def cluster_embeddings(
+    embeddings_array: np.ndarray,
+    cluster_nums: list[int],
+    pca_components: int | None = None,
+    kmeans_batch_size: int | None = None,
+    cluster_space: str = "umap",
+    knn_builder=None,
+) -> tuple[np.ndarray, dict]:
+    """埋め込みをUMAPで2次元に射影し、階層的にクラスタリングする
+
+    Args:
+        embeddings_array: 意見の埋め込み
+        cluster_nums: 各階層のクラスタ数
+        pca_components: 指定した場合、UMAPとクラスタリングの前にPCAでこの次元数まで減らす
+        kmeans_batch_size: 指定した場合、初期クラスタリングにこのバッチサイズのMiniBatchKMeansを使う
+        cluster_space: "umap"はUMAPの2次元座標で、"embedding"は埋め込み空間でクラスタリングする
+        knn_builder: 指定した場合、(点, 近傍数)からUMAPに渡すk近傍グラフを作る関数（knn_graph_builderを参照）
+
+    Returns:
+        (UMAPの2次元座標, クラスタ数ごとの各意見のラベル)
+    """
+    model = fit_cluster_model(
+        embeddings_array, cluster_nums, pca_components, kmeans_batch_size, cluster_space, knn_builder
+    )
+    return model["reducer"].embedding_, hierarchical_labels(
+        model["kmeans"].labels_, model["linkage"], model["cluster_nums"]
+    )
+
+
+def fit_cluster_model(
+    embeddings_array: np.ndarray,
+    cluster_nums: list[int],
+    pca_components: int | None = None,
+    kmeans_batch_size: int | None = None,
+    cluster_space: str = "umap",
+    knn_builder=None,
+) -> dict:
+    """PCA・UMAP・KMeansをfitし、KMeansの中心のWard法によるリンケージを計算する
+
+    引数はcluster_embeddingsと同じ。新しい意見を後から割り当てられるよう、fit済みのモデルをまとめて返す。
+    """
+    if cluster_space not in ("umap", "embedding"):
+        raise ValueError(f"Unknown cluster_space: {cluster_space}")
+    cluster_nums = sorted(cluster_nums)
+    pca = None
+    if pca_components:
+        embeddings_array, pca = reduce_dimensions(embeddings_array, pca_components)
+
+    if cluster_space == "umap":
+        reducer = fit_umap(embeddings_array, knn_builder)
+        cluster_points = reducer.embedding_
+        kmeans_model = fit_kmeans(cluster_points, cluster_nums[-1], kmeans_batch_size)
+    else:
+        # 埋め込み空間でクラスタリングし、UMAPは散布図の座標のためだけに使う。
+        # 両者は互いの結果を使わないため、KMeansを別プロセスでUMAPと同時に実行する
+        # memo: 同じプロセスの別スレッドで動かすと、KMeans（threadpoolctl）の共有ライブラリの走査と、UMAP（numba）の
+        # 拡張モジュールの読み込み（dlopen）が互いのロック（ローダーのロックとGIL）を待ってデッドロックすることがある
+        cluster_points = np.asarray(embeddings_array)
+        # UMAPはrandom_stateを指定しているため1スレッドで動く。KMeansはそれ以外のCPUを使う
+        n_threads = max(1, (os.cpu_count() or 1) - 1)
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            kmeans_future = executor.submit(fit_kmeans, cluster_points, cluster_nums[-1], kmeans_batch_size, n_threads)
+            reducer = fit_umap(embeddings_array, knn_builder)
+            kmeans_model = kmeans_future.result()
+    # リンケージは中心だけから決まるため1回だけ計算し、各階層の分割はその切り方だけを変える
+    linkage_matrix = sch.linkage(kmeans_model.cluster_centers_, method="ward")
+    # 新しい意見のずれを測る基準として、埋め込み空間での各クラスタの重心と、重心までの平均距離を記録する
+    embedding_centers = cluster_means(embeddings_array, kmeans_model.labels_, cluster_nums[-1])
+    distances = center_distances(embeddings_array, embedding_centers, kmeans_model.labels_)
+    return {
+        "pca": pca,
+        "reducer": reducer,
+        "kmeans": kmeans_model,
+        "linkage": linkage_matrix,
+        "embedding_centers": embedding_centers,
+        "cluster_nums": cluster_nums,
+        "cluster_space": cluster_space,
+        "baseline_distance": float(distances.mean()),
+        "n_fitted": len(cluster_points),
+    }
+
+
+def fit_umap(embeddings_array: np.ndarray, knn_builder=None):
+    """UMAPで埋め込みを2次元に射影する（2次元座標はembedding_、新しい点の座標はtransformで求める）"""
+    UMAP = import_module("umap").UMAP
 
     n_samples = embeddings_array.shape[0]
     # デフォルト設定は15
@@ -28,29 +334,32 @@ def hierarchical_clustering(config):
     else:
         n_neighbors = default_n_neighbors
 
-    umap_model = UMAP(random_state=42, n_components=2, n_neighbors=n_neighbors)
+    if knn_builder is None:
+        umap_model = UMAP(random_state=42, n_components=2, n_neighbors=n_neighbors)
+    else:
+        # k近傍グラフの構築がUMAPの処理時間の大半を占めるため、外部で作った（キャッシュした）グラフを渡す
+        knn = knn_builder(embeddings_array, n_neighbors)
+        umap_model = UMAP(random_state=42, n_components=2, n_neighbors=n_neighbors, precomputed_knn=knn)
     # TODO 詳細エラーメッセージを加える
     # 以下のエラーの場合、おそらく元の意見件数が少なすぎることが原因
     # TypeError: Cannot use scipy.linalg.eigh for sparse A with k >= N. Use scipy.linalg.eigh(A.toarray()) or reduce k.
-    umap_embeds = umap_model.fit_transform(embeddings_array)
+    return umap_model.fit(embeddings_array)
 
-    cluster_results = hierarchical_clustering_embeddings(
-        umap_embeds=umap_embeds,
-        cluster_nums=cluster_nums,
-    )
-    result_df = pd.DataFrame(
-        {
-            "arg-id": arguments_df["arg-id"],
-            "argument": arguments_df["argument"],
-            "x": umap_embeds[:, 0],
-            "y": umap_embeds[:, 1],
-        }
-    )
 
-    for cluster_level, final_labels in enumerate(cluster_results.values(), start=1):
-        result_df[f"cluster-level-{cluster_level}-id"] = [f"{cluster_level}_{label}" for label in final_labels]
+def reduce_dimensions(embeddings: np.ndarray, n_components: int) -> tuple[np.ndarray, PCA | None]:
+    """ランダム化PCAで埋め込みをn_components次元に減らす（元の次元数がそれ以下の場合はそのまま返す）
 
-    result_df.to_csv(path, index=False)
+    Returns:
+        (削減後の埋め込み, fit済みのPCA。削減しなかった場合はNone)
+    """
+    n_components = min(n_components, embeddings.shape[0])
+    if embeddings.shape[1] <= n_components:
+        return embeddings, None
+    print(f"start PCA: {embeddings.shape[1]} -> {n_components} dims")
+    pca = PCA(n_components=n_components, svd_solver="randomized", random_state=42)
+    reduced = pca.fit_transform(embeddings).astype(np.float32)
+    print(f"end PCA: explained variance ratio {pca.explained_variance_ratio_.sum():.3f}")
+    return reduced, pca
 
 
 def generate_cluster_count_list(min_clusters: int, max_clusters: int):
@@ -83,50 +392,30 @@ def generate_cluster_count_list(min_clusters: int, max_clusters: int):
 
 
 def merge_clusters_with_hierarchy(
-    cluster_centers: np.ndarray,
+    linkage_matrix: np.ndarray,
     kmeans_labels: np.ndarray,
-    umap_array: np.ndarray,
     n_cluster_cut: int,
-):
-    Z = sch.linkage(cluster_centers, method="ward")
-    cluster_labels_merged = sch.fcluster(Z, t=n_cluster_cut, criterion="maxclust")
-
-    n_samples = umap_array.shape[0]
-    final_labels = np.zeros(n_samples, dtype=int)
+) -> np.ndarray:
+    """KMeansの中心のWard法によるリンケージをn_cluster_cut個に切り、各意見のラベルを統合後のクラスタに置き換える"""
+    cluster_labels_merged = sch.fcluster(linkage_matrix, t=n_cluster_cut, criterion="maxclust")
+    # KMeansのラベルは中心のインデックスなので、インデックス参照でまとめて変換できる
+    return cluster_labels_merged[np.asarray(kmeans_labels)]
 
-    for i in range(n_samples):
-        original_label = kmeans_labels[i]
-        final_labels[i] = cluster_labels_merged[original_label]
-
-    return final_labels
-
-
-def hierarchical_clustering_embeddings(
-    umap_embeds,
-    cluster_nums,
-):
-    # 最大分割数でクラスタリングを実施
-    print("start initial clustering")
-    initial_cluster_num = cluster_nums[-1]
-    kmeans_model = KMeans(n_clusters=initial_cluster_num, random_state=42)
-    kmeans_model.fit(umap_embeds)
-    print("end initial clustering")
 
+def hierarchical_labels(kmeans_labels: np.ndarray, linkage_matrix: np.ndarray, cluster_nums: list[int]) -> dict:
+    """KMeansのラベルをリンケージで統合し、クラスタ数（昇順）ごとの各意見のラベルを返す"""
     results = {}
     print("start hierarchical clustering")
-    cluster_nums.sort()
     print(cluster_nums)
     for n_cluster_cut in cluster_nums[:-1]:
         print("n_cluster_cut: ", n_cluster_cut)
-        final_labels = merge_clusters_with_hierarchy(
-            cluster_centers=kmeans_model.cluster_centers_,
-            kmeans_labels=kmeans_model.labels_,
-            umap_array=umap_embeds,
+        results[n_cluster_cut] = merge_clusters_with_hierarchy(
+            linkage_matrix=linkage_matrix,
+            kmeans_labels=kmeans_labels,
             n_cluster_cut=n_cluster_cut,
         )
-        results[n_cluster_cut] = final_labels
 
-    results[initial_cluster_num] = kmeans_model.labels_
+    results[cluster_nums[-1]] = np.asarray(kmeans_labels)
     print("end hierarchical clustering")
 
     return results
@@ -1,12 +1,16 @@
 import json
-from concurrent.futures import ThreadPoolExecutor
-from functools import partial
+import zlib
 from typing import TypedDict
 
 import pandas as pd
+from hierarchical_utils import record_token_usage
 from pydantic import BaseModel, Field
 
-from services.llm import request_to_chat_ai
+from services.cluster_label_cache import ClusterLabelCache
+from services.llm import arequest_to_chat_ai, get_scheduler
+
+ERROR_LABEL = "エラーでラベル名が取得できませんでした"
+ERROR_DESCRIPTION = "エラーで解説が取得できませんでした"
 
 
 class LabellingResult(TypedDict):
@@ -41,9 +45,14 @@ def hierarchical_initial_labelling(config: dict) -> None:
     model = config["hierarchical_initial_labelling"]["model"]
     workers = config["hierarchical_initial_labelling"]["workers"]
 
-    # トークン使用量を追跡するための変数を初期化
-    config["total_token_usage"] = config.get("total_token_usage", 0)
-
+    # 所属する意見が前回と同じクラスタは、前回のラベルを再利用する（-fで強制実行した場合は再利用しない）
+    cache = ClusterLabelCache(
+        f"outputs/{dataset}/hierarchical_initial_labels_cache.json",
+        initial_labelling_prompt,
+        model,
+        sampling_num,
+        enabled=not config.get("force", False),
+    )
     initial_label_df = initial_labelling(
         initial_labelling_prompt,
         clusters_argument_df,
@@ -53,7 +62,9 @@ def hierarchical_initial_labelling(config: dict) -> None:
         config["provider"],
         config.get("local_llm_address"),
         config,  # configを渡して、トークン使用量を累積できるようにする
+        cache,
     )
+    cache.save()
     print("start initial labelling")
     initial_clusters_argument_df = clusters_argument_df.merge(
         initial_label_df,
@@ -79,6 +90,7 @@ def initial_labelling(
     provider: str = "openai",
     local_llm_address: str | None = None,
     config: dict | None = None,  # configを追加
+    cache: ClusterLabelCache | None = None,
 ) -> pd.DataFrame:
     """各クラスタに対して初期ラベリングを実行する
 
@@ -91,27 +103,54 @@ def initial_labelling(
         provider: LLMプロバイダー
         local_llm_address: ローカルLLMのアドレス
         config: 設定情報を含む辞書（トークン使用量の累積に使用）
+        cache: 指定した場合、所属する意見が前回と同じクラスタはLLMを呼ばずに前回のラベルを使う
 
     Returns:
         各クラスタのラベリング結果を含むDataFrame
     """
     cluster_columns = [col for col in clusters_df.columns if col.startswith("cluster-level-")]
     initial_cluster_column = cluster_columns[-1]
-    cluster_ids = clusters_df[initial_cluster_column].unique()
-    process_func = partial(
+    reused_results = []
+    cluster_ids = []
+    cluster_keys = {}
+    for cluster_id, cluster_data in clusters_df.groupby(initial_cluster_column, sort=False):
+        if cache is not None:
+            cluster_keys[cluster_id] = ClusterLabelCache.cluster_key(cluster_data["arg-id"], cluster_data["argument"])
+            cached = cache.get(cluster_keys[cluster_id])
+            if cached is not None:
+                reused_results.append(LabellingResult(cluster_id=cluster_id, **cached))
+                continue
+        cluster_ids.append(cluster_id)
+    if reused_results:
+        print(f"Reused labels of {len(reused_results)} unchanged clusters")
+    # 共有スケジューラに各クラスタのラベリングを投入し、workers件ずつ並行実行する
+    results = get_scheduler().map(
         process_initial_labelling,
-        df=clusters_df,
-        prompt=prompt,
-        sampling_num=sampling_num,
-        target_column=initial_cluster_column,
-        model=model,
-        provider=provider,
-        local_llm_address=local_llm_address,
-        config=config,  # configを渡す
+        [
+            {
+                "cluster_id": cluster_id,
+                "df": clusters_df,
+                "prompt": prompt,
+                "sampling_num": sampling_num,
+                "target_column": initial_cluster_column,
+                "model": model,
+                "provider": provider,
+                "local_llm_address": local_llm_address,
+                "config": config,  # configを渡す
+            }
+            for cluster_id in cluster_ids
+        ],
+        max_concurrency=workers,
+        batchable=True,
     )
-    with ThreadPoolExecutor(max_workers=workers) as executor:
-        results = list(executor.map(process_func, cluster_ids))
-    return pd.DataFrame(results)
+    if cache is not None:
+        for result in results:
+            if result["label"] != ERROR_LABEL:
+                cache.set(
+                    cluster_keys[result["cluster_id"]],
+                    {"label": result["label"], "description": result["description"]},
+                )
+    return pd.DataFrame(reused_results + results)
 
 
 class LabellingFromat(BaseModel):
@@ -121,7 +160,7 @@ class LabellingFromat(BaseModel):
     description: str = Field(..., description="クラスタの説明文")
 
 
-def process_initial_labelling(
+async def process_initial_labelling(
     cluster_id: str,
     df: pd.DataFrame,
     prompt: str,
@@ -150,14 +189,15 @@ def process_initial_labelling(
     """
     cluster_data = df[df[target_column] == cluster_id]
     sampling_num = min(sampling_num, len(cluster_data))
-    cluster = cluster_data.sample(sampling_num)
+    # 同じ入力からは同じプロンプトになるよう（LLMのレスポンスキャッシュが効くよう）、クラスタIDから乱数のシードを決める
+    cluster = cluster_data.sample(sampling_num, random_state=zlib.crc32(str(cluster_id).encode("utf-8")))
     input = "\n".join(cluster["argument"].values)
     messages = [
         {"role": "system", "content": prompt},
         {"role": "user", "content": input},
     ]
     try:
-        response_text, token_input, token_output, token_total = request_to_chat_ai(
+        response_text, token_input, token_output, token_total = await arequest_to_chat_ai(
             messages=messages,
             model=model,
             provider=provider,
@@ -167,20 +207,18 @@ def process_initial_labelling(
 
         # トークン使用量を累積（configが渡されている場合）
         if config is not None:
-            config["total_token_usage"] = config.get("total_token_usage", 0) + token_total
-            config["token_usage_input"] = config.get("token_usage_input", 0) + token_input
-            config["token_usage_output"] = config.get("token_usage_output", 0) + token_output
+            record_token_usage(config, "hierarchical_initial_labelling", token_input, token_output, token_total)
 
         response_json = json.loads(response_text) if isinstance(response_text, str) else response_text
         return LabellingResult(
             cluster_id=cluster_id,
-            label=response_json.get("label", "エラーでラベル名が取得できませんでした"),
-            description=response_json.get("description", "エラーで解説が取得できませんでした"),
+            label=response_json.get("label", ERROR_LABEL),
+            description=response_json.get("description", ERROR_DESCRIPTION),
         )
     except Exception as e:
         print(e)
         return LabellingResult(
             cluster_id=cluster_id,
-            label="エラーでラベル名が取得できませんでした",
-            description="エラーで解説が取得できませんでした",
+            label=ERROR_LABEL,
+            description=ERROR_DESCRIPTION,
         )
@@ -1,14 +1,18 @@
 import json
-from concurrent.futures import ThreadPoolExecutor
+import zlib
 from dataclasses import dataclass
-from functools import partial
 
 import numpy as np
 import pandas as pd
+from hierarchical_utils import record_token_usage
 from pydantic import BaseModel, Field
 from tqdm import tqdm
 
-from services.llm import request_to_chat_ai
+from services.cluster_label_cache import ClusterLabelCache
+from services.llm import arequest_to_chat_ai, get_scheduler
+
+ERROR_LABEL = "エラーでラベル名が取得できませんでした"
+ERROR_DESCRIPTION = "エラーで解説が取得できませんでした"
 
 
 @dataclass
@@ -58,12 +62,22 @@ def hierarchical_merge_labelling(config: dict) -> None:
     clusters_df = pd.read_csv(f"outputs/{dataset}/hierarchical_initial_labels.csv")
 
     cluster_id_columns: list[str] = _filter_id_columns(clusters_df.columns)
+    # 所属する意見と下位クラスタのラベルが前回と同じクラスタは、前回のラベルを再利用する（-fで強制実行した場合は再利用しない）
+    cache = ClusterLabelCache(
+        f"outputs/{dataset}/hierarchical_merge_labels_cache.json",
+        config["hierarchical_merge_labelling"]["prompt"],
+        config["hierarchical_merge_labelling"]["model"],
+        config["hierarchical_merge_labelling"]["sampling_num"],
+        enabled=not config.get("force", False),
+    )
     # ボトムクラスタのラベル・説明とクラスタid付きの各argumentを入力し、各階層のクラスタラベル・説明を生成し、argumentに付けたdfを作成
     merge_result_df = merge_labelling(
         clusters_df=clusters_df,
         cluster_id_columns=sorted(cluster_id_columns, reverse=True),
         config=config,
+        cache=cache,
     )
+    cache.save()
     # 上記のdfから各クラスタのlevel, id, label, description, valueを取得してdfを作成
     melted_df = melt_cluster_data(merge_result_df)
     # 上記のdfに親子関係を追加
@@ -166,13 +180,19 @@ def melt_cluster_data(df: pd.DataFrame) -> pd.DataFrame:
     return pd.DataFrame(all_rows)
 
 
-def merge_labelling(clusters_df: pd.DataFrame, cluster_id_columns: list[str], config) -> pd.DataFrame:
+def merge_labelling(
+    clusters_df: pd.DataFrame,
+    cluster_id_columns: list[str],
+    config,
+    cache: ClusterLabelCache | None = None,
+) -> pd.DataFrame:
     """階層的なクラスタのマージラベリングを実行する
 
     Args:
         clusters_df: クラスタリング結果のDataFrame
         cluster_id_columns: クラスタIDのカラム名のリスト
         config: 設定情報を含む辞書
+        cache: 指定した場合、所属する意見と下位クラスタのラベルが前回と同じクラスタはLLMを呼ばずに前回のラベルを使う
 
     Returns:
         マージラベリング結果を含むDataFrame
@@ -181,24 +201,64 @@ def merge_labelling(clusters_df: pd.DataFrame, cluster_id_columns: list[str], co
         previous_columns = ClusterColumns.from_id_column(cluster_id_columns[idx])
         current_columns = ClusterColumns.from_id_column(cluster_id_columns[idx + 1])
 
-        process_fn = partial(
-            process_merge_labelling,
-            result_df=clusters_df,
-            current_columns=current_columns,
-            previous_columns=previous_columns,
-            config=config,
-        )
-
-        current_cluster_ids = sorted(clusters_df[current_columns.id].unique())
-        with ThreadPoolExecutor(max_workers=config["hierarchical_merge_labelling"]["workers"]) as executor:
-            responses = list(
-                tqdm(
-                    executor.map(process_fn, current_cluster_ids),
-                    total=len(current_cluster_ids),
+        reused_responses = []
+        current_cluster_ids = []
+        cluster_keys = {}
+        for cluster_id, cluster_data in sorted(clusters_df.groupby(current_columns.id), key=lambda item: item[0]):
+            if cache is not None:
+                child_labels = [
+                    f"{label}: {description}"
+                    for label, description in cluster_data[[previous_columns.label, previous_columns.description]]
+                    .drop_duplicates()
+                    .itertuples(index=False)
+                ]
+                cluster_keys[cluster_id] = ClusterLabelCache.cluster_key(
+                    cluster_data["arg-id"], cluster_data["argument"], child_labels
                 )
+                cached = cache.get(cluster_keys[cluster_id])
+                if cached is not None:
+                    reused_responses.append(
+                        {
+                            current_columns.id: cluster_id,
+                            current_columns.label: cached["label"],
+                            current_columns.description: cached["description"],
+                        }
+                    )
+                    continue
+            current_cluster_ids.append(cluster_id)
+        if reused_responses:
+            print(f"Reused labels of {len(reused_responses)} unchanged clusters")
+        # 共有スケジューラに各クラスタのラベリングを投入し、workers件ずつ並行実行する
+        with tqdm(total=len(current_cluster_ids)) as progress:
+            responses = get_scheduler().map(
+                process_merge_labelling,
+                [
+                    {
+                        "target_cluster_id": target_cluster_id,
+                        "result_df": clusters_df,
+                        "current_columns": current_columns,
+                        "previous_columns": previous_columns,
+                        "config": config,
+                    }
+                    for target_cluster_id in current_cluster_ids
+                ],
+                max_concurrency=config["hierarchical_merge_labelling"]["workers"],
+                on_result=lambda _i, _result: progress.update(1),
+                batchable=True,
             )
 
-        current_result_df = pd.DataFrame(responses)
+        if cache is not None:
+            for response in responses:
+                if response[current_columns.label] != ERROR_LABEL:
+                    cache.set(
+                        cluster_keys[response[current_columns.id]],
+                        {
+                            "label": response[current_columns.label],
+                            "description": response[current_columns.description],
+                        },
+                    )
+
+        current_result_df = pd.DataFrame(reused_responses + responses)
         clusters_df = clusters_df.merge(current_result_df, on=[current_columns.id])
     return clusters_df
 
@@ -210,7 +270,7 @@ class LabellingFromat(BaseModel):
     description: str = Field(..., description="クラスタの説明文")
 
 
-def process_merge_labelling(
+async def process_merge_labelling(
     target_cluster_id: str,
     result_df: pd.DataFrame,
     current_columns: ClusterColumns,
@@ -259,7 +319,10 @@ def process_merge_labelling(
         config["hierarchical_merge_labelling"]["sampling_num"],
         len(current_cluster_data),
     )
-    sampled_data = current_cluster_data.sample(sampling_num)
+    # 同じ入力からは同じプロンプトになるよう（LLMのレスポンスキャッシュが効くよう）、クラスタIDから乱数のシードを決める
+    sampled_data = current_cluster_data.sample(
+        sampling_num, random_state=zlib.crc32(str(target_cluster_id).encode("utf-8"))
+    )
     sampled_argument_text = "\n".join(sampled_data["argument"].values)
     cluster_text = "\n".join([value.to_prompt_text() for value in previous_values])
     messages = [
@@ -270,7 +333,7 @@ def process_merge_labelling(
         },
     ]
     try:
-        response_text, token_input, token_output, token_total = request_to_chat_ai(
+        response_text, token_input, token_output, token_total = await arequest_to_chat_ai(
             messages=messages,
             model=config["hierarchical_merge_labelling"]["model"],
             json_schema=LabellingFromat,
@@ -278,23 +341,21 @@ def process_merge_labelling(
             local_llm_address=config.get("local_llm_address"),
         )
 
-        config["total_token_usage"] = config.get("total_token_usage", 0) + token_total
-        config["token_usage_input"] = config.get("token_usage_input", 0) + token_input
-        config["token_usage_output"] = config.get("token_usage_output", 0) + token_output
+        record_token_usage(config, "hierarchical_merge_labelling", token_input, token_output, token_total)
         print(f"Merge labelling: input={token_input}, output={token_output}, total={token_total} tokens")
 
         response_json = json.loads(response_text) if isinstance(response_text, str) else response_text
         return {
             current_columns.id: target_cluster_id,
-            current_columns.label: response_json.get("label", "エラーでラベル名が取得できませんでした"),
-            current_columns.description: response_json.get("description", "エラーで解説が取得できませんでした"),
+            current_columns.label: response_json.get("label", ERROR_LABEL),
+            current_columns.description: response_json.get("description", ERROR_DESCRIPTION),
         }
     except Exception as e:
         print(f"エラーが発生しました: {e}")
         return {
             current_columns.id: target_cluster_id,
-            current_columns.label: "エラーでラベル名が取得できませんでした",
-            current_columns.description: "エラーで解説が取得できませんでした",
+            current_columns.label: ERROR_LABEL,
+            current_columns.description: ERROR_DESCRIPTION,
         }
 
 
@@ -4,6 +4,7 @@ import json
 import re
 
 import pandas as pd
+from hierarchical_utils import record_token_usage
 from pydantic import BaseModel, Field
 
 from services.llm import request_to_chat_ai
@@ -45,9 +46,7 @@ def hierarchical_overview(config):
     )
 
     # トークン使用量を累積
-    config["total_token_usage"] = config.get("total_token_usage", 0) + token_total
-    config["token_usage_input"] = config.get("token_usage_input", 0) + token_input
-    config["token_usage_output"] = config.get("token_usage_output", 0) + token_output
+    record_token_usage(config, "hierarchical_overview", token_input, token_output, token_total)
     print(f"Hierarchical overview: input={token_input}, output={token_output}, total={token_total} tokens")
 
     try:
@@ -65,8 +65,12 @@ async def download_comments_csv(slug: str, api_key: str = Depends(verify_admin_a
 
 @router.get("/admin/reports/{slug}/status/step-json", dependencies=[Depends(verify_admin_api_key)])
 async def get_current_step(slug: str) -> dict:
+    progress_file = settings.REPORT_DIR / slug / "hierarchical_progress.json"
     status_file = settings.REPORT_DIR / slug / "hierarchical_status.json"
     try:
+        # 進捗の表示に必要な項目だけを書き出した小さなファイルがあれば、そちらを読む
+        if progress_file.exists():
+            status_file = progress_file
         # ステータスファイルが存在しない場合は "loading" を返す
         if not status_file.exists():
             return {"current_step": "loading"}
@@ -1,5 +1,7 @@
 from typing import Literal
 
+from pydantic import model_validator
+
 from src.schemas.base import SchemaBaseModel
 from src.schemas.report import ReportVisibility
 
@@ -35,6 +37,14 @@ class ReportInput(SchemaBaseModel):
     is_embedded_at_local: bool = False  # エンベデッド処理をローカルで行うかどうか
     provider: str = "openai"  # LLMプロバイダー（openai, azure, openrouter, local）
     local_llm_address: str | None = None  # LocalLLM用アドレス（例: "127.0.0.1:1234"）
+    batch_mode: bool = False  # 抽出・ラベリングのLLMリクエストをBatch APIでまとめて実行するかどうか
+
+    @model_validator(mode="after")
+    def validate_batch_mode(self) -> "ReportInput":
+        # Batch APIに対応していないプロバイダーでは、パイプラインの開始時にエラーになるため受け付けない
+        if self.batch_mode and self.provider not in ("openai", "azure"):
+            raise ValueError(f"batch_mode is not supported for provider '{self.provider}'")
+        return self
 
 
 class ReportMetadataUpdate(SchemaBaseModel):
@@ -32,6 +32,7 @@ def _build_config(report_input: ReportInput) -> dict[str, Any]:
         "is_pubcom": report_input.is_pubcom,
         "is_embedded_at_local": report_input.is_embedded_at_local,
         "local_llm_address": report_input.local_llm_address,
+        "batch_mode": report_input.batch_mode,
         "extraction": {
             "prompt": report_input.prompt.extraction,
             "workers": report_input.workers,
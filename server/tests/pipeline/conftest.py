@@ -0,0 +1,22 @@
+import importlib
+import sys
+from pathlib import Path
+
+import pytest
+
+# パイプラインのステップはpipelineディレクトリをカレントディレクトリとして実行され、
+# services・steps・hierarchical_utilsをトップレベルのモジュールとしてimportするため、同じ形でimportできるようにする
+PIPELINE_DIR = Path(__file__).parents[2] / "broadlistening" / "pipeline"
+sys.path.insert(0, str(PIPELINE_DIR))
+
+
+@pytest.fixture
+def pipeline_module(monkeypatch):
+    """pipelineディレクトリで(hierarchical_specs.jsonを読み込めるように)モジュールをimportする関数を返すフィクスチャ"""
+
+    def _import(name: str):
+        with monkeypatch.context() as m:
+            m.chdir(PIPELINE_DIR)
+            return importlib.import_module(name)
+
+    return _import
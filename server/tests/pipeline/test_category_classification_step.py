@@ -0,0 +1,39 @@
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def output_dir(monkeypatch, tmp_path):
+    """一時ディレクトリをカレントディレクトリにし、抽出ステップの出力を用意する"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "outputs" / "test").mkdir(parents=True)
+    pd.DataFrame({"arg-id": ["A0_0", "A1_0"], "argument": ["意見0", "意見1"]}).to_csv(
+        "outputs/test/args.csv", index=False
+    )
+    return tmp_path / "outputs" / "test"
+
+
+def test_without_categories_writes_arg_ids(pipeline_module, output_dir):
+    """category_classification: カテゴリを指定しない場合はLLMを呼ばずにarg-idだけを出力する"""
+    step = pipeline_module("steps.category_classification")
+    config = {"output_dir": "test", "category_classification": {"categories": {}, "workers": 1}}
+
+    step.category_classification(config)
+
+    assert pd.read_csv(output_dir / "arg_categories.csv").columns.tolist() == ["arg-id"]
+
+
+def test_writes_category_columns(pipeline_module, output_dir, monkeypatch):
+    """category_classification: 分類結果のカテゴリの列をarg-idとともに出力する"""
+    step = pipeline_module("steps.category_classification")
+    monkeypatch.setattr(step, "classify_args", lambda args, config, workers: args.assign(sentiment="ポジティブ"))
+    config = {
+        "output_dir": "test",
+        "category_classification": {"categories": {"sentiment": {"ポジティブ": "肯定的"}}, "workers": 1},
+    }
+
+    step.category_classification(config)
+
+    result = pd.read_csv(output_dir / "arg_categories.csv")
+    assert result.columns.tolist() == ["arg-id", "sentiment"]
+    assert result["sentiment"].tolist() == ["ポジティブ", "ポジティブ"]
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import os
+
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def extraction_step(pipeline_module, monkeypatch, tmp_path):
+    """一時ディレクトリで抽出ステップを実行できるようにし、LLMへのリクエストを偽の応答に差し替えるフィクスチャ
+
+    偽の応答は、コメント本文を受け取って意見のリストを返す関数（fixture.respond）で決まる。
+    本文がfixture.failingに含まれるコメントのリクエストはエラーにし、"slow"で始まるコメントは他より遅く完了させる。
+    まとめたリクエストの応答では順序を入れ替え、"missing"で始まるコメントの結果を含めない。
+    """
+    utils = pipeline_module("hierarchical_utils")
+    step = pipeline_module("steps.extraction")
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "inputs").mkdir()
+    (tmp_path / "outputs" / "test").mkdir(parents=True)
+
+    class Fake:
+        requests = []
+        failing = set()
+
+        @staticmethod
+        def respond(body):
+            return [f"{body}の意見"]
+
+    async def fake_arequest_to_chat_ai(messages, model, is_json=False, json_schema=None, provider="openai", **kwargs):
+        system, user = messages[0]["content"], messages[1]["content"]
+        Fake.requests.append(user)
+        if system.endswith(step.PACKED_EXTRACTION_INSTRUCTION):
+            comments = json.loads(user)
+            if any(comment["comment"] in Fake.failing for comment in comments):
+                raise RuntimeError("request failed")
+            results = [
+                {"commentId": comment["commentId"], "extractedOpinionList": Fake.respond(comment["comment"])}
+                for comment in reversed(comments)
+                if not comment["comment"].startswith("missing")
+            ]
+            return json.dumps({"results": results}, ensure_ascii=False), 10, 5, 15
+        if user in Fake.failing:
+            raise RuntimeError("request failed")
+        if user.startswith("slow"):
+            await asyncio.sleep(0.2)
+        return json.dumps({"extractedOpinionList": Fake.respond(user)}, ensure_ascii=False), 10, 5, 15
+
+    monkeypatch.setattr(step, "arequest_to_chat_ai", fake_arequest_to_chat_ai)
+    Fake.utils = utils
+    Fake.step = step
+    return Fake
+
+
+def _run(fake, comments, **options):
+    pd.DataFrame({"comment-id": list(comments), "comment-body": list(comments.values())}).to_csv(
+        "inputs/test.csv", index=False
+    )
+    extraction_spec = [spec for spec in fake.utils.specs if spec["step"] == "extraction"][0]
+    config = {
+        "input": "test",
+        "output_dir": "test",
+        "provider": "openai",
+        "extraction": {**extraction_spec["options"], "prompt": "prompt", "model": "gpt-4o-mini", "workers": 4},
+    }
+    config["extraction"].update(options)
+    fake.requests.clear()
+    fake.step.extraction(config)
+    args = pd.read_csv("outputs/test/args.csv")
+    relations = pd.read_csv("outputs/test/relations.csv")
+    arguments = dict(zip(args["arg-id"], args["argument"], strict=True))
+    extracted = {}
+    for arg_id, comment_id in zip(relations["arg-id"], relations["comment-id"], strict=True):
+        extracted.setdefault(comment_id, []).append(arguments[arg_id])
+    return config, args, extracted
+
+
+def test_results_are_flushed_in_input_order(extraction_step):
+    """extraction: 完了順によらず入力順に結果を反映し、同じ意見のarg-idは入力で先のコメントから採番する"""
+    extraction_step.respond = staticmethod(lambda body: ["共通の意見", f"{body}の意見"])
+
+    _, args, extracted = _run(extraction_step, {1: "slow 1", 2: "コメント2", 3: "コメント3"})
+
+    assert list(args["arg-id"]) == ["A1_0", "A1_1", "A2_1", "A3_1"]
+    assert list(args["argument"]) == ["共通の意見", "slow 1の意見", "コメント2の意見", "コメント3の意見"]
+    assert extracted[2] == ["共通の意見", "コメント2の意見"]
+
+
+def test_duplicate_bodies_are_extracted_once(extraction_step):
+    """extraction: 同じ本文のコメントは1回だけ抽出し、結果を全てのcomment-idに割り当てる"""
+    config, _, extracted = _run(extraction_step, {1: "同じ意見です", 2: "別の意見", 3: "同じ意見です"})
+
+    assert sorted(extraction_step.requests) == ["別の意見", "同じ意見です"]
+    assert extracted[1] == extracted[3] == ["同じ意見ですの意見"]
+    assert extracted[2] == ["別の意見の意見"]
+    assert config["extraction_dedup_stats"]["unique_bodies"] == 2
+
+
+def test_packed_results_are_split_back_to_comments(extraction_step):
+    """extraction: まとめて抽出した結果をコメントごとに戻し、応答に含まれなかったコメントは1件ずつ抽出し直す"""
+    comments = {10: "コメントA", 20: "missing B", 30: "コメントC"}
+
+    _, _, extracted = _run(extraction_step, comments, packing=True, pack_max_comments=10)
+
+    # 1リクエストにまとめた後、応答に含まれなかったコメントだけを単独で抽出し直す
+    assert len(extraction_step.requests) == 2
+    assert extraction_step.requests[1] == "missing B"
+    assert extracted == {10: ["コメントAの意見"], 20: ["missing Bの意見"], 30: ["コメントCの意見"]}
+
+
+def test_failed_comments_are_retried_on_next_run(extraction_step):
+    """extraction: 失敗したコメントはジャーナルに残さず、次回の実行で失敗したコメントだけを再抽出する"""
+    extraction_step.failing = {"コメント2"}
+
+    config, _, extracted = _run(extraction_step, {1: "コメント1", 2: "コメント2", 3: "コメント3"})
+
+    assert 2 not in extracted
+    assert config["extraction_failed_comments"] == 1
+    assert config["incomplete_steps"] == {"extraction": "1 comments failed"}
+    assert os.path.exists("outputs/test/extraction_journal.jsonl")
+
+    extraction_step.failing = set()
+    config, _, extracted = _run(extraction_step, {1: "コメント1", 2: "コメント2", 3: "コメント3"})
+
+    # 前回成功したコメントはジャーナルから復元する
+    assert extraction_step.requests == ["コメント2"]
+    assert extracted == {1: ["コメント1の意見"], 2: ["コメント2の意見"], 3: ["コメント3の意見"]}
+    assert config["extraction_failed_comments"] == 0
+    assert "extraction" not in config.get("incomplete_steps", {})
+    assert not os.path.exists("outputs/test/extraction_journal.jsonl")
+
+
+def test_incomplete_step_reruns_with_unchanged_inputs(extraction_step):
+    """decide_what_to_run: 前回の実行が不完全だったステップは、入力が同じでも実行し直す"""
+    utils = extraction_step.utils
+    config, _, _ = _run(extraction_step, {1: "コメント1"})
+    previous_job = {
+        "step": "extraction",
+        "params": utils.slim_params(config["extraction"]),
+        "input_fingerprint": utils.input_fingerprint(config, "extraction"),
+    }
+
+    config["previous"] = {"completed_jobs": [previous_job]}
+    assert not utils.decide_what_to_run(config, config["previous"])[0]["run"]
+
+    config["previous"] = {"completed_jobs": [{**previous_job, "incomplete": "1 comments failed"}]}
+    plan = utils.decide_what_to_run(config, config["previous"])[0]
+    assert plan["run"]
+    assert plan["reason"] == "previous run was incomplete: 1 comments failed"
@@ -0,0 +1,243 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.cluster.hierarchy as sch
+from sklearn.cluster import KMeans
+
+
+@pytest.fixture
+def clustering(pipeline_module, monkeypatch, tmp_path):
+    """一時ディレクトリをカレントディレクトリにしたsteps.hierarchical_clusteringを返す"""
+    module = pipeline_module("steps.hierarchical_clustering")
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "outputs" / "test").mkdir(parents=True)
+    return module
+
+
+def _write_inputs(embedding_store, arg_ids, embedding_arg_ids, seed=0):
+    pd.DataFrame({"arg-id": arg_ids, "argument": [f"意見{arg_id}" for arg_id in arg_ids]}).to_csv(
+        "outputs/test/args.csv", index=False
+    )
+    embeddings = np.random.default_rng(seed).normal(size=(len(embedding_arg_ids), 8)).astype(np.float32)
+    embedding_store.save_embeddings("outputs/test", embedding_arg_ids, embeddings)
+
+
+def test_rejects_embeddings_in_different_order(clustering, pipeline_module):
+    """hierarchical_clustering: 埋め込みのarg-idがargs.csvの順序と一致しなければエラーにする"""
+    arg_ids = [f"A{i}_0" for i in range(20)]
+    _write_inputs(pipeline_module("services.embedding_store"), arg_ids, arg_ids[1:] + arg_ids[:1])
+    config = {"output_dir": "test", "hierarchical_clustering": {"cluster_nums": [2, 4]}}
+
+    with pytest.raises(ValueError, match="do not match args.csv"):
+        clustering.hierarchical_clustering(config)
+
+
+def test_rejects_embeddings_of_other_arguments(clustering, pipeline_module):
+    """hierarchical_clustering: 埋め込みの件数がargs.csvと異なる場合もエラーにする"""
+    arg_ids = [f"A{i}_0" for i in range(20)]
+    _write_inputs(pipeline_module("services.embedding_store"), arg_ids, arg_ids[:-1])
+    config = {"output_dir": "test", "hierarchical_clustering": {"cluster_nums": [2, 4]}}
+
+    with pytest.raises(ValueError, match="do not match args.csv"):
+        clustering.hierarchical_clustering(config)
+
+
+def test_embeddings_digest_uses_recorded_output_hash(clustering, pipeline_module, monkeypatch):
+    """embeddings_digest: 埋め込みステップが記録した出力のハッシュを使い、埋め込みファイルを読み直さない"""
+    arg_ids = [f"A{i}_0" for i in range(20)]
+    _write_inputs(pipeline_module("services.embedding_store"), arg_ids, arg_ids)
+    monkeypatch.setattr(clustering, "file_digest", lambda path: pytest.fail("embeddings.npy was hashed"))
+    config = {
+        "completed_jobs": [{"step": "embedding", "output_hash": "current"}],
+        "previous": {"completed_jobs": [{"step": "embedding", "output_hash": "previous"}]},
+    }
+
+    assert clustering.embeddings_digest(config, "outputs/test") == "current"
+    del config["completed_jobs"]
+    assert clustering.embeddings_digest(config, "outputs/test") == "previous"
+
+
+def test_embeddings_digest_hashes_file_without_record(clustering, pipeline_module):
+    """embeddings_digest: 埋め込みステップの記録がない場合は埋め込みファイルの内容をハッシュする"""
+    arg_ids = [f"A{i}_0" for i in range(20)]
+    embedding_store = pipeline_module("services.embedding_store")
+    _write_inputs(embedding_store, arg_ids, arg_ids)
+    first = clustering.embeddings_digest({}, "outputs/test")
+
+    assert first == clustering.file_digest("outputs/test/embeddings.npy")
+    _write_inputs(embedding_store, arg_ids, arg_ids, seed=1)
+    assert clustering.embeddings_digest({}, "outputs/test") != first
+    assert clustering.embeddings_digest({}, "outputs/missing") is None
+
+
+def _blobs(n_samples=300, n_features=16, seed=0):
+    """4つの塊に分かれた埋め込みを作る"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(scale=10, size=(4, n_features))
+    return (centers[rng.integers(0, 4, n_samples)] + rng.normal(size=(n_samples, n_features))).astype(np.float32)
+
+
+def _merge_with_loop(cluster_centers, kmeans_labels, n_cluster_cut):
+    """書き換える前のmerge_clusters_with_hierarchy（意見ごとにループしてラベルを置き換える）"""
+    Z = sch.linkage(cluster_centers, method="ward")
+    cluster_labels_merged = sch.fcluster(Z, t=n_cluster_cut, criterion="maxclust")
+    final_labels = np.zeros(len(kmeans_labels), dtype=int)
+    for i in range(len(kmeans_labels)):
+        final_labels[i] = cluster_labels_merged[kmeans_labels[i]]
+    return final_labels
+
+
+def test_cluster_id_column_matches_per_row_formatting(clustering):
+    """cluster_id_column: 意見ごとに文字列を作っていた以前の実装と同じ列になる"""
+    labels = np.random.default_rng(0).integers(0, 50, 1000)
+
+    assert list(clustering.cluster_id_column(3, labels)) == [f"3_{label}" for label in labels]
+
+
+def test_merge_clusters_with_hierarchy_matches_loop(clustering):
+    """merge_clusters_with_hierarchy: 一度だけ計算したリンケージからの変換が、以前のループの実装と同じラベルになる"""
+    points = _blobs()
+    kmeans = KMeans(n_clusters=16, random_state=42).fit(points)
+    linkage_matrix = sch.linkage(kmeans.cluster_centers_, method="ward")
+
+    for n_cluster_cut in (2, 4, 8):
+        np.testing.assert_array_equal(
+            clustering.merge_clusters_with_hierarchy(linkage_matrix, kmeans.labels_, n_cluster_cut),
+            _merge_with_loop(kmeans.cluster_centers_, kmeans.labels_, n_cluster_cut),
+        )
+
+
+def test_standard_mode_matches_previous_implementation(clustering):
+    """cluster_embeddings: 標準モードでは、以前の実装（UMAP→KMeans→階層ごとにリンケージを計算）と同じ座標・ラベルになる"""
+    umap = pytest.importorskip("umap")
+    points = _blobs()
+    cluster_nums = [2, 4, 8]
+
+    umap_embeds = umap.UMAP(random_state=42, n_components=2, n_neighbors=15).fit_transform(points)
+    kmeans = KMeans(n_clusters=cluster_nums[-1], random_state=42).fit(umap_embeds)
+    expected = {n: _merge_with_loop(kmeans.cluster_centers_, kmeans.labels_, n) for n in cluster_nums[:-1]}
+    expected[cluster_nums[-1]] = kmeans.labels_
+
+    coords, labels = clustering.cluster_embeddings(points, cluster_nums)
+
+    np.testing.assert_allclose(coords, umap_embeds)
+    assert list(labels) == cluster_nums
+    for n in cluster_nums:
+        np.testing.assert_array_equal(labels[n], expected[n])
+
+
+def test_reduce_dimensions(clustering):
+    """reduce_dimensions: PCAでn_components次元のfloat32に減らし、fit済みのPCAで同じ変換ができる"""
+    points = _blobs(n_features=64)
+
+    reduced, pca = clustering.reduce_dimensions(points, 8)
+
+    assert reduced.shape == (300, 8)
+    assert reduced.dtype == np.float32
+    # ランダム化PCAのfit_transformとtransformは分散の小さい成分で少しずれるため、塊を分ける主成分で比べる
+    np.testing.assert_allclose(pca.transform(points)[:, :3], reduced[:, :3], atol=1e-3)
+    # 4つの塊の違いはほぼ全て残る
+    assert pca.explained_variance_ratio_.sum() > 0.9
+
+
+def test_reduce_dimensions_keeps_small_embeddings(clustering):
+    """reduce_dimensions: 元の次元数がn_components以下の場合はそのまま返し、次元数は意見数を超えない"""
+    points = _blobs(n_features=16)
+
+    reduced, pca = clustering.reduce_dimensions(points, 50)
+    assert reduced is points
+    assert pca is None
+
+    reduced, pca = clustering.reduce_dimensions(points[:10], 12)
+    assert reduced.shape == (10, 10)
+
+
+def test_large_mode_output_columns(clustering, pipeline_module):
+    """hierarchical_clustering: largeモードでも標準モードと同じ列を出力し、各階層のクラスタ数はcluster_numsになる"""
+    pytest.importorskip("umap")
+    arg_ids = [f"A{i}_0" for i in range(300)]
+    pd.DataFrame({"arg-id": arg_ids, "argument": [f"意見{i}" for i in range(300)]}).to_csv(
+        "outputs/test/args.csv", index=False
+    )
+    pipeline_module("services.embedding_store").save_embeddings("outputs/test", arg_ids, _blobs(n_features=64))
+    config = {
+        "output_dir": "test",
+        "hierarchical_clustering": {
+            "cluster_nums": [2, 8],
+            "mode": "large",
+            "pca_components": 8,
+            "kmeans_batch_size": 64,
+        },
+    }
+
+    clustering.hierarchical_clustering(config)
+
+    result = pd.read_csv("outputs/test/hierarchical_clusters.csv")
+    assert list(result.columns) == ["arg-id", "argument", "x", "y", "cluster-level-1-id", "cluster-level-2-id"]
+    assert list(result["arg-id"]) == arg_ids
+    assert result[["x", "y"]].notna().all().all()
+    assert result["cluster-level-1-id"].str.startswith("1_").all()
+    assert result["cluster-level-1-id"].nunique() == 2
+    assert result["cluster-level-2-id"].nunique() == 8
+
+
+def _wait_for(path, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{path} was not created")
+        time.sleep(0.01)
+
+
+def _fit_kmeans_after_umap_starts(cluster_points, n_clusters, kmeans_batch_size=None, n_threads=None):
+    """UMAPの開始を待ってからKMeansをfitする（子プロセスで実行される）"""
+    with open("kmeans_started", "w") as f:
+        f.write(str(os.getpid()))
+    _wait_for("umap_started")
+    return KMeans(n_clusters=n_clusters, random_state=42).fit(cluster_points)
+
+
+def test_embedding_space_fits_kmeans_alongside_umap(clustering, monkeypatch):
+    """fit_cluster_model: cluster_space="embedding"ではKMeansを別プロセスでUMAPと同時に実行する"""
+    fit_umap = clustering.fit_umap
+
+    def fit_umap_after_kmeans_starts(*args, **kwargs):
+        # KMeansがUMAPと同時に実行されていなければ、どちらかの待ち合わせがタイムアウトする
+        with open("umap_started", "w") as f:
+            f.write(str(os.getpid()))
+        _wait_for("kmeans_started")
+        return fit_umap(*args, **kwargs)
+
+    monkeypatch.setattr(clustering, "fit_umap", fit_umap_after_kmeans_starts)
+    monkeypatch.setattr(clustering, "fit_kmeans", _fit_kmeans_after_umap_starts)
+
+    model = clustering.fit_cluster_model(_blobs(n_samples=100), [2, 4], cluster_space="embedding")
+
+    with open("kmeans_started") as f:
+        assert int(f.read()) != os.getpid()
+    assert len(model["kmeans"].cluster_centers_) == 4
+
+
+def test_embedding_space_clusters_embeddings(clustering):
+    """cluster_embeddings: cluster_space="embedding"では埋め込みをKMeansでクラスタリングし、座標はUMAPと同じになる"""
+    umap = pytest.importorskip("umap")
+    points = _blobs()
+    cluster_nums = [2, 4]
+
+    umap_embeds = umap.UMAP(random_state=42, n_components=2, n_neighbors=15).fit_transform(points)
+    kmeans = KMeans(n_clusters=cluster_nums[-1], random_state=42).fit(points)
+
+    coords, labels = clustering.cluster_embeddings(points, cluster_nums, cluster_space="embedding")
+
+    np.testing.assert_allclose(coords, umap_embeds)
+    np.testing.assert_array_equal(labels[4], kmeans.labels_)
+    np.testing.assert_array_equal(labels[2], _merge_with_loop(kmeans.cluster_centers_, kmeans.labels_, 2))
+
+
+def test_rejects_unknown_cluster_space(clustering):
+    """fit_cluster_model: 未知のcluster_spaceはエラーになる"""
+    with pytest.raises(ValueError, match="Unknown cluster_space"):
+        clustering.fit_cluster_model(_blobs(n_samples=20), [2, 4], cluster_space="pca")
@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def export(pipeline_module, monkeypatch, tmp_path):
+    """一時ディレクトリをカレントディレクトリにし、抽出・クラスタリング・マージラベリングの出力を用意する"""
+    module = pipeline_module("steps.hierarchical_comment_export")
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "outputs" / "test").mkdir(parents=True)
+    (tmp_path / "inputs").mkdir()
+    pd.DataFrame({"comment-id": [1, 2], "comment-body": ["コメント1", "コメント2"], "attribute_age": [20, 30]}).to_csv(
+        "inputs/test.csv", index=False
+    )
+    pd.DataFrame({"arg-id": ["A1_0", "A2_0"], "argument": ["意見1", "意見2"]}).to_csv(
+        "outputs/test/args.csv", index=False
+    )
+    pd.DataFrame({"arg-id": ["A1_0", "A2_0"], "comment-id": [1, 2]}).to_csv("outputs/test/relations.csv", index=False)
+    pd.DataFrame({"arg-id": ["A1_0", "A2_0"], "cluster-level-1-id": ["1_0", "1_1"]}).to_csv(
+        "outputs/test/hierarchical_clusters.csv", index=False
+    )
+    pd.DataFrame({"level": [1, 1], "id": ["1_0", "1_1"], "label": ["ラベル0", "ラベル1"]}).to_csv(
+        "outputs/test/hierarchical_merge_labels.csv", index=False
+    )
+    return module
+
+
+def test_skips_without_pubcom(export, tmp_path):
+    """hierarchical_comment_export: CSV出力モードでなければ何も出力しない"""
+    export.hierarchical_comment_export({"output_dir": "test", "input": "test", "is_pubcom": False})
+
+    assert not (tmp_path / "outputs" / "test" / "final_result_with_comments.csv").exists()
+
+
+def test_exports_comments_with_category(export):
+    """hierarchical_comment_export: 意見に元コメント・大カテゴリのラベル・属性をつけて出力する"""
+    export.hierarchical_comment_export({"output_dir": "test", "input": "test", "is_pubcom": True})
+
+    result = pd.read_csv("outputs/test/final_result_with_comments.csv")
+    assert result.columns.tolist() == [
+        "comment-id",
+        "original-comment",
+        "arg_id",
+        "argument",
+        "category_id",
+        "category",
+        "attribute_age",
+    ]
+    assert result["original-comment"].tolist() == ["コメント1", "コメント2"]
+    assert result["category"].tolist() == ["ラベル0", "ラベル1"]
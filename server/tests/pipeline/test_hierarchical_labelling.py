@@ -0,0 +1,74 @@
+import asyncio
+import json
+
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def llm_calls(pipeline_module, monkeypatch, tmp_path):
+    """LLMのレスポンスキャッシュを有効にし、プロバイダーへのリクエストを記録するフィクスチャ"""
+    llm = pipeline_module("services.llm")
+    llm_cache = pipeline_module("services.llm_cache")
+    llm_cache.configure_response_cache(enabled=True, cache_dir=str(tmp_path / "llm_cache"))
+    calls = []
+
+    async def fake_request(messages, model, is_json=False, json_schema=None):
+        calls.append(messages)
+        return json.dumps({"label": "ラベル", "description": "説明"}), 10, 5, 15
+
+    monkeypatch.setattr(llm, "arequest_to_openai", fake_request)
+    yield calls
+    llm_cache.configure_response_cache(enabled=False)
+
+
+def _clusters_df():
+    return pd.DataFrame(
+        {
+            "arg-id": [f"A{i}_0" for i in range(20)],
+            "argument": [f"意見{i}" for i in range(20)],
+            "cluster-level-1-id": ["1_1"] * 10 + ["1_2"] * 10,
+            "cluster-level-2-id": ["2_1"] * 5 + ["2_2"] * 5 + ["2_3"] * 5 + ["2_4"] * 5,
+        }
+    )
+
+
+def test_initial_labelling_hits_response_cache(pipeline_module, llm_calls):
+    """process_initial_labelling: 同じクラスタを2回ラベリングすると同じプロンプトになり、2回目はキャッシュから返る"""
+    labelling = pipeline_module("steps.hierarchical_initial_labelling")
+    df = _clusters_df()
+
+    results = [
+        asyncio.run(
+            labelling.process_initial_labelling(
+                "2_1", df, "prompt", sampling_num=3, target_column="cluster-level-2-id", model="gpt-4o-mini"
+            )
+        )
+        for _ in range(2)
+    ]
+
+    assert len(llm_calls) == 1
+    assert results[0] == results[1]
+    assert results[0]["label"] == "ラベル"
+
+
+def test_merge_labelling_hits_response_cache(pipeline_module, llm_calls):
+    """process_merge_labelling: 同じクラスタを2回ラベリングすると同じプロンプトになり、2回目はキャッシュから返る"""
+    labelling = pipeline_module("steps.hierarchical_merge_labelling")
+    df = _clusters_df()
+    df["cluster-level-2-label"] = df["cluster-level-2-id"] + "のラベル"
+    df["cluster-level-2-description"] = df["cluster-level-2-id"] + "の説明"
+    config = {
+        "provider": "openai",
+        "hierarchical_merge_labelling": {"sampling_num": 3, "prompt": "prompt", "model": "gpt-4o-mini"},
+    }
+    current_columns = labelling.ClusterColumns.from_id_column("cluster-level-1-id")
+    previous_columns = labelling.ClusterColumns.from_id_column("cluster-level-2-id")
+
+    results = [
+        asyncio.run(labelling.process_merge_labelling("1_1", df, current_columns, previous_columns, config))
+        for _ in range(2)
+    ]
+
+    assert len(llm_calls) == 1
+    assert results[0] == results[1]
@@ -0,0 +1,351 @@
+import json
+import os
+import threading
+
+import pytest
+
+OUTPUT_FILES = {
+    "args.csv": "arg-id,argument\nA0_0,意見\n",
+    "relations.csv": "arg-id,comment-id\nA0_0,0\n",
+    "embeddings.npy": "embeddings",
+    "arg_categories.csv": "arg-id\nA0_0\n",
+    "hierarchical_clusters.csv": "arg-id,x,y\nA0_0,0.0,0.0\n",
+    "hierarchical_initial_labels.csv": "initial labels",
+    "hierarchical_merge_labels.csv": "merge labels",
+    "hierarchical_overview.txt": "overview",
+    "hierarchical_result.json": "{}",
+    "final_result_with_comments.csv": "arg_id,argument\nA0_0,意見\n",
+}
+
+
+@pytest.fixture
+def utils(pipeline_module, monkeypatch, tmp_path):
+    """一時ディレクトリに全ステップの出力ファイルを用意し、そこをカレントディレクトリにしたhierarchical_utilsを返す"""
+    module = pipeline_module("hierarchical_utils")
+    monkeypatch.setattr(module, "_file_hashes", {})
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "inputs").mkdir()
+    (tmp_path / "inputs" / "test.csv").write_text("comment-id,comment-body,age\n0,コメント,20\n")
+    output_dir = tmp_path / "outputs" / "test"
+    (output_dir / "report").mkdir(parents=True)
+    for filename, content in OUTPUT_FILES.items():
+        (output_dir / filename).write_text(content)
+    return module
+
+
+def _config(utils):
+    config = {"input": "test", "output_dir": "test", "model": "gpt-4o-mini"}
+    for spec in utils.specs:
+        config[spec["step"]] = dict(spec.get("options", {}))
+        if spec.get("use_llm"):
+            config[spec["step"]].update({"prompt": f"{spec['step']}のプロンプト", "model": "gpt-4o-mini"})
+    return config
+
+
+def _with_previous_run(utils, config):
+    """現在のファイルとパラメータで全ステップが完了した前回の実行を設定する"""
+    config["previous"] = {
+        "completed_jobs": [
+            {
+                "step": spec["step"],
+                "params": utils.slim_params(config[spec["step"]]),
+                "input_fingerprint": utils.input_fingerprint(config, spec["step"]),
+            }
+            for spec in utils.specs
+        ]
+    }
+    return config
+
+
+def _append(path, text):
+    # memo: _file_hashはサイズと更新時刻でハッシュを覚えるため、同じサイズの書き換えではなく追記で変更する
+    with open(path, "a") as f:
+        f.write(text)
+
+
+def _plan_by_step(plan):
+    return {entry["step"]: entry for entry in plan}
+
+
+class TestInputFingerprint:
+    """input_fingerprintのテスト"""
+
+    def test_same_inputs_give_same_fingerprint(self, utils):
+        """input_fingerprint: パラメータと読み込むファイルが同じであれば同じ値になる"""
+        config = _config(utils)
+
+        assert utils.input_fingerprint(config, "hierarchical_aggregation") == utils.input_fingerprint(
+            _config(utils), "hierarchical_aggregation"
+        )
+
+    @pytest.mark.parametrize(
+        ("step", "path"),
+        [
+            ("extraction", "inputs/test.csv"),
+            ("embedding", "outputs/test/args.csv"),
+            ("hierarchical_clustering", "outputs/test/args.csv"),
+            ("hierarchical_merge_labelling", "outputs/test/hierarchical_clusters.csv"),
+            ("hierarchical_aggregation", "outputs/test/relations.csv"),
+            ("hierarchical_aggregation", "inputs/test.csv"),
+            ("hierarchical_aggregation", "outputs/test/hierarchical_overview.txt"),
+        ],
+    )
+    def test_fingerprint_changes_with_files_read_by_step(self, utils, step, path):
+        """input_fingerprint: 依存するステップの出力以外も含め、ステップが読み込むファイルが変わると値が変わる"""
+        config = _config(utils)
+        before = utils.input_fingerprint(config, step)
+
+        _append(path, "1,追加,30\n")
+
+        assert utils.input_fingerprint(config, step) != before
+
+    def test_fingerprint_ignores_files_not_read_by_step(self, utils):
+        """input_fingerprint: ステップが読み込まないファイルが変わっても値は変わらない"""
+        config = _config(utils)
+        before = utils.input_fingerprint(config, "hierarchical_overview")
+
+        _append("outputs/test/relations.csv", "A1_0,1\n")
+        _append("inputs/test.csv", "1,追加,30\n")
+
+        assert utils.input_fingerprint(config, "hierarchical_overview") == before
+
+    def test_fingerprint_changes_with_tracked_params(self, utils):
+        """input_fingerprint: 追跡するパラメータやプロンプトが変わると値が変わる"""
+        config = _config(utils)
+        before = utils.input_fingerprint(config, "hierarchical_overview")
+
+        config["hierarchical_overview"]["prompt"] = "別のプロンプト"
+
+        assert utils.input_fingerprint(config, "hierarchical_overview") != before
+
+
+class TestDecideWhatToRun:
+    """decide_what_to_runのテスト"""
+
+    def test_first_run_runs_all_steps(self, utils):
+        """decide_what_to_run: 前回の実行がなければ全ステップを実行する"""
+        plan = utils.decide_what_to_run(_config(utils), False)
+
+        assert all(entry["run"] for entry in plan)
+        assert {entry["reason"] for entry in plan} == {"not trace of previous run"}
+
+    def test_nothing_changed(self, utils):
+        """decide_what_to_run: パラメータもファイルも前回と同じであればどのステップも実行しない"""
+        config = _with_previous_run(utils, _config(utils))
+
+        plan = utils.decide_what_to_run(config, config["previous"])
+
+        assert not any(entry["run"] for entry in plan)
+
+    def test_force_runs_all_steps(self, utils):
+        """decide_what_to_run: -fの場合は前回と同じでも全ステップを実行する"""
+        config = _with_previous_run(utils, _config(utils))
+        config["force"] = True
+
+        plan = utils.decide_what_to_run(config, config["previous"])
+
+        assert all(entry["run"] for entry in plan)
+
+    def test_changed_extra_input_reruns_step(self, utils):
+        """decide_what_to_run: 依存するステップの出力以外に読み込むファイルだけが変わった場合も再実行する"""
+        config = _with_previous_run(utils, _config(utils))
+        _append("outputs/test/relations.csv", "A1_0,1\n")
+
+        plan = _plan_by_step(utils.decide_what_to_run(config, config["previous"]))
+
+        assert plan["hierarchical_aggregation"]["run"]
+        assert plan["hierarchical_aggregation"]["reason"] == "input data changed"
+        assert not plan["hierarchical_overview"]["run"]
+
+    def test_changed_input_csv_checks_inputs_of_aggregation(self, utils):
+        """decide_what_to_run: 入力CSVが変わると抽出を再実行し、集約は実行直前に入力を確認する"""
+        config = _with_previous_run(utils, _config(utils))
+        _append("inputs/test.csv", "1,追加,30\n")
+
+        plan = _plan_by_step(utils.decide_what_to_run(config, config["previous"]))
+
+        assert plan["extraction"]["reason"] == "input data changed"
+        assert plan["hierarchical_aggregation"]["check_inputs"]
+
+    def test_changed_params_check_inputs_of_downstream_steps(self, utils):
+        """decide_what_to_run: パラメータが変わったステップを実行し、下流のステップは実行直前に入力を確認する"""
+        config = _with_previous_run(utils, _config(utils))
+        config["hierarchical_clustering"]["cluster_nums"] = [2, 4]
+
+        plan = _plan_by_step(utils.decide_what_to_run(config, config["previous"]))
+
+        assert not plan["embedding"]["run"]
+        assert plan["hierarchical_clustering"]["reason"] == "some parameters changed: cluster_nums"
+        assert plan["hierarchical_initial_labelling"]["run"]
+        assert plan["hierarchical_initial_labelling"]["check_inputs"]
+        assert plan["hierarchical_aggregation"]["check_inputs"]
+        assert "check_inputs" not in plan["hierarchical_clustering"]
+
+
+class TestRunStep:
+    """run_stepの入力の確認のテスト"""
+
+    def _config_with_check_inputs(self, utils, step):
+        config = _with_previous_run(utils, _config(utils))
+        config["plan"] = [
+            {"step": step, "run": True, "reason": "some dependent steps will re-run", "check_inputs": True}
+        ]
+        return config
+
+    def test_skips_step_when_inputs_unchanged(self, utils):
+        """run_step: 上流のステップを再実行しても入力が前回と同じであれば、ステップを実行せずスキップする"""
+        config = self._config_with_check_inputs(utils, "hierarchical_overview")
+        calls = []
+
+        utils.run_step("hierarchical_overview", calls.append, config)
+
+        assert calls == []
+        assert config["plan"][0]["run"] is False
+        assert config["plan"][0]["reason"] == "inputs unchanged after re-running dependent steps"
+        assert "completed_jobs" not in config
+
+    def test_runs_step_when_inputs_changed(self, utils):
+        """run_step: 上流のステップの出力が変わった場合は実行し、新しい入力のハッシュを記録する"""
+        config = self._config_with_check_inputs(utils, "hierarchical_overview")
+        calls = []
+        _append("outputs/test/hierarchical_merge_labels.csv", "changed")
+
+        utils.run_step("hierarchical_overview", calls.append, config)
+
+        assert calls == [config]
+        assert config["plan"][0]["run"] is True
+        job = config["completed_jobs"][0]
+        assert job["step"] == "hierarchical_overview"
+        assert job["input_fingerprint"] == utils.input_fingerprint(config, "hierarchical_overview")
+
+    def test_runs_aggregation_when_only_input_csv_changed(self, utils):
+        """run_step: 抽出の結果が同じでも、入力CSV（属性のカラムなど）が変わった場合は集約を実行する"""
+        config = self._config_with_check_inputs(utils, "hierarchical_aggregation")
+        calls = []
+        _append("inputs/test.csv", "1,追加,30\n")
+
+        utils.run_step("hierarchical_aggregation", calls.append, config)
+
+        assert calls == [config]
+
+
+class TestStatusWrites:
+    """ステータス・進捗ファイルの書き出しのテスト"""
+
+    def test_write_json_atomic(self, utils):
+        """_write_json_atomic: 一時ファイルに書き出してから置き換え、一時ファイルを残さない"""
+        path = "outputs/test/hierarchical_status.json"
+        utils._write_json_atomic(path, {"status": "running"})
+        utils._write_json_atomic(path, {"status": "completed"}, indent=2)
+
+        with open(path) as f:
+            assert json.load(f) == {"status": "completed"}
+        assert not os.path.exists(f"{path}.tmp")
+
+    def test_write_json_atomic_keeps_previous_file_on_error(self, utils):
+        """_write_json_atomic: 書き出しの途中で失敗しても、読み込み側からは前回の内容のまま見える"""
+        path = "outputs/test/hierarchical_status.json"
+        utils._write_json_atomic(path, {"status": "running"})
+
+        with pytest.raises(TypeError):
+            utils._write_json_atomic(path, {"status": object()})
+
+        with open(path) as f:
+            assert json.load(f) == {"status": "running"}
+
+    def test_update_progress_write_interval(self, utils, monkeypatch):
+        """update_progress: 進捗はPROGRESS_WRITE_INTERVAL秒に1回、ステータス全体はSTATUS_WRITE_INTERVAL秒に1回だけ書き出す"""
+        clock = [0.0]
+        writes = []
+        write_progress = utils._write_progress
+        write_status = utils._write_status
+        monkeypatch.setattr(utils.time, "monotonic", lambda: clock[0])
+        monkeypatch.setattr(utils, "_last_writes", {"status": 0.0, "progress": 0.0})
+        monkeypatch.setattr(
+            utils, "_write_progress", lambda config: (writes.append("progress"), write_progress(config))
+        )
+        monkeypatch.setattr(utils, "_write_status", lambda config: (writes.append("status"), write_status(config)))
+        config = {"output_dir": "test", "status": "running", "current_job": "extraction"}
+
+        # 進捗の開始は必ず書き出す
+        utils.update_progress(config, "extraction", total=10)
+        assert writes == ["progress"]
+
+        clock[0] = utils.PROGRESS_WRITE_INTERVAL / 2
+        utils.update_progress(config, "extraction", incr=1)
+        assert writes == ["progress"]
+
+        clock[0] = utils.PROGRESS_WRITE_INTERVAL
+        utils.update_progress(config, "extraction", incr=1)
+        assert writes == ["progress", "progress"]
+
+        clock[0] = utils.STATUS_WRITE_INTERVAL
+        utils.update_progress(config, "extraction", incr=1)
+        assert writes == ["progress", "progress", "status", "progress"]
+
+        # 最後の1件は間隔によらず書き出す
+        clock[0] += 0.01
+        utils.update_progress(config, "extraction", incr=7)
+        assert writes[-1] == "progress"
+        assert len(writes) == 5
+        with open("outputs/test/hierarchical_progress.json") as f:
+            progress = json.load(f)
+        assert progress["current_job_progress"] == 10
+        assert progress["current_jop_tasks"] == 10
+
+
+class TestConcurrentSteps:
+    """並行して実行されるステップのステータス・トークン使用量の記録のテスト"""
+
+    def test_specs_have_parallel_branches(self, utils):
+        """hierarchical_specs.json: カテゴリ分類は埋め込みと、CSV出力は集約・可視化と依存関係がない"""
+        deps = {spec["step"]: spec["dependencies"]["steps"] for spec in utils.specs}
+
+        assert deps["embedding"] == ["extraction"]
+        assert deps["category_classification"] == ["extraction"]
+        assert "category_classification" in deps["hierarchical_aggregation"]
+        assert "hierarchical_aggregation" not in deps["hierarchical_comment_export"]
+        assert "hierarchical_comment_export" not in deps["hierarchical_visualization"]
+
+    def test_steps_record_own_progress_and_token_usage(self, utils, monkeypatch):
+        """run_steps: 並行して実行したステップの進捗とトークン使用量をステップごとに記録する"""
+        monkeypatch.setattr(utils, "get_concurrency_stats", lambda: {})
+        config = _config(utils)
+        config["plan"] = [{"step": spec["step"], "run": True, "reason": "test"} for spec in utils.specs]
+        # 2つのステップが同時に実行されていなければ待ち合わせがタイムアウトする
+        barrier = threading.Barrier(2, timeout=5)
+        running = []
+
+        def step_func(step, tokens, tasks):
+            def func(config):
+                utils.update_progress(config, step, total=tasks)
+                barrier.wait()
+                for _ in range(tasks):
+                    utils.record_token_usage(config, step, tokens, 1, tokens + 1)
+                    utils.update_progress(config, step, incr=1)
+                barrier.wait()
+                with open("outputs/test/hierarchical_progress.json") as f:
+                    running.append(json.load(f))
+                barrier.wait()
+
+            return func
+
+        utils.run_steps(
+            {
+                "embedding": step_func("embedding", 10, 20),
+                "category_classification": step_func("category_classification", 100, 30),
+            },
+            config,
+        )
+
+        # 実行中は両方のステップの進捗を記録し、current_jobは定義の順で前にあるステップを表す
+        assert running[0]["running_jobs"]["embedding"]["progress"] == 20
+        assert running[0]["running_jobs"]["category_classification"]["progress"] == 30
+        assert running[0]["current_job"] == "embedding"
+        jobs = {job["step"]: job for job in config["completed_jobs"]}
+        assert jobs["embedding"]["token_usage"] == 20 * 11
+        assert jobs["category_classification"]["token_usage"] == 30 * 101
+        assert config["total_token_usage"] == 20 * 11 + 30 * 101
+        assert config["token_usage_input"] == 20 * 10 + 30 * 100
+        assert config["running_jobs"] == {}
+        assert "current_job_progress" not in config
@@ -0,0 +1,136 @@
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def utils(pipeline_module, monkeypatch):
+    """テスト用のステップ定義で実行できるようにしたhierarchical_utilsを返す（run_stepは関数を呼ぶだけにする）"""
+    module = pipeline_module("hierarchical_utils")
+    monkeypatch.setattr(module, "run_step", lambda step, func, config: func(config))
+    monkeypatch.setattr(module, "RESOURCE_SLOTS", {"llm": 1, "cpu": 1, "io": 1})
+    return module
+
+
+@pytest.fixture
+def use_specs(utils, monkeypatch):
+    """(ステップ名, 資源, 依存するステップ)の組からステップ定義を作って差し替える関数を返す"""
+
+    def _use_specs(*step_specs):
+        specs = [
+            {"step": step, "resource": resource, "dependencies": {"params": [], "steps": deps}}
+            for step, resource, deps in step_specs
+        ]
+        monkeypatch.setattr(utils, "specs", specs)
+
+    return _use_specs
+
+
+class Recorder:
+    """ステップの開始・終了の順序を記録する"""
+
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    def record(self, event):
+        with self.lock:
+            self.events.append(event)
+
+    def step(self, name, wait=None, error=None):
+        def func(config):
+            self.record(("start", name))
+            if wait is not None:
+                wait()
+            if error is not None:
+                raise error
+            self.record(("end", name))
+
+        return func
+
+    def index(self, event):
+        return self.events.index(event)
+
+
+def test_steps_start_after_dependencies(utils, use_specs):
+    """run_steps: 依存するステップが全て完了してから開始し、資源の異なる独立したステップは並行して実行する"""
+    use_specs(("a", "llm", []), ("b", "cpu", []), ("c", "io", ["a", "b"]))
+    recorder = Recorder()
+    # aとbが同時に実行されていなければ待ち合わせがタイムアウトする
+    barrier = threading.Barrier(2, timeout=5)
+
+    utils.run_steps(
+        {"a": recorder.step("a", barrier.wait), "b": recorder.step("b", barrier.wait), "c": recorder.step("c")},
+        {},
+    )
+
+    assert recorder.index(("start", "c")) > recorder.index(("end", "a"))
+    assert recorder.index(("start", "c")) > recorder.index(("end", "b"))
+    assert recorder.events[-1] == ("end", "c")
+
+
+def test_resource_slots_limit_concurrency(utils, use_specs):
+    """run_steps: 同じ資源のステップはRESOURCE_SLOTSの数までしか同時に実行せず、定義の順に開始する"""
+    use_specs(("a", "llm", []), ("b", "llm", []), ("c", "llm", []))
+    recorder = Recorder()
+
+    utils.run_steps({name: recorder.step(name, lambda: time.sleep(0.01)) for name in "abc"}, {})
+
+    assert recorder.events == [("start", "a"), ("end", "a"), ("start", "b"), ("end", "b"), ("start", "c"), ("end", "c")]
+
+
+def test_dependencies_outside_step_funcs_are_ignored(utils, use_specs):
+    """run_steps: step_funcsに含まれないステップへの依存は解決済みとみなす"""
+    use_specs(("a", "llm", []), ("b", "cpu", ["a"]))
+    recorder = Recorder()
+
+    utils.run_steps({"b": recorder.step("b")}, {})
+
+    assert recorder.events == [("start", "b"), ("end", "b")]
+
+
+def test_failure_skips_dependent_steps(utils, use_specs):
+    """run_steps: 失敗したステップの例外を送出し、それに依存するステップは実行しない"""
+    use_specs(("a", "llm", []), ("b", "cpu", ["a"]))
+    recorder = Recorder()
+
+    with pytest.raises(ValueError, match="failed"):
+        utils.run_steps({"a": recorder.step("a", error=ValueError("failed")), "b": recorder.step("b")}, {})
+
+    assert recorder.events == [("start", "a")]
+
+
+def test_failure_waits_for_running_steps(utils, use_specs):
+    """run_steps: ステップが失敗しても実行中のステップの完了を待ち、新しいステップは開始しない"""
+    use_specs(("a", "llm", []), ("b", "cpu", []), ("c", "cpu", []))
+    recorder = Recorder()
+    a_failed = threading.Event()
+
+    def fail(config):
+        recorder.record(("start", "a"))
+        a_failed.set()
+        raise ValueError("failed")
+
+    def slow():
+        # aが失敗した後も実行を続ける
+        assert a_failed.wait(timeout=5)
+        time.sleep(0.05)
+
+    with pytest.raises(ValueError, match="failed"):
+        utils.run_steps({"a": fail, "b": recorder.step("b", slow), "c": recorder.step("c")}, {})
+
+    # 例外が送出された時点でbは完了しており、cpuの枠の空きを待っていたcは開始されていない
+    assert ("end", "b") in recorder.events
+    assert ("start", "c") not in recorder.events
+
+
+def test_circular_dependencies(utils, use_specs):
+    """run_steps: 循環する依存がある場合は実行できるステップを実行してからエラーにする"""
+    use_specs(("a", "llm", []), ("b", "cpu", ["c"]), ("c", "io", ["b"]))
+    recorder = Recorder()
+
+    with pytest.raises(RuntimeError, match="Circular dependencies"):
+        utils.run_steps({name: recorder.step(name) for name in "abc"}, {})
+
+    assert recorder.events == [("start", "a"), ("end", "a")]
@@ -1,3 +1,4 @@
+import asyncio
 import json
 from unittest.mock import mock_open, patch
 
@@ -5,7 +6,7 @@ import pytest
 from fastapi import FastAPI
 from httpx import AsyncClient
 
-from src.routers.admin_report import router, verify_admin_api_key
+from src.routers.admin_report import get_current_step, router, verify_admin_api_key
 
 
 @pytest.fixture
@@ -119,3 +120,35 @@ async def test_get_current_step_exception(async_client, test_slug):
         assert data["token_usage"] == 0
         assert data["token_usage_input"] == 0
         assert data["token_usage_output"] == 0
+
+
+def test_get_current_step_prefers_progress_file(test_slug, tmp_path):
+    """get_current_stepエンドポイントが進捗ファイルがある場合はそちらを参照することをテスト"""
+    report_dir = tmp_path / test_slug
+    report_dir.mkdir()
+    (report_dir / "hierarchical_status.json").write_text(json.dumps({"status": "running", "current_job": "extraction"}))
+    (report_dir / "hierarchical_progress.json").write_text(
+        json.dumps({"status": "running", "current_job": "embedding", "total_token_usage": 42})
+    )
+
+    # memo: pytest-asyncioがなくても実行されるよう、エンドポイントの関数を直接呼び出す
+    with patch("src.routers.admin_report.settings.REPORT_DIR", tmp_path):
+        data = asyncio.run(get_current_step(test_slug))
+
+    assert data["current_step"] == "embedding"
+    assert data["token_usage"] == 42
+
+
+def test_get_current_step_falls_back_to_status_file(test_slug, tmp_path):
+    """get_current_stepエンドポイントが進捗ファイルがない場合はステータスファイルを参照することをテスト"""
+    report_dir = tmp_path / test_slug
+    report_dir.mkdir()
+    (report_dir / "hierarchical_status.json").write_text(
+        json.dumps({"status": "running", "current_job": "extraction", "total_token_usage": 7})
+    )
+
+    with patch("src.routers.admin_report.settings.REPORT_DIR", tmp_path):
+        data = asyncio.run(get_current_step(test_slug))
+
+    assert data["current_step"] == "extraction"
+    assert data["token_usage"] == 7
@@ -0,0 +1,33 @@
+import pytest
+from pydantic import ValidationError
+
+from src.schemas.admin_report import ReportInput
+
+
+def _report_input(**kwargs):
+    return ReportInput(
+        input="report",
+        question="質問",
+        intro="概要",
+        cluster=[3, 6],
+        model="gpt-4o-mini",
+        workers=1,
+        prompt={"extraction": "", "initial_labelling": "", "merge_labelling": "", "overview": ""},
+        comments=[],
+        **kwargs,
+    )
+
+
+@pytest.mark.parametrize("provider", ["openai", "azure"])
+def test_batch_mode_with_supported_provider(provider):
+    """ReportInput: Batch APIに対応したプロバイダーではbatch_modeを受け付ける"""
+    assert _report_input(provider=provider, batch_mode=True).batch_mode is True
+
+
+@pytest.mark.parametrize("provider", ["local", "openrouter"])
+def test_batch_mode_with_unsupported_provider(provider):
+    """ReportInput: Batch APIに対応していないプロバイダーでbatch_modeを指定するとエラーになる"""
+    with pytest.raises(ValidationError, match="batch_mode is not supported"):
+        _report_input(provider=provider, batch_mode=True)
+
+    assert _report_input(provider=provider).batch_mode is False
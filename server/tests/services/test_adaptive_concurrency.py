@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from broadlistening.pipeline.services.adaptive_concurrency import AdaptiveConcurrencyLimiter
+
+
+class TestAdaptiveConcurrencyLimiter:
+    """適応的な同時実行数制御のテスト"""
+
+    def test_increases_while_healthy(self):
+        """release: レイテンシが基準値の範囲内で成功している間は上限を増やす"""
+        limiter = AdaptiveConcurrencyLimiter(initial=2, max_limit=5)
+
+        async def run():
+            for _ in range(10):
+                await limiter.acquire()
+                limiter.release(latency=0.1)
+
+        asyncio.run(run())
+
+        assert limiter.stats()["effective_concurrency"] == 5
+
+    def test_decreases_on_overload(self):
+        """release: 過負荷を検知したら上限を半分に減らし、以降は緩やかに増やす"""
+        limiter = AdaptiveConcurrencyLimiter(initial=8)
+
+        async def run():
+            await limiter.acquire()
+            limiter.release(latency=0.1, overloaded=True, succeeded=False)
+            await limiter.acquire()
+            limiter.release(latency=0.1)
+
+        asyncio.run(run())
+
+        stats = limiter.stats()
+        assert stats["effective_concurrency"] == 4
+        assert stats["decreases"] == 1
+        assert stats["overloaded"] == 1
+
+    def test_limits_in_flight(self):
+        """slot: 同時に実行されるリクエスト数が上限を超えない"""
+        limiter = AdaptiveConcurrencyLimiter(initial=2, max_limit=2)
+        running = 0
+        max_running = 0
+
+        async def request():
+            nonlocal running, max_running
+            async with limiter.slot(lambda e: False):
+                running += 1
+                max_running = max(max_running, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+
+        async def run():
+            await asyncio.gather(*[request() for _ in range(10)])
+
+        asyncio.run(run())
+
+        assert max_running == 2
+        assert limiter.stats()["in_flight"] == 0
+
+    def test_slot_reports_overload_error(self):
+        """slot: 過負荷を示す例外で終わった場合は上限を減らし、例外をそのまま送出する"""
+        limiter = AdaptiveConcurrencyLimiter(initial=4)
+
+        async def run():
+            async with limiter.slot(lambda e: isinstance(e, TimeoutError)):
+                raise TimeoutError
+
+        with pytest.raises(TimeoutError):
+            asyncio.run(run())
+
+        assert limiter.stats()["effective_concurrency"] == 2
@@ -0,0 +1,195 @@
+import asyncio
+import json
+from unittest.mock import patch
+
+import httpx
+import pytest
+from broadlistening.pipeline.services.batch_api import (
+    BatchCollector,
+    BatchRequestError,
+    configure_batch_mode,
+    is_batch_mode,
+)
+from broadlistening.pipeline.services.llm import _strict_response_format, arequest_to_chat_ai
+from openai import AsyncOpenAI
+from pydantic import BaseModel, Field
+
+
+class CalendarEvent(BaseModel):
+    name: str = Field(..., description="イベント名")
+
+
+class FakeBatchEndpoint:
+    """OpenAI Batch API互換のフェイクエンドポイント（各リクエストのユーザーメッセージをそのまま返す）"""
+
+    def __init__(self, fail_custom_ids=()):
+        self.fail_custom_ids = set(fail_custom_ids)
+        self.files: dict[str, str] = {}
+        self.batches: dict[str, dict] = {}
+        self.submitted: list[list[dict]] = []
+
+    def _batch(self, batch_id: str, status: str, output_file_id: str | None = None) -> dict:
+        batch = self.batches[batch_id]
+        batch.update({"status": status, "output_file_id": output_file_id})
+        return batch
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if request.method == "POST" and path.endswith("/files"):
+            lines = [line for line in request.content.decode("utf-8").splitlines() if line.startswith('{"custom_id"')]
+            file_id = f"file-{len(self.files)}"
+            self.files[file_id] = "\n".join(lines)
+            return httpx.Response(
+                200,
+                json={
+                    "id": file_id,
+                    "object": "file",
+                    "bytes": 0,
+                    "created_at": 0,
+                    "filename": "batch.jsonl",
+                    "purpose": "batch",
+                    "status": "processed",
+                },
+            )
+        if request.method == "POST" and path.endswith("/batches"):
+            body = json.loads(request.content)
+            batch_id = f"batch-{len(self.batches)}"
+            self.batches[batch_id] = {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": body["endpoint"],
+                "completion_window": body["completion_window"],
+                "created_at": 0,
+                "input_file_id": body["input_file_id"],
+                "status": "validating",
+            }
+            return httpx.Response(200, json=self.batches[batch_id])
+        if request.method == "GET" and "/batches/" in path:
+            batch_id = path.rsplit("/", 1)[-1]
+            requests = [json.loads(line) for line in self.files[self.batches[batch_id]["input_file_id"]].splitlines()]
+            self.submitted.append(requests)
+            output_file_id = f"{batch_id}-output"
+            self.files[output_file_id] = "\n".join(json.dumps(self._result(r)) for r in requests)
+            return httpx.Response(200, json=self._batch(batch_id, "completed", output_file_id))
+        if request.method == "GET" and path.endswith("/content"):
+            return httpx.Response(200, text=self.files[path.split("/")[-2]])
+        return httpx.Response(404)
+
+    def _result(self, request: dict) -> dict:
+        if request["custom_id"] in self.fail_custom_ids:
+            return {"custom_id": request["custom_id"], "response": {"status_code": 400, "body": {"error": "bad"}}}
+        content = request["body"]["messages"][-1]["content"]
+        body = {
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 3, "completion_tokens": 2, "total_tokens": 5},
+        }
+        return {"custom_id": request["custom_id"], "response": {"status_code": 200, "body": body}}
+
+
+def fake_client(endpoint: FakeBatchEndpoint) -> AsyncOpenAI:
+    return AsyncOpenAI(
+        api_key="dummy",
+        base_url="http://fake-batch/v1",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(endpoint.handler)),
+    )
+
+
+class TestBatchCollector:
+    """Batch APIモードのテスト"""
+
+    @pytest.fixture(autouse=True)
+    def disable_batch_mode_after_test(self):
+        yield
+        configure_batch_mode(False)
+
+    def test_collects_concurrent_requests_into_one_job(self, tmp_path):
+        """request: 並行して発行されたリクエストを1つのバッチジョブにまとめ、それぞれの結果を返す"""
+        endpoint = FakeBatchEndpoint()
+        collector = BatchCollector(work_dir=str(tmp_path), poll_interval=0, flush_delay=0.01)
+
+        async def run():
+            client = fake_client(endpoint)
+            bodies = [{"model": "gpt-4o", "messages": [{"role": "user", "content": f"m{i}"}]} for i in range(3)]
+            return await asyncio.gather(*[collector.request(client, body) for body in bodies])
+
+        responses = asyncio.run(run())
+
+        assert [r["choices"][0]["message"]["content"] for r in responses] == ["m0", "m1", "m2"]
+        assert len(endpoint.submitted) == 1
+        assert len(endpoint.submitted[0]) == 3
+        assert (tmp_path / "batch_001_input.jsonl").exists()
+        assert collector.stats() == [{"requests": 3, "batch_id": "batch-0", "status": "completed"}]
+
+    def test_failed_request_raises(self):
+        """request: バッチ内で失敗したリクエストはBatchRequestErrorになる"""
+        endpoint = FakeBatchEndpoint()
+        collector = BatchCollector(poll_interval=0, flush_delay=0.01)
+
+        async def run():
+            client = fake_client(endpoint)
+            with patch("broadlistening.pipeline.services.batch_api.uuid.uuid4") as mock_uuid:
+                mock_uuid.return_value.hex = "x"
+                endpoint.fail_custom_ids.add("request-x")
+                return await collector.request(client, {"model": "gpt-4o", "messages": []})
+
+        with pytest.raises(BatchRequestError):
+            asyncio.run(run())
+
+    def test_arequest_to_chat_ai_in_batch_mode(self):
+        """arequest_to_chat_ai: Batch APIモードではバッチジョブ経由でレスポンスとトークン使用量を返す"""
+        endpoint = FakeBatchEndpoint()
+        configure_batch_mode(True, poll_interval=0, flush_delay=0.01)
+        messages = [{"role": "user", "content": '{"name": "会議"}'}]
+
+        async def run():
+            with patch(
+                "broadlistening.pipeline.services.llm._batch_client",
+                return_value=(fake_client(endpoint), "/v1/chat/completions"),
+            ):
+                return await arequest_to_chat_ai(messages=messages, model="gpt-4o", json_schema=CalendarEvent)
+
+        result = asyncio.run(run())
+
+        assert result == ('{"name": "会議"}', 3, 2, 5)
+        body = endpoint.submitted[0][0]["body"]
+        assert body["model"] == "gpt-4o"
+        assert body["response_format"]["type"] == "json_schema"
+        assert body["response_format"]["json_schema"]["name"] == "CalendarEvent"
+
+
+class Attendee(BaseModel):
+    name: str
+    role: str | None = None
+
+
+class Meeting(BaseModel):
+    title: str
+    attendees: list[Attendee] = []
+
+
+def test_strict_response_format_for_nested_model():
+    """_strict_response_format: 入れ子のモデルも含めadditionalPropertiesをfalseにし、全プロパティをrequiredにする"""
+    response_format = _strict_response_format(Meeting)
+
+    assert response_format["type"] == "json_schema"
+    assert response_format["json_schema"]["name"] == "Meeting"
+    assert response_format["json_schema"]["strict"] is True
+    schema = response_format["json_schema"]["schema"]
+    assert schema["additionalProperties"] is False
+    assert schema["required"] == ["title", "attendees"]
+    assert "default" not in schema["properties"]["attendees"]
+    attendee = schema["$defs"]["Attendee"]
+    assert attendee["additionalProperties"] is False
+    assert attendee["required"] == ["name", "role"]
+    assert "default" not in attendee["properties"]["role"]
+
+
+@pytest.mark.parametrize("provider", ["local", "openrouter"])
+def test_configure_batch_mode_rejects_unsupported_provider(provider):
+    """configure_batch_mode: Batch APIに対応していないプロバイダーでは有効にできず、無効であれば何もしない"""
+    with pytest.raises(ValueError, match=f"not supported for provider '{provider}'"):
+        configure_batch_mode(True, provider=provider)
+    assert not is_batch_mode()
+
+    configure_batch_mode(False, provider=provider)
+    assert not is_batch_mode()
@@ -0,0 +1,95 @@
+import asyncio
+import json
+from unittest.mock import patch
+
+import pandas as pd
+from broadlistening.pipeline.services import category_classification
+from broadlistening.pipeline.services.category_classification import (
+    build_classification_batches,
+    classify_args,
+    classify_batch_args,
+)
+
+CATEGORIES = {"sentiment": {"ポジティブ": "肯定的な意見", "ネガティブ": "否定的な意見"}}
+
+
+def make_args(n: int, argument: str = "意見") -> pd.DataFrame:
+    return pd.DataFrame({"arg-id": [f"A{i}_0" for i in range(n)], "argument": [f"{argument}{i}" for i in range(n)]})
+
+
+def fake_chat(respond):
+    """プロンプトに含まれるarg-idのリストを受け取り、応答の文字列を返す関数からarequest_to_chat_aiの代わりを作る"""
+    prompts = []
+
+    async def chat(messages, **kwargs):
+        prompt = messages[0]["content"]
+        prompts.append(prompt)
+        arg_ids = [line.split(":")[0][2:] for line in prompt.splitlines() if line.startswith("- A")]
+        return respond(arg_ids), 0, 0, 0
+
+    return chat, prompts
+
+
+def all_positive(arg_ids):
+    return json.dumps({arg_id: {"sentiment": "ポジティブ"} for arg_id in arg_ids})
+
+
+class TestBuildClassificationBatches:
+    def test_batches_do_not_overlap(self):
+        """build_classification_batches: すべての意見がちょうど1回ずつ含まれる"""
+        args = make_args(23)
+        batches = build_classification_batches(args, CATEGORIES, max_tokens=10_000, max_size=5)
+        assert [len(batch) for batch in batches] == [5, 5, 5, 5, 3]
+        assert sum(batches, []) == list(range(23))
+
+    def test_token_budget_limits_batch_size(self):
+        """build_classification_batches: 長い意見ほど1バッチの件数が少なくなる"""
+        short = build_classification_batches(make_args(20), CATEGORIES, max_tokens=200, max_size=100)
+        long = build_classification_batches(make_args(20, "長い意見" * 20), CATEGORIES, max_tokens=200, max_size=100)
+        assert len(long) > len(short)
+        assert sum(long, []) == list(range(20))
+
+
+class TestClassifyBatchArgs:
+    def test_invalid_json_is_split_and_retried(self):
+        """classify_batch_args: JSONとして読めない応答は半分に分けて再分類する"""
+        chat, prompts = fake_chat(lambda ids: all_positive(ids) if len(ids) <= 2 else '{"A0_0": {"sentim')
+        with patch.object(category_classification, "arequest_to_chat_ai", chat):
+            result = asyncio.run(classify_batch_args(make_args(4), CATEGORIES, "gpt-4o-mini"))
+
+        assert set(result) == {"A0_0", "A1_0", "A2_0", "A3_0"}
+        assert len(prompts) == 3
+
+    def test_only_missing_args_are_retried(self):
+        """classify_batch_args: 応答に含まれなかった意見だけを再分類する"""
+        chat, prompts = fake_chat(lambda ids: all_positive(ids[:-1]) if len(ids) > 1 else all_positive(ids))
+        with patch.object(category_classification, "arequest_to_chat_ai", chat):
+            result = asyncio.run(classify_batch_args(make_args(3), CATEGORIES, "gpt-4o-mini"))
+
+        assert set(result) == {"A0_0", "A1_0", "A2_0"}
+        assert len(prompts) == 2
+        assert "A2_0" in prompts[1] and "A0_0" not in prompts[1]
+
+    def test_single_arg_failure_is_dropped(self):
+        """classify_batch_args: 1件でも分類できない意見は結果に含めない"""
+        chat, prompts = fake_chat(lambda ids: "not json")
+        with patch.object(category_classification, "arequest_to_chat_ai", chat):
+            result = asyncio.run(classify_batch_args(make_args(2), CATEGORIES, "gpt-4o-mini"))
+
+        assert result == {}
+        assert len(prompts) == 3
+
+
+def test_classify_args_classifies_each_argument_once():
+    """classify_args: 境界の意見を重複して分類せず、すべての意見に結果を付与する"""
+    chat, prompts = fake_chat(all_positive)
+    config = {
+        "category_classification": {"categories": CATEGORIES, "category_batch_size": 5, "model": "gpt-4o-mini"},
+    }
+    with patch.object(category_classification, "arequest_to_chat_ai", chat):
+        result = classify_args(make_args(12), config, workers=2)
+
+    classified_ids = [line for prompt in prompts for line in prompt.splitlines() if line.startswith("- A")]
+    assert len(prompts) == 3
+    assert len(classified_ids) == 12
+    assert result["sentiment"].tolist() == ["ポジティブ"] * 12
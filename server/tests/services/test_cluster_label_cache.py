@@ -0,0 +1,51 @@
+from broadlistening.pipeline.services.cluster_label_cache import ClusterLabelCache
+
+
+def test_cluster_key_ignores_order():
+    """cluster_key: 所属する意見の並び順によらず同じキーになり、内容が変わると別のキーになる"""
+    key = ClusterLabelCache.cluster_key(["A1", "A2"], ["意見1", "意見2"])
+
+    assert ClusterLabelCache.cluster_key(["A2", "A1"], ["意見2", "意見1"]) == key
+    assert ClusterLabelCache.cluster_key(["A1", "A2"], ["意見1", "変更"]) != key
+    assert ClusterLabelCache.cluster_key(["A1", "A2"], ["意見1", "意見2"], ["ラベル: 説明"]) != key
+
+
+def test_saved_labels_are_reused_with_same_conditions(tmp_path):
+    """ClusterLabelCache: 同じ条件で作ったキャッシュからは保存したラベルを読み込む"""
+    path = str(tmp_path / "cache.json")
+    cache = ClusterLabelCache(path, "prompt", "gpt-4o-mini", 3)
+    cache.set("key", {"label": "ラベル", "description": "説明"})
+    cache.save()
+
+    reloaded = ClusterLabelCache(path, "prompt", "gpt-4o-mini", 3)
+    assert reloaded.get("key") == {"label": "ラベル", "description": "説明"}
+    assert reloaded.get("other") is None
+    assert reloaded.hits == 1
+
+
+def test_labels_are_not_reused_when_conditions_change(tmp_path):
+    """ClusterLabelCache: プロンプトが変わった場合や無効化した場合は前回のラベルを使わない"""
+    path = str(tmp_path / "cache.json")
+    cache = ClusterLabelCache(path, "prompt", "gpt-4o-mini", 3)
+    cache.set("key", {"label": "ラベル", "description": "説明"})
+    cache.save()
+
+    assert ClusterLabelCache(path, "new prompt", "gpt-4o-mini", 3).get("key") is None
+    assert ClusterLabelCache(path, "prompt", "gpt-4o-mini", 3, enabled=False).get("key") is None
+
+
+def test_save_keeps_only_used_entries(tmp_path):
+    """ClusterLabelCache: 保存時は今回使ったエントリだけを書き出す"""
+    path = str(tmp_path / "cache.json")
+    cache = ClusterLabelCache(path, "prompt", "gpt-4o-mini", 3)
+    cache.set("old", {"label": "古い", "description": "説明"})
+    cache.set("kept", {"label": "残る", "description": "説明"})
+    cache.save()
+
+    second = ClusterLabelCache(path, "prompt", "gpt-4o-mini", 3)
+    second.get("kept")
+    second.save()
+
+    third = ClusterLabelCache(path, "prompt", "gpt-4o-mini", 3)
+    assert third.get("kept") is not None
+    assert third.get("old") is None
@@ -0,0 +1,72 @@
+import numpy as np
+from broadlistening.pipeline.services.cluster_model import (
+    assign_to_centers,
+    center_distances,
+    centroid_drift,
+    cluster_means,
+    fit_kmeans,
+    load_cluster_model,
+    save_cluster_model,
+)
+
+
+def test_save_and_load_roundtrip(tmp_path):
+    """save_cluster_model/load_cluster_model: 保存したモデルをそのまま読み込める"""
+    model = {"linkage": np.arange(8, dtype=float).reshape(2, 4), "cluster_nums": [3, 6], "params": {"mode": "large"}}
+    save_cluster_model(str(tmp_path), model)
+
+    loaded = load_cluster_model(str(tmp_path))
+
+    np.testing.assert_array_equal(loaded["linkage"], model["linkage"])
+    assert loaded["cluster_nums"] == [3, 6]
+    assert loaded["params"] == {"mode": "large"}
+
+
+def test_load_missing_or_broken_model(tmp_path):
+    """load_cluster_model: モデルがない場合や壊れている場合はNoneを返す"""
+    assert load_cluster_model(str(tmp_path)) is None
+
+    (tmp_path / "hierarchical_cluster_model.joblib").write_bytes(b"broken")
+    assert load_cluster_model(str(tmp_path)) is None
+
+
+def test_assign_to_centers():
+    """assign_to_centers: 最も近い中心のインデックスと距離を返す"""
+    centers = np.array([[0.0, 0.0], [10.0, 0.0]])
+    points = np.array([[1.0, 0.0], [9.0, 0.0], [10.0, 3.0]])
+
+    labels, distances = assign_to_centers(points, centers)
+
+    np.testing.assert_array_equal(labels, [0, 1, 1])
+    np.testing.assert_allclose(distances, [1.0, 1.0, 3.0])
+
+
+def test_cluster_means_and_distances():
+    """cluster_means/center_distances: クラスタごとの重心と、割り当てたクラスタの重心までの距離を計算する"""
+    points = np.array([[0.0, 0.0], [2.0, 0.0], [10.0, 10.0]], dtype=np.float32)
+    labels = np.array([0, 0, 2])
+
+    centers = cluster_means(points, labels, 3)
+
+    np.testing.assert_allclose(centers, [[1.0, 0.0], [0.0, 0.0], [10.0, 10.0]])
+    np.testing.assert_allclose(center_distances(points, centers, labels), [1.0, 1.0, 0.0])
+
+
+def test_centroid_drift():
+    """centroid_drift: 新しい意見の平均距離とfit時の平均距離の比を返す"""
+    assert centroid_drift(np.array([1.0, 3.0]), 2.0) == 1.0
+    assert centroid_drift(np.array([8.0]), 2.0) == 4.0
+    assert centroid_drift(np.array([]), 2.0) == 0.0
+
+
+def test_fit_kmeans_thread_limit_keeps_result():
+    """fit_kmeans: OpenMPのスレッド数を制限しても、同じシードであれば同じクラスタになる"""
+    rng = np.random.default_rng(0)
+    points = np.concatenate([rng.normal(loc=center, size=(50, 4)) for center in (-10, 0, 10)])
+
+    limited = fit_kmeans(points, 3, n_threads=1)
+    unlimited = fit_kmeans(points, 3)
+
+    np.testing.assert_array_equal(limited.labels_, unlimited.labels_)
+    assert len(np.unique(limited.labels_)) == 3
+    assert len(fit_kmeans(points, 3, kmeans_batch_size=32).cluster_centers_) == 3
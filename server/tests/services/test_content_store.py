@@ -0,0 +1,45 @@
+from broadlistening.pipeline.services.content_store import (
+    content_hash,
+    get_content,
+    param_value,
+    put_content,
+    slim_params,
+)
+
+
+def test_put_content_stores_text_by_hash(tmp_path):
+    """put_content: 同じ内容は同じハッシュで1つだけ保存し、get_contentで取り出せる"""
+    store_dir = str(tmp_path / "store")
+    digest = put_content(store_dir, "プロンプト")
+
+    assert digest == content_hash("プロンプト")
+    assert put_content(store_dir, "プロンプト") == digest
+    assert len(list((tmp_path / "store").iterdir())) == 1
+    assert get_content(store_dir, digest) == "プロンプト"
+    assert get_content(store_dir, content_hash("other")) is None
+
+
+def test_slim_params_replaces_text_with_hashes():
+    """slim_params: ソースコードとプロンプトをハッシュに置き換え、その他のオプションは残す"""
+    params = {"model": "gpt-4o-mini", "prompt": "プロンプト", "source_code": "print(1)"}
+
+    slim = slim_params(params)
+
+    assert slim == {
+        "model": "gpt-4o-mini",
+        "prompt_hash": content_hash("プロンプト"),
+        "source_code_hash": content_hash("print(1)"),
+    }
+    assert slim_params(slim) == slim
+    assert "prompt" in params
+
+
+def test_param_value_compares_slim_and_legacy_params():
+    """param_value: ハッシュだけを記録したオプションと本文を記録した以前のオプションを同じ値として扱う"""
+    legacy = {"model": "gpt-4o-mini", "prompt": "プロンプト"}
+    slim = slim_params(legacy)
+
+    assert param_value(slim, "prompt") == param_value(legacy, "prompt")
+    assert param_value(slim, "model") == "gpt-4o-mini"
+    assert param_value(slim, "limit") is None
+    assert param_value({}, "prompt") is None
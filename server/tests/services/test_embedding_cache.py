@@ -0,0 +1,115 @@
+import threading
+
+import numpy as np
+from broadlistening.pipeline.services.embedding_cache import EmbeddingCache, embedding_model_key
+
+
+class TestEmbeddingCache:
+    """埋め込みの永続キャッシュのテスト"""
+
+    def test_put_and_get_roundtrip(self, tmp_path):
+        """put_many/get_many: 保存したベクトルをfloat32で取得でき、別のインスタンスからも読み込める"""
+        path = str(tmp_path / "embeddings.sqlite3")
+        cache = EmbeddingCache(path)
+        cache.put_many("openai:text-embedding-3-small", ["意見1", "意見2"], [[0.1, 0.2], [0.3, 0.4]])
+        cache.close()
+
+        reopened = EmbeddingCache(path)
+        vectors = reopened.get_many("openai:text-embedding-3-small", ["意見1", "意見2"])
+        reopened.close()
+
+        assert all(vector.dtype == np.float32 for vector in vectors)
+        np.testing.assert_allclose(vectors, [[0.1, 0.2], [0.3, 0.4]], rtol=1e-6)
+
+    def test_partial_hits_and_duplicates(self, tmp_path):
+        """get_many: キャッシュにない文章はNoneになり、重複した文章にはそれぞれ同じベクトルを返す"""
+        cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"))
+        cache.put_many("openai:m", ["意見1"], [[1.0, 2.0]])
+
+        vectors = cache.get_many("openai:m", ["意見1", "新しい意見", "意見1"])
+        cache.close()
+
+        np.testing.assert_array_equal(vectors[0], [1.0, 2.0])
+        assert vectors[1] is None
+        np.testing.assert_array_equal(vectors[2], [1.0, 2.0])
+
+    def test_entries_are_separated_by_model_key(self, tmp_path):
+        """get_many: 別のモデルのキーで保存したベクトルは返さない"""
+        cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"))
+        cache.put_many("openai:m1", ["意見1"], [[1.0, 2.0]])
+
+        assert cache.get_many("openai:m2", ["意見1"]) == [None]
+        cache.close()
+
+    def test_many_texts_are_queried_in_chunks(self, tmp_path):
+        """get_many: SQLiteのプレースホルダ数の上限を超える件数でも取得できる"""
+        cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"))
+        texts = [f"意見{i}" for i in range(1200)]
+        cache.put_many("openai:m", texts, np.arange(2400, dtype=np.float32).reshape(1200, 2))
+
+        vectors = cache.get_many("openai:m", texts)
+        cache.close()
+
+        assert all(vector is not None for vector in vectors)
+        np.testing.assert_array_equal(vectors[-1], [2398.0, 2399.0])
+
+    def test_concurrent_writers(self, tmp_path):
+        """put_many: 同じファイルを開いた複数のインスタンス・スレッドから同時に書き込んでも全件保存される"""
+        path = str(tmp_path / "embeddings.sqlite3")
+        shared = EmbeddingCache(path)
+        errors = []
+
+        def write(worker: int, cache: EmbeddingCache):
+            try:
+                for batch in range(10):
+                    texts = [f"{worker}-{batch}-{i}" for i in range(20)]
+                    cache.put_many("openai:m", texts, np.full((20, 4), worker, dtype=np.float32))
+            except Exception as e:
+                errors.append(e)
+
+        own_caches = [EmbeddingCache(path) for _ in range(4)]
+        threads = [threading.Thread(target=write, args=(i, shared)) for i in range(4)]
+        threads += [threading.Thread(target=write, args=(4 + i, cache)) for i, cache in enumerate(own_caches)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for cache in own_caches:
+            cache.close()
+
+        texts = [f"{worker}-{batch}-{i}" for worker in range(8) for batch in range(10) for i in range(20)]
+        vectors = shared.get_many("openai:m", texts)
+        shared.close()
+
+        assert errors == []
+        assert all(vector is not None for vector in vectors)
+        assert vectors[-1][0] == 7
+
+
+class TestEmbeddingModelKey:
+    """埋め込みモデルのキーのテスト"""
+
+    def test_local_llm_key_includes_address(self):
+        """embedding_model_key: ローカルLLMは同じモデル名でもアドレスが異なれば別のキーになる"""
+        first = embedding_model_key("nomic-embed-text", provider="local", local_llm_address="host-a:11434")
+        second = embedding_model_key("nomic-embed-text", provider="local", local_llm_address="host-b:11434")
+
+        assert first != second
+        assert embedding_model_key("nomic-embed-text", provider="local") == embedding_model_key(
+            "nomic-embed-text", provider="local", local_llm_address="localhost:11434"
+        )
+
+    def test_azure_key_includes_endpoint(self, monkeypatch):
+        """embedding_model_key: Azureはデプロイメント名が同じでもエンドポイントが異なれば別のキーになる"""
+        monkeypatch.setenv("AZURE_EMBEDDING_DEPLOYMENT_NAME", "embedding")
+        monkeypatch.setenv("AZURE_EMBEDDING_ENDPOINT", "https://a.openai.azure.com")
+        first = embedding_model_key("text-embedding-3-small", provider="azure")
+        monkeypatch.setenv("AZURE_EMBEDDING_ENDPOINT", "https://b.openai.azure.com")
+
+        assert embedding_model_key("text-embedding-3-small", provider="azure") != first
+
+    def test_local_embedding_ignores_model_name(self):
+        """embedding_model_key: ローカル埋め込みはモデル名の指定によらず同じキーになる"""
+        assert embedding_model_key("a", is_embedded_at_local=True) == embedding_model_key(
+            "b", is_embedded_at_local=True
+        )
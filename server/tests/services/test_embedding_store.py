@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+from broadlistening.pipeline.services.embedding_store import load_embeddings, save_embeddings
+
+
+class TestEmbeddingStore:
+    """埋め込みの保存・読み込みのテスト"""
+
+    def test_save_and_load_roundtrip(self, tmp_path):
+        """save_embeddings/load_embeddings: float32の行列としてメモリマップで読み込める"""
+        embeddings = np.arange(12, dtype=np.float64).reshape(4, 3)
+        arg_ids = ["A1_0", "A1_1", "A2_0", "A3_0"]
+
+        save_embeddings(str(tmp_path), arg_ids, embeddings)
+        loaded, loaded_ids = load_embeddings(str(tmp_path))
+
+        assert isinstance(loaded, np.memmap)
+        assert loaded.dtype == np.float32
+        np.testing.assert_array_equal(loaded, embeddings.astype(np.float32))
+        assert loaded_ids == arg_ids
+
+    def test_load_legacy_pickle(self, tmp_path):
+        """load_embeddings: 旧形式のembeddings.pklしかない場合はそちらを読み込む"""
+        pd.DataFrame({"arg-id": ["A1_0", "A2_0"], "embedding": [[0.1, 0.2], [0.3, 0.4]]}).to_pickle(
+            tmp_path / "embeddings.pkl"
+        )
+
+        loaded, loaded_ids = load_embeddings(str(tmp_path))
+
+        assert loaded.dtype == np.float32
+        np.testing.assert_allclose(loaded, [[0.1, 0.2], [0.3, 0.4]], rtol=1e-6)
+        assert loaded_ids == ["A1_0", "A2_0"]
+
+    def test_save_rejects_mismatched_arg_ids(self, tmp_path):
+        """save_embeddings: 行数とarg-idの数が一致しない場合はエラーになる"""
+        with pytest.raises(ValueError):
+            save_embeddings(str(tmp_path), ["A1_0"], np.zeros((2, 3)))
+
+    def test_load_missing(self, tmp_path):
+        """load_embeddings: 埋め込みが存在しない場合はFileNotFoundErrorになる"""
+        with pytest.raises(FileNotFoundError):
+            load_embeddings(str(tmp_path))
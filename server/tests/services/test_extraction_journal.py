@@ -0,0 +1,102 @@
+from broadlistening.pipeline.services.extraction_journal import ExtractionJournal
+
+
+class TestExtractionJournal:
+    """意見抽出ジャーナルのテスト"""
+
+    def test_resume_from_journal(self, tmp_path):
+        """append/get: 同じ抽出条件で開き直すと、完了済みのコメントの結果を取得できる"""
+        path = str(tmp_path / "extraction_journal.jsonl")
+        journal = ExtractionJournal(path, "prompt", "gpt-4o", "openai")
+        journal.append(1, "本文1", ["意見A", "意見B"])
+        journal.append("2", "本文2", [])
+        journal.close()
+
+        resumed = ExtractionJournal(path, "prompt", "gpt-4o", "openai")
+
+        assert len(resumed) == 2
+        assert resumed.get("1", "本文1") == ["意見A", "意見B"]
+        assert resumed.get(2, "本文2") == []
+        assert resumed.get(3, "本文3") is None
+
+    def test_ignores_changed_body(self, tmp_path):
+        """get: コメント本文が変わっている場合は未処理として扱う"""
+        path = str(tmp_path / "extraction_journal.jsonl")
+        journal = ExtractionJournal(path, "prompt", "gpt-4o", "openai")
+        journal.append(1, "本文1", ["意見A"])
+        journal.close()
+
+        assert ExtractionJournal(path, "prompt", "gpt-4o", "openai").get(1, "変更後の本文") is None
+
+    def test_discards_journal_for_different_prompt(self, tmp_path):
+        """プロンプトやモデルが異なる場合はジャーナルを読み込まず、追記時に作り直す"""
+        path = str(tmp_path / "extraction_journal.jsonl")
+        journal = ExtractionJournal(path, "prompt", "gpt-4o", "openai")
+        journal.append(1, "本文1", ["意見A"])
+        journal.close()
+
+        changed = ExtractionJournal(path, "new prompt", "gpt-4o", "openai")
+        assert len(changed) == 0
+        changed.append(2, "本文2", ["意見B"])
+        changed.close()
+
+        reopened = ExtractionJournal(path, "new prompt", "gpt-4o", "openai")
+        assert reopened.get(1, "本文1") is None
+        assert reopened.get(2, "本文2") == ["意見B"]
+
+    def test_skips_truncated_line(self, tmp_path):
+        """書き込み途中で中断された行は読み飛ばし、続きから追記できる"""
+        path = tmp_path / "extraction_journal.jsonl"
+        journal = ExtractionJournal(str(path), "prompt", "gpt-4o", "openai")
+        journal.append(1, "本文1", ["意見A"])
+        journal.close()
+        with open(path, "a", encoding="utf-8") as f:
+            f.write('{"comment_id": "2", "body_ha')
+
+        resumed = ExtractionJournal(str(path), "prompt", "gpt-4o", "openai")
+        assert len(resumed) == 1
+        resumed.append(3, "本文3", ["意見C"])
+        resumed.close()
+
+        reopened = ExtractionJournal(str(path), "prompt", "gpt-4o", "openai")
+        assert reopened.get(1, "本文1") == ["意見A"]
+        assert reopened.get(3, "本文3") == ["意見C"]
+
+    def test_discards_journal_for_different_options(self, tmp_path):
+        """重複判定やパッキングのオプションが異なる場合はジャーナルを読み込まない"""
+        path = str(tmp_path / "extraction_journal.jsonl")
+        journal = ExtractionJournal(path, "prompt", "gpt-4o", "openai", options={"dedup": "exact", "packing": False})
+        journal.append(1, "本文1", ["意見A"])
+        journal.close()
+
+        same = ExtractionJournal(path, "prompt", "gpt-4o", "openai", options={"packing": False, "dedup": "exact"})
+        assert same.get(1, "本文1") == ["意見A"]
+        packed = ExtractionJournal(path, "prompt", "gpt-4o", "openai", options={"dedup": "exact", "packing": True})
+        assert packed.get(1, "本文1") is None
+
+    def test_disabled_journal_is_not_restored_and_is_rewritten(self, tmp_path):
+        """enabled=False（-f）の場合は既存のジャーナルを読み込まず、追記時に作り直す"""
+        path = str(tmp_path / "extraction_journal.jsonl")
+        journal = ExtractionJournal(path, "prompt", "gpt-4o", "openai")
+        journal.append(1, "本文1", ["意見A"])
+        journal.close()
+
+        forced = ExtractionJournal(path, "prompt", "gpt-4o", "openai", enabled=False)
+        assert forced.get(1, "本文1") is None
+        forced.append(2, "本文2", ["意見B"])
+        forced.close()
+
+        reopened = ExtractionJournal(path, "prompt", "gpt-4o", "openai")
+        assert reopened.get(1, "本文1") is None
+        assert reopened.get(2, "本文2") == ["意見B"]
+
+    def test_remove_after_completion(self, tmp_path):
+        """remove: 抽出の完了後にジャーナルを削除し、次回の実行では何も復元しない"""
+        path = tmp_path / "extraction_journal.jsonl"
+        journal = ExtractionJournal(str(path), "prompt", "gpt-4o", "openai")
+        journal.append(1, "本文1", ["意見A"])
+
+        journal.remove()
+
+        assert not path.exists()
+        assert len(ExtractionJournal(str(path), "prompt", "gpt-4o", "openai")) == 0
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from broadlistening.pipeline.services import knn_graph
+from broadlistening.pipeline.services.knn_graph import build_knn_graph, file_digest, get_knn_graph, knn_cache_key
+
+
+def _points():
+    rng = np.random.default_rng(0)
+    return rng.normal(size=(50, 4)).astype(np.float32)
+
+
+def test_build_exact_knn_graph_includes_self():
+    """build_knn_graph: exactでは各点の最近傍は自身で、距離は昇順になる"""
+    indices, distances, search_index = build_knn_graph(_points(), 5, backend="exact")
+
+    assert indices.shape == distances.shape == (50, 5)
+    np.testing.assert_array_equal(indices[:, 0], np.arange(50))
+    assert (np.diff(distances, axis=1) >= 0).all()
+    assert search_index is None
+
+
+def test_build_rejects_unknown_backend():
+    """build_knn_graph: 未知のバックエンドはエラーになる"""
+    with pytest.raises(ValueError):
+        build_knn_graph(_points(), 5, backend="unknown")
+
+
+def test_hnsw_without_hnswlib_points_to_extra(monkeypatch):
+    """build_knn_graph: hnswlibがインストールされていない場合は、hnsw extraのインストール方法を示すエラーになる"""
+
+    def missing(name):
+        raise ImportError(f"No module named '{name}'")
+
+    monkeypatch.setattr(knn_graph, "import_module", missing)
+
+    with pytest.raises(ImportError, match="'hnsw' extra"):
+        build_knn_graph(_points(), 5, backend="hnsw")
+
+
+def test_cached_graph_is_reused_only_with_same_key(tmp_path, monkeypatch):
+    """get_knn_graph: 同じキーのキャッシュがあれば作り直さず、キーが変わった場合は作り直す"""
+    cache_path = str(tmp_path / "graph.joblib")
+    indices, distances, _ = get_knn_graph(_points(), 5, backend="exact", cache_path=cache_path, cache_key="a")
+
+    def fail(*args, **kwargs):
+        raise AssertionError("graph should be loaded from the cache")
+
+    monkeypatch.setattr(knn_graph, "build_knn_graph", fail)
+    cached_indices, cached_distances, _ = get_knn_graph(
+        _points(), 5, backend="exact", cache_path=cache_path, cache_key="a"
+    )
+    np.testing.assert_array_equal(cached_indices, indices)
+    np.testing.assert_array_equal(cached_distances, distances)
+
+    with pytest.raises(AssertionError):
+        get_knn_graph(_points(), 5, backend="exact", cache_path=cache_path, cache_key="b")
+
+
+def test_cache_key_depends_on_file_content(tmp_path):
+    """file_digest/knn_cache_key: 埋め込みファイルの内容やパラメータが変わるとキーが変わる"""
+    path = tmp_path / "embeddings.npy"
+    path.write_bytes(b"first")
+    first = knn_cache_key(embeddings=file_digest(str(path)), n_neighbors=15)
+
+    assert knn_cache_key(embeddings=file_digest(str(path)), n_neighbors=15) == first
+    assert knn_cache_key(embeddings=file_digest(str(path)), n_neighbors=10) != first
+    path.write_bytes(b"second")
+    assert knn_cache_key(embeddings=file_digest(str(path)), n_neighbors=15) != first
@@ -1,15 +1,27 @@
+import asyncio
 import os
-from unittest.mock import MagicMock, patch
+import threading
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
 
+import httpx
 import openai
 import pytest
 from broadlistening.pipeline.services.llm import (
+    LLMScheduler,
+    _is_overload_error,
     _validate_model,
+    arequest_to_chat_ai,
+    estimate_tokens,
+    get_client,
+    get_client_metrics,
     request_to_azure_chatcompletion,
     request_to_azure_embed,  # noqa: F401
     request_to_chat_ai,
     request_to_embed,  # noqa: F401
     request_to_openai,
+    reset_clients,
+    run_chat_requests,
 )
 from openai import AzureOpenAI  # noqa: F401
 from pydantic import BaseModel, Field
@@ -18,6 +30,13 @@ from pydantic import BaseModel, Field
 class TestLLMService:
     """LLMサービスのテスト"""
 
+    @pytest.fixture(autouse=True)
+    def reset_shared_clients(self):
+        """テストごとに共有クライアントを破棄し、モックの差し替えを反映させるフィクスチャ"""
+        reset_clients()
+        yield
+        reset_clients()
+
     @pytest.fixture
     def mock_openai_response(self):
         """OpenAIのレスポンスをモック化するフィクスチャ"""
@@ -739,3 +758,123 @@ class TestLLMService:
             with patch("broadlistening.pipeline.services.llm.OpenAI", return_value=mock_client):
                 with pytest.raises(openai.RateLimitError):
                     request_to_chat_ai(messages=messages, model=model, provider="openrouter")
+
+    def test_get_client_reuses_same_key(self):
+        """get_client: 同じ(provider, base_url, api_version)では同一クライアントを再利用する"""
+        with patch("broadlistening.pipeline.services.llm.OpenAI", side_effect=lambda **_: MagicMock()) as mock_cls:
+            first = get_client("local", base_url="http://localhost:11434/v1", api_key="not-needed")
+            second = get_client("local", base_url="http://localhost:11434/v1", api_key="not-needed")
+            other = get_client("local", base_url="http://localhost:1234/v1", api_key="not-needed")
+
+        assert first is second
+        assert first is not other
+        assert mock_cls.call_count == 2
+        metrics = get_client_metrics()
+        assert metrics["clients_created"] == 2
+        assert metrics["clients_reused"] == 1
+
+    def test_arequest_to_chat_ai_use_local(self, mock_openai_response):
+        """arequest_to_chat_ai: 同期版と同じペイロードで非同期クライアントにリクエストする"""
+        messages = [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": "Hello, world!"},
+        ]
+        mock_openai_response.configure_mock(
+            **{"usage.prompt_tokens": 10, "usage.completion_tokens": 5, "usage.total_tokens": 15}
+        )
+        mock_client = MagicMock()
+        mock_client.chat.completions.create = AsyncMock(return_value=mock_openai_response)
+
+        with patch("broadlistening.pipeline.services.llm.AsyncOpenAI", return_value=mock_client) as mock_cls:
+            response = asyncio.run(
+                arequest_to_chat_ai(
+                    messages=messages,
+                    model="llama3",
+                    is_json=True,
+                    provider="local",
+                    local_llm_address="127.0.0.1:1234",
+                )
+            )
+
+        assert response == ("This is a test response", 10, 5, 15)
+        assert mock_cls.call_args.kwargs["base_url"] == "http://127.0.0.1:1234/v1"
+        mock_client.chat.completions.create.assert_awaited_once_with(
+            model="llama3",
+            messages=messages,
+            temperature=0,
+            n=1,
+            seed=0,
+            timeout=30,
+            response_format={"type": "json_object"},
+        )
+
+    def test_arequest_to_chat_ai_unknown_provider(self):
+        """arequest_to_chat_ai: 未知のプロバイダーはValueErrorになる"""
+        with pytest.raises(ValueError):
+            asyncio.run(arequest_to_chat_ai(messages=[], provider="unknown"))
+
+    def test_scheduler_map_limits_concurrency(self):
+        """LLMScheduler.map: max_concurrencyを超えて同時実行せず、入力順に結果を返す"""
+        scheduler = LLMScheduler(max_concurrency=100)
+        lock = threading.Lock()
+        state = {"running": 0, "peak": 0}
+
+        async def fake_request(value):
+            with lock:
+                state["running"] += 1
+                state["peak"] = max(state["peak"], state["running"])
+            await asyncio.sleep(0.01)
+            with lock:
+                state["running"] -= 1
+            return value * 2
+
+        completed = []
+        results = scheduler.map(
+            fake_request,
+            [{"value": i} for i in range(20)],
+            max_concurrency=3,
+            on_result=lambda i, _result: completed.append(i),
+        )
+
+        assert results == [i * 2 for i in range(20)]
+        assert state["peak"] == 3
+        assert sorted(completed) == list(range(20))
+
+    def test_run_chat_requests_returns_exceptions(self):
+        """run_chat_requests: 失敗したリクエストは例外オブジェクトとして返す"""
+
+        async def fake_arequest_to_chat_ai(messages, **kwargs):
+            if messages == "fail":
+                raise RuntimeError("failed")
+            await asyncio.sleep(0)
+            return messages, 1, 1, 2
+
+        with patch("broadlistening.pipeline.services.llm.arequest_to_chat_ai", side_effect=fake_arequest_to_chat_ai):
+            started = time.monotonic()
+            results = run_chat_requests(
+                [{"messages": "ok"}, {"messages": "fail"}, {"messages": "ok2"}], max_concurrency=2
+            )
+
+        assert time.monotonic() - started < 5
+        assert results[0] == ("ok", 1, 1, 2)
+        assert isinstance(results[1], RuntimeError)
+        assert results[2] == ("ok2", 1, 1, 2)
+
+    def test_estimate_tokens(self):
+        """estimate_tokens: 非ASCII文字は1文字1トークン、ASCII文字は4文字1トークンとして見積もる"""
+        assert estimate_tokens("") == 0
+        assert estimate_tokens("abcd") == 1
+        assert estimate_tokens("abcde") == 2
+        assert estimate_tokens("日本語") == 3
+        assert estimate_tokens("日本語abcd") == 4
+
+    def test_pool_timeout_is_not_overload(self):
+        """_is_overload_error: 接続プールの空き待ちによるタイムアウトは過負荷とみなさず、通常のタイムアウトは過負荷とみなす"""
+        request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+        pool_timeout = openai.APITimeoutError(request=request)
+        pool_timeout.__cause__ = httpx.PoolTimeout("pool is full")
+        read_timeout = openai.APITimeoutError(request=request)
+        read_timeout.__cause__ = httpx.ReadTimeout("read timed out")
+
+        assert _is_overload_error(pool_timeout) is False
+        assert _is_overload_error(read_timeout) is True
@@ -0,0 +1,79 @@
+import os
+from unittest.mock import patch
+
+import pytest
+from broadlistening.pipeline.services.llm import request_to_chat_ai
+from broadlistening.pipeline.services.llm_cache import (
+    LLMResponseCache,
+    configure_response_cache,
+    make_cache_key,
+)
+from pydantic import BaseModel, Field
+
+
+class CalendarEvent(BaseModel):
+    name: str = Field(..., description="イベント名")
+
+
+class TestLLMResponseCache:
+    """LLMレスポンスキャッシュのテスト"""
+
+    @pytest.fixture(autouse=True)
+    def disable_cache_after_test(self):
+        yield
+        configure_response_cache(enabled=False)
+
+    def test_make_cache_key_depends_on_request(self):
+        """make_cache_key: リクエスト内容が異なればキーも異なる"""
+        messages = [{"role": "user", "content": "hello"}]
+        key = make_cache_key("openai", "gpt-4o", messages)
+
+        assert key == make_cache_key("openai", "gpt-4o", [{"content": "hello", "role": "user"}])
+        assert key != make_cache_key("openai", "gpt-4o-mini", messages)
+        assert key != make_cache_key("azure", "gpt-4o", messages)
+        assert key != make_cache_key("openai", "gpt-4o", messages, json_schema=CalendarEvent)
+        assert key != make_cache_key("openai", "gpt-4o", messages, is_json=True)
+
+    def test_get_and_set(self, tmp_path):
+        """get/set: 保存したレスポンスを取得でき、ヒット・ミス数を記録する"""
+        cache = LLMResponseCache(str(tmp_path))
+
+        assert cache.get("a" * 64) is None
+        cache.set("a" * 64, {"label": "ラベル"})
+
+        assert cache.get("a" * 64) == {"label": "ラベル"}
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["writes"] == 1
+
+    def test_evicts_least_recently_used(self, tmp_path):
+        """set: 合計サイズが上限を超えたら、最終アクセスが古いエントリから削除する"""
+        cache = LLMResponseCache(str(tmp_path), max_bytes=350)
+        keys = [c * 64 for c in "abc"]
+        for i, key in enumerate(keys):
+            cache.set(key, "x" * 80)
+            os.utime(cache._path(key), (1000 + i, 1000 + i))
+        # aを参照して最近使ったエントリにする
+        assert cache.get(keys[0]) is not None
+
+        cache.set("d" * 64, "x" * 80)
+
+        assert cache.get(keys[0]) is not None
+        assert cache.get(keys[1]) is None
+        assert cache.stats()["evictions"] >= 1
+
+    def test_request_to_chat_ai_uses_cache(self, tmp_path):
+        """request_to_chat_ai: 同一リクエストの2回目はキャッシュを返し、APIを呼ばない"""
+        configure_response_cache(enabled=True, cache_dir=str(tmp_path))
+        messages = [{"role": "user", "content": "hello"}]
+
+        with patch(
+            "broadlistening.pipeline.services.llm.request_to_openai", return_value=("response", 10, 5, 15)
+        ) as mock_request:
+            first = request_to_chat_ai(messages=messages, model="gpt-4o")
+            second = request_to_chat_ai(messages=messages, model="gpt-4o")
+
+        assert first == ("response", 10, 5, 15)
+        assert second == ("response", 0, 0, 0)
+        mock_request.assert_called_once()
@@ -0,0 +1,77 @@
+import numpy as np
+from broadlistening.pipeline.services.local_embedding import LocalEmbeddingEngine, get_local_embedding_engine
+
+
+class FakeSentenceTransformer:
+    """文字数を1次元目、呼び出し内での位置を2次元目に持つベクトルを返すモデル"""
+
+    def __init__(self):
+        self.calls = []
+
+    def encode(
+        self, sentences, batch_size=32, show_progress_bar=False, convert_to_numpy=True, normalize_embeddings=False
+    ):
+        self.calls.append(list(sentences))
+        embeddings = np.array([[len(s), i] for i, s in enumerate(sentences)], dtype=np.float64)
+        if normalize_embeddings:
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings
+
+
+class TestLocalEmbeddingEngine:
+    """ローカル埋め込みエンジンのテスト"""
+
+    def _engine(self):
+        engine = LocalEmbeddingEngine()
+        engine._model = FakeSentenceTransformer()
+        return engine
+
+    def test_encode_sorts_by_length_and_restores_order(self):
+        """encode: 長い順に並べ替えて計算し、結果は入力と同じ順序のfloat32行列で返す"""
+        engine = self._engine()
+        texts = ["aa", "aaaa", "a", "aaa"]
+
+        embeddings = engine.encode(texts, batch_size=2)
+
+        assert engine._model.calls == [["aaaa", "aaa", "aa", "a"]]
+        assert embeddings.dtype == np.float32
+        np.testing.assert_array_equal(embeddings[:, 0], [2, 4, 1, 3])
+
+    def test_encode_normalize(self):
+        """encode: normalize=Trueの場合は各ベクトルのノルムが1になる"""
+        embeddings = self._engine().encode(["abc", "de"], normalize=True)
+
+        np.testing.assert_allclose(np.linalg.norm(embeddings, axis=1), [1.0, 1.0], rtol=1e-6)
+
+    def test_encode_empty(self):
+        """encode: 空の入力ではモデルを呼ばずに空の行列を返す"""
+        engine = self._engine()
+
+        embeddings = engine.encode([])
+
+        assert embeddings.shape[0] == 0
+        assert engine._model.calls == []
+
+    def test_device_is_left_to_sentence_transformers_by_default(self, monkeypatch):
+        """model: deviceを指定しない場合はsentence-transformersにデバイスの選択を任せ、指定した場合はそれを渡す"""
+        created = []
+
+        class RecordingSentenceTransformer:
+            def __init__(self, model_name, device=None):
+                created.append(device)
+
+        monkeypatch.setattr("sentence_transformers.SentenceTransformer", RecordingSentenceTransformer)
+
+        default_model = LocalEmbeddingEngine().model
+        cuda_model = LocalEmbeddingEngine(device="cuda").model
+
+        assert isinstance(default_model, RecordingSentenceTransformer)
+        assert isinstance(cuda_model, RecordingSentenceTransformer)
+        assert created == [None, "cuda"]
+
+
+def test_get_local_embedding_engine_shares_engine_per_device():
+    """get_local_embedding_engine: 同じデバイスでは同じエンジンを返し、デバイスごとに別のエンジンを作る"""
+    assert get_local_embedding_engine() is get_local_embedding_engine()
+    assert get_local_embedding_engine("cpu") is not get_local_embedding_engine()
+    assert get_local_embedding_engine("cpu").device == "cpu"
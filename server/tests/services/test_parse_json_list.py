@@ -1,4 +1,7 @@
-from broadlistening.pipeline.services.parse_json_list import parse_extraction_response
+from broadlistening.pipeline.services.parse_json_list import (
+    parse_extraction_response,
+    parse_packed_extraction_response,
+)
 
 
 class TestParseJsonList:
@@ -38,3 +41,28 @@ class TestParseJsonList:
         response = '{"extractedOpinionList": null}'
         result = parse_extraction_response(response)
         assert result == []  # 実際の実装ではNoneが返されるかもしれないが、空リストを期待
+
+    def test_parse_packed_extraction_response_valid(self):
+        """parse_packed_extraction_response: コメントIDごとの意見のリストを返す"""
+        response = (
+            '{"results": [{"commentId": "0", "extractedOpinionList": ["テスト1"]}, '
+            '{"commentId": "1", "extractedOpinionList": ["テスト2", "テスト3"]}]}'
+        )
+        result = parse_packed_extraction_response(response)
+        assert result == {"0": ["テスト1"], "1": ["テスト2", "テスト3"]}
+
+    def test_parse_packed_extraction_response_skips_invalid_items(self):
+        """parse_packed_extraction_response: 形式が正しくない要素は結果に含めない"""
+        response = {
+            "results": [
+                {"commentId": 0, "extractedOpinionList": ["テスト1"]},
+                {"commentId": "1", "extractedOpinionList": None},
+                {"extractedOpinionList": ["テスト2"]},
+            ]
+        }
+        result = parse_packed_extraction_response(response)
+        assert result == {"0": ["テスト1"]}
+
+    def test_parse_packed_extraction_response_invalid_json(self):
+        """parse_packed_extraction_response: 無効なJSONの場合は空の辞書を返す"""
+        assert parse_packed_extraction_response('{"results": [') == {}
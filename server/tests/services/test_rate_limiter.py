@@ -0,0 +1,64 @@
+from unittest.mock import patch
+
+import pytest
+from broadlistening.pipeline.services.llm import request_to_chat_ai
+from broadlistening.pipeline.services.rate_limiter import (
+    RateLimiter,
+    TokenBucket,
+    configure_rate_limits,
+    get_rate_limiter,
+)
+
+
+class TestRateLimiter:
+    """レート制限のテスト"""
+
+    @pytest.fixture(autouse=True)
+    def clear_rate_limits(self):
+        yield
+        configure_rate_limits(None)
+
+    def test_token_bucket_wait(self):
+        """TokenBucket.reserve: 残量を超えた分だけ、補充されるまでの待ち時間を返す"""
+        bucket = TokenBucket(60)  # 1秒に1ずつ補充
+
+        assert bucket.reserve(60, now=bucket.updated) == 0
+        assert bucket.reserve(2, now=bucket.updated) == pytest.approx(2.0)
+        # 4秒後には2回分の不足を補って2だけ残っている
+        assert bucket.reserve(2, now=bucket.updated + 4) == 0
+
+    def test_record_usage_adjusts_tokens(self):
+        """record_usage: 実際の使用量が推定より多い場合、その分だけ次のリクエストを待たせる"""
+        limiter = RateLimiter(tpm=600)  # 1秒に10トークン補充
+        with patch("broadlistening.pipeline.services.rate_limiter.time.monotonic", return_value=100.0):
+            limiter._tokens.updated = 100.0
+            assert limiter._reserve(500) == 0
+            limiter.record_usage(estimated_tokens=500, actual_tokens=600)
+            assert limiter._reserve(100) == pytest.approx(10.0)
+
+        assert limiter.stats()["throttled"] == 1
+
+    def test_get_rate_limiter(self):
+        """get_rate_limiter: 設定したprovider:modelにだけ共有のRateLimiterを返す"""
+        configure_rate_limits('{"openai:gpt-4o": {"rpm": 10}, "local:*": {"tpm": 1000}}')
+
+        limiter = get_rate_limiter("openai", "gpt-4o")
+        assert limiter is get_rate_limiter("openai", "gpt-4o")
+        assert limiter.rpm == 10
+        assert get_rate_limiter("local", "llama3").tpm == 1000
+        assert get_rate_limiter("openai", "gpt-4o-mini") is None
+
+    def test_request_to_chat_ai_uses_limiter(self):
+        """request_to_chat_ai: 送信前に推定トークン数で予約し、受信後に実際の使用量を反映する"""
+        configure_rate_limits({"openai:gpt-4o": {"rpm": 100, "tpm": 10000}})
+        limiter = get_rate_limiter("openai", "gpt-4o")
+
+        with (
+            patch("broadlistening.pipeline.services.llm.request_to_openai", return_value=("response", 10, 5, 15)),
+            patch.object(limiter, "acquire") as mock_acquire,
+            patch.object(limiter, "record_usage") as mock_record,
+        ):
+            request_to_chat_ai(messages=[{"role": "user", "content": "こんにちは"}], model="gpt-4o")
+
+        mock_acquire.assert_called_once_with(5)
+        mock_record.assert_called_once_with(5, 15)
@@ -0,0 +1,33 @@
+import pytest
+from broadlistening.pipeline.services.text_dedup import find_duplicates, normalize_text
+
+
+class TestTextDedup:
+    """コメント本文の重複判定のテスト"""
+
+    def test_normalize_text(self):
+        """normalize_text: 全角英数字・連続する空白・前後の空白の違いを吸収する"""
+        assert normalize_text("  ＡＢＣ　 です\n") == normalize_text("ABC です")
+
+    def test_exact_duplicates(self):
+        """find_duplicates: 正規化後に一致するテキストは最初に出現したテキストを代表にする"""
+        texts = ["賛成です", "反対です", " 賛成です ", "賛成です。", "反対です"]
+
+        assert find_duplicates(texts) == [0, 1, 0, 3, 1]
+
+    def test_none_mode(self):
+        """find_duplicates: mode="none"の場合は重複判定をしない"""
+        assert find_duplicates(["a", "a"], mode="none") == [0, 1]
+
+    def test_near_duplicates(self):
+        """find_duplicates: mode="near"の場合は、ほぼ同じテキストも同じグループにまとめる"""
+        base = "この計画には反対です。住民への説明が不十分であり、環境への影響も十分に検討されていないと考えます。"
+        texts = [base, base + "!", "公園の整備を早く進めてほしいです。子どもが安全に遊べる場所が足りません。"]
+
+        assert find_duplicates(texts, mode="exact") == [0, 1, 2]
+        assert find_duplicates(texts, mode="near", threshold=0.8) == [0, 0, 2]
+
+    def test_unknown_mode(self):
+        """find_duplicates: 不明なmodeはエラーになる"""
+        with pytest.raises(ValueError):
+            find_duplicates(["a"], mode="fuzzy")